@@ -0,0 +1,149 @@
+#    Prana RC
+#    Copyright (C) 2020 Dmitry Berezovsky
+#
+#    prana is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    prana is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import time
+from typing import Dict, List, Mapping, NamedTuple, Optional, Sequence, Union
+
+import bleak.exc
+
+__all__ = ("AdapterPool", "AdapterStatus", "is_adapter_error", "parse_adapters")
+
+# D-Bus errors BlueZ reports when the adapter itself is unusable rather than the remote device
+ADAPTER_DBUS_ERRORS = frozenset(
+    (
+        "org.bluez.Error.NotReady",  # Adapter is powered off
+        "org.freedesktop.DBus.Error.UnknownObject",  # Adapter is gone
+        "org.freedesktop.DBus.Error.NoReply",  # Bluetooth daemon doesn't respond
+        "org.freedesktop.DBus.Error.ServiceUnknown",  # Bluetooth daemon is not running
+    )
+)
+
+
+def parse_adapters(iface: Union[str, Sequence[str]]) -> List[str]:
+    """
+    Normalizes adapters specification. Accepts either a single interface name, comma separated list of names
+    or a sequence of names.
+    """
+    names = iface.split(",") if isinstance(iface, str) else list(iface)
+    adapters = []
+    for name in (x.strip() for x in names):
+        if name and name not in adapters:
+            adapters.append(name)
+    if len(adapters) == 0:
+        raise ValueError("At least one bluetooth interface must be specified")
+    return adapters
+
+
+def is_adapter_error(error: BaseException) -> bool:
+    """
+    Tells whether operation failed because of the bluetooth adapter. Device which is out of range or powered off
+    (timeouts, device not found) is not an adapter failure.
+    """
+    not_available_error = getattr(bleak.exc, "BleakBluetoothNotAvailableError", None)
+    if not_available_error is not None and isinstance(error, not_available_error):
+        return True
+    if isinstance(error, bleak.exc.BleakDBusError):
+        return getattr(error, "dbus_error", None) in ADAPTER_DBUS_ERRORS
+    if isinstance(error, bleak.exc.BleakError):
+        return "adapter" in str(error).lower()
+    return False
+
+
+class AdapterStatus(NamedTuple):
+    iface: str
+    available: bool
+    consecutive_failures: int
+    retry_in: Optional[float]
+
+
+class AdapterPool(object):
+    """
+    Keeps track of the bluetooth adapters: which devices each of them can reach and whether adapter responds.
+    Adapter which failed FAILURE_THRESHOLD operations in a row with adapter errors (see is_adapter_error) or failed
+    discoveries is considered unresponsive and is not used for COOLDOWN seconds unless there is no other choice.
+    """
+
+    def __init__(self, adapters: Sequence[str], failure_threshold: int = 3, cooldown: float = 30) -> None:
+        self.__adapters = list(adapters)
+        self.__failure_threshold = failure_threshold
+        self.__cooldown = cooldown
+        self.__consecutive_failures: Dict[str, int] = {x: 0 for x in self.__adapters}
+        self.__down_since: Dict[str, float] = {}
+        # Signal strength of the device as seen by each adapter during the last discovery
+        self.__reachability: Dict[str, Dict[str, int]] = {}
+
+    @property
+    def adapters(self) -> List[str]:
+        return list(self.__adapters)
+
+    def record_discovery(self, iface: str, rssi_by_address: Mapping[str, int]):
+        """
+        Replaces reachability info of the adapter with the discovery results
+        :param iface: adapter discovery was running on
+        :param rssi_by_address: signal strength of each discovered device
+        """
+        for seen_by in self.__reachability.values():
+            seen_by.pop(iface, None)
+        for address, rssi in rssi_by_address.items():
+            self.__reachability.setdefault(address, {})[iface] = rssi
+
+    def is_available(self, iface: str) -> bool:
+        down_since = self.__down_since.get(iface)
+        return down_since is None or time.monotonic() - down_since >= self.__cooldown
+
+    def choose(self, address: str, load: Mapping[str, int]) -> str:
+        """
+        Picks adapter for the device: the least loaded one among available adapters which can reach the device.
+        Stronger signal wins among equally loaded adapters.
+        :param address: device mac address
+        :param load: number of devices currently served by each adapter
+        """
+        seen_by = self.__reachability.get(address, {})
+        candidates = [x for x in self.__adapters if x in seen_by] or self.__adapters
+        available = [x for x in candidates if self.is_available(x)]
+        if len(available) == 0:
+            # Everything is down, the adapter which failed first is the most likely one to be back
+            return min(candidates, key=lambda x: self.__down_since.get(x, 0))
+        return min(available, key=lambda x: (load.get(x, 0), -seen_by.get(x, -1000)))
+
+    def record_success(self, iface: str):
+        self.__consecutive_failures[iface] = 0
+        self.__down_since.pop(iface, None)
+
+    def record_failure(self, iface: str):
+        failures = self.__consecutive_failures.get(iface, 0) + 1
+        self.__consecutive_failures[iface] = failures
+        if failures >= self.__failure_threshold:
+            self.__down_since[iface] = time.monotonic()
+
+    def status(self) -> List[AdapterStatus]:
+        result = []
+        for iface in self.__adapters:
+            available = self.is_available(iface)
+            down_since = self.__down_since.get(iface)
+            result.append(
+                AdapterStatus(
+                    iface=iface,
+                    available=available,
+                    consecutive_failures=self.__consecutive_failures.get(iface, 0),
+                    retry_in=(
+                        None
+                        if available or down_since is None
+                        else max(0.0, down_since + self.__cooldown - time.monotonic())
+                    ),
+                )
+            )
+        return result
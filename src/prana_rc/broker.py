@@ -0,0 +1,143 @@
+#    Prana RC
+#    Copyright (C) 2020 Dmitry Berezovsky
+#
+#    prana is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    prana is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+from collections import OrderedDict
+from typing import Collection, List, Optional, Tuple
+
+from prana_rc.entity import PranaState
+
+__all__ = ("Mailbox", "StateBroker", "StateBrokerStats")
+
+
+class StateBrokerStats(object):
+    def __init__(self) -> None:
+        # States received from the devices
+        self.published = 0
+        # States replaced in the mailbox by the newer state of the same device before consumer fetched them
+        self.conflated = 0
+        # States dropped because mailbox was full
+        self.dropped = 0
+
+    def to_dict(self) -> dict:
+        return dict(published=self.published, conflated=self.conflated, dropped=self.dropped)
+
+
+class Mailbox(object):
+    """
+    Bounded mailbox of a single consumer. Keeps only the latest undelivered state of each device, so consumer
+    which lags behind receives the most recent state rather than the whole history. If states of more than CAPACITY
+    devices are pending the oldest one is dropped.
+    """
+
+    def __init__(
+        self, capacity: int, addresses: Optional[Collection[str]] = None, stats: Optional[StateBrokerStats] = None
+    ) -> None:
+        """
+        :param capacity: maximum number of pending states
+        :param addresses: devices to accept states of, all devices if not set
+        :param stats: shared counters to account conflated and dropped states in
+        """
+        if capacity < 1:
+            raise ValueError("capacity must be at least 1")
+        self.__capacity = capacity
+        self.__addresses = None if addresses is None else frozenset(addresses)
+        self.__stats = stats or StateBrokerStats()
+        self.__pending: "OrderedDict[str, PranaState]" = OrderedDict()
+        self.__not_empty = asyncio.Event()
+        self.conflated = 0
+        self.dropped = 0
+
+    def __len__(self) -> int:
+        return len(self.__pending)
+
+    def put(self, address: str, state: PranaState):
+        """
+        Never blocks
+        """
+        if self.__addresses is not None and address not in self.__addresses:
+            return
+        if address in self.__pending:
+            self.conflated += 1
+            self.__stats.conflated += 1
+            del self.__pending[address]
+        elif len(self.__pending) >= self.__capacity:
+            self.__pending.popitem(last=False)
+            self.dropped += 1
+            self.__stats.dropped += 1
+        self.__pending[address] = state
+        self.__not_empty.set()
+
+    def drain(self) -> List[Tuple[str, PranaState]]:
+        """
+        Removes and returns all pending states, the oldest first
+        """
+        pending = list(self.__pending.items())
+        self.__pending.clear()
+        self.__not_empty.clear()
+        return pending
+
+    async def wait(self, timeout: float) -> bool:
+        """
+        Waits up to TIMEOUT seconds for the mailbox to become non-empty
+        :return: True if there are pending states
+        """
+        try:
+            await asyncio.wait_for(self.__not_empty.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+
+class StateBroker(object):
+    """
+    Fans device states out to the consumers. Each consumer has its own bounded mailbox and publishing never waits
+    for consumers, so a slow consumer neither delays the others nor makes memory grow.
+    """
+
+    def __init__(self, mailbox_capacity: int = 64) -> None:
+        """
+        :param mailbox_capacity: default number of devices whose states are kept pending for each consumer
+        """
+        self.__mailbox_capacity = mailbox_capacity
+        self.__mailboxes: List[Mailbox] = []
+        self.__stats = StateBrokerStats()
+
+    @property
+    def stats(self) -> StateBrokerStats:
+        return self.__stats
+
+    @property
+    def subscribers(self) -> int:
+        return len(self.__mailboxes)
+
+    def subscribe(self, addresses: Optional[Collection[str]] = None, capacity: Optional[int] = None) -> Mailbox:
+        """
+        :param addresses: devices to receive states of, all devices if not set
+        :param capacity: mailbox capacity, broker default is used if not set
+        """
+        mailbox = Mailbox(capacity or self.__mailbox_capacity, addresses, self.__stats)
+        self.__mailboxes.append(mailbox)
+        return mailbox
+
+    def unsubscribe(self, mailbox: Mailbox):
+        if mailbox in self.__mailboxes:
+            self.__mailboxes.remove(mailbox)
+
+    def publish(self, address: str, state: PranaState):
+        self.__stats.published += 1
+        for mailbox in self.__mailboxes:
+            mailbox.put(address, state)
@@ -24,6 +24,7 @@ from enum import Enum
 from typing import Optional
 
 from prana_rc.entity import Speed, PranaState
+from prana_rc.retry import CircuitOpenError
 from prana_rc.service import PranaDeviceManager
 
 
@@ -112,12 +113,15 @@ class CliExtension(object):
             except CancelledError as e:
                 CLI.print_info("Connect to device routine interrupted")
                 raise e
+            except CircuitOpenError:
+                # Device keeps failing, no reason to continue
+                raise
             except Exception as e:
                 attempts_left -= 1
-                attempt_number += 1
                 CLI.print_error(e)
+                await asyncio.sleep(self.device_manager.retry_policy.delay(attempt_number))
+                attempt_number += 1
                 CLI.print_info("Reconnecting... Attempt #{}".format(attempt_number))
-                await asyncio.sleep(1)
         raise RuntimeError("Unable to connect after {} attempts".format(attempt_number - 1))
 
     @property
@@ -153,7 +157,7 @@ def register_global_arguments(parser: argparse.ArgumentParser):
         action="store",
         required=False,
         type=str,
-        help="Bluetooth interface to be used",
+        help="Bluetooth interface to be used. Comma separated list spreads devices across several adapters",
         default="hci0",
     )
     parser.add_argument(
@@ -0,0 +1,285 @@
+#    Prana RC
+#    Copyright (C) 2020 Dmitry Berezovsky
+#
+#    prana is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    prana is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import logging
+import time
+from collections import deque
+from enum import IntEnum
+from typing import Awaitable, Callable, Deque, Dict, List, Optional
+
+from prana_rc.rate_limit import RateLimiter, RateLimitExceededError, RateLimitPolicy
+
+__all__ = (
+    "CommandQueue",
+    "CommandWriter",
+    "CommandPriority",
+    "CommandQueueStats",
+    "QueueClosedError",
+    "CommandDroppedError",
+)
+
+CommandWriter = Callable[[bytearray, bool], Awaitable[Optional[bytearray]]]
+
+
+class QueueClosedError(RuntimeError):
+    pass
+
+
+class CommandDroppedError(RuntimeError):
+    pass
+
+
+class CommandPriority(IntEnum):
+    INTERACTIVE = 0  # Triggered by user, sent before any queued background command
+    BACKGROUND = 1  # Polling and keepalive, dropped when the queue is saturated
+
+
+class _PriorityStats(object):
+    def __init__(self) -> None:
+        # Commands waiting in queues right now
+        self.depth = 0
+        self.sent = 0
+        self.dropped = 0
+        # Time in seconds commands spent in the queue before being written
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def to_dict(self) -> dict:
+        return dict(
+            depth=self.depth,
+            sent=self.sent,
+            dropped=self.dropped,
+            avg_wait=self.total_wait / self.sent if self.sent > 0 else 0.0,
+            max_wait=self.max_wait,
+        )
+
+
+class CommandQueueStats(object):
+    """
+    Per priority counters. A single instance might be shared by queues of several devices.
+    """
+
+    def __init__(self) -> None:
+        self.__by_priority = {x: _PriorityStats() for x in CommandPriority}
+
+    def __getitem__(self, priority: CommandPriority) -> _PriorityStats:
+        return self.__by_priority[priority]
+
+    def to_dict(self) -> Dict[str, dict]:
+        return {priority.name.lower(): stats.to_dict() for priority, stats in self.__by_priority.items()}
+
+
+class _QueuedCommand(object):
+    def __init__(
+        self, command: bytearray, expect_reply: bool, priority: CommandPriority, future: asyncio.Future
+    ) -> None:
+        self.command = command
+        self.expect_reply = expect_reply
+        self.priority = priority
+        self.future = future
+        self.enqueued_at = time.monotonic()
+        self.batch: Optional[List[asyncio.Future]] = None
+        # Set if rate limiter budget was already reserved for the command
+        self.budget_reserved = False
+
+
+class CommandQueue(object):
+    """
+    Serializes commands sent to a single device.
+    Commands are written one by one by a background worker. Write-without-response commands are sent back-to-back
+    separated by INTER_FRAME_GAP only, commands which expect reply block the queue until reply is received.
+    Interactive commands are sent before all the queued background ones, background commands are dropped once
+    SATURATION_DEPTH commands are waiting. Optional RATE_LIMITER either delays or rejects writes exceeding
+    device budget.
+    """
+
+    def __init__(
+        self,
+        writer: CommandWriter,
+        inter_frame_gap: float = 0.0,
+        saturation_depth: int = 8,
+        stats: Optional[CommandQueueStats] = None,
+        rate_limiter: Optional[RateLimiter] = None,
+    ) -> None:
+        self.__writer = writer
+        self.__rate_limiter = rate_limiter
+        self.__inter_frame_gap = inter_frame_gap
+        self.__saturation_depth = saturation_depth
+        self.__stats = stats or CommandQueueStats()
+        self.__pending: Dict[CommandPriority, Deque[_QueuedCommand]] = {x: deque() for x in CommandPriority}
+        self.__has_items = asyncio.Event()
+        self.__worker: Optional[asyncio.Task] = None
+        self.__last_write_at = 0.0
+        self.__logger = logging.getLogger(self.__class__.__name__)
+
+    def submit(
+        self, command: bytearray, expect_reply=False, priority: CommandPriority = CommandPriority.INTERACTIVE
+    ) -> "asyncio.Future[Optional[bytearray]]":
+        """
+        Enqueue command for sending.
+        :param command: command bytes
+        :param expect_reply: if set, the future will be resolved with the reply payload
+        :param priority: background commands fail with CommandDroppedError if the queue is saturated
+        :return: future which is resolved once command is sent (or reply received)
+        """
+        if self.__is_saturated_for(priority, 1):
+            return self.__dropped(priority)
+        item = self.__enqueue(command, expect_reply, priority)
+        self.__wakeup()
+        return item.future
+
+    def submit_many(
+        self, commands: List[bytearray], priority: CommandPriority = CommandPriority.INTERACTIVE
+    ) -> List["asyncio.Future[Optional[bytearray]]"]:
+        """
+        Enqueue a sequence of write-without-response commands. Commands are sent in the given order, in case one of
+        them fails the rest of the sequence is cancelled. With REJECT rate limit policy budget is reserved for the
+        whole sequence up front, so it is either rejected entirely or not rejected at all.
+        :param commands: list of commands
+        :param priority: priority of the whole sequence, background sequence is either queued or dropped entirely
+        :return: list of futures, one per command
+        """
+        if self.__is_saturated_for(priority, len(commands)):
+            return [self.__dropped(priority) for _ in commands]
+        reserve_budget = False
+        if self.__rate_limiter is not None and self.__rate_limiter.policy == RateLimitPolicy.REJECT:
+            if not self.__rate_limiter.try_acquire(len(commands)):
+                return [self.__rejected() for _ in commands]
+            reserve_budget = True
+        items = [self.__enqueue(command, False, priority) for command in commands]
+        batch = [x.future for x in items]
+        for item in items:
+            item.batch = batch
+            item.budget_reserved = reserve_budget
+        self.__wakeup()
+        return batch
+
+    def __is_saturated_for(self, priority: CommandPriority, count: int) -> bool:
+        return priority == CommandPriority.BACKGROUND and self.depth + count > self.__saturation_depth
+
+    def __dropped(self, priority: CommandPriority) -> asyncio.Future:
+        self.__stats[priority].dropped += 1
+        future = asyncio.get_event_loop().create_future()
+        future.set_exception(CommandDroppedError("Command queue is saturated, background command dropped"))
+        return future
+
+    @staticmethod
+    def __rejected() -> asyncio.Future:
+        future = asyncio.get_event_loop().create_future()
+        future.set_exception(RateLimitExceededError("Device write budget exhausted, command rejected"))
+        return future
+
+    def __enqueue(self, command: bytearray, expect_reply: bool, priority: CommandPriority) -> _QueuedCommand:
+        item = _QueuedCommand(command, expect_reply, priority, asyncio.get_event_loop().create_future())
+        self.__pending[priority].append(item)
+        self.__stats[priority].depth += 1
+        return item
+
+    def __next_item(self) -> Optional[_QueuedCommand]:
+        for priority in CommandPriority:
+            if self.__pending[priority]:
+                self.__stats[priority].depth -= 1
+                return self.__pending[priority].popleft()
+        return None
+
+    def __wakeup(self):
+        self.__has_items.set()
+        if self.__worker is None or self.__worker.done():
+            self.__worker = asyncio.ensure_future(self.__run())
+
+    @property
+    def depth(self) -> int:
+        return sum(len(x) for x in self.__pending.values())
+
+    def depth_of(self, priority: CommandPriority) -> int:
+        return len(self.__pending[priority])
+
+    @property
+    def stats(self) -> CommandQueueStats:
+        return self.__stats
+
+    async def close(self):
+        """
+        Stops the worker. All commands which are not sent yet will fail with QueueClosedError.
+        """
+        if self.__worker is not None and not self.__worker.done():
+            self.__worker.cancel()
+            try:
+                await self.__worker
+            except asyncio.CancelledError:
+                pass
+        self.__worker = None
+        while True:
+            item = self.__next_item()
+            if item is None:
+                break
+            if not item.future.done():
+                item.future.set_exception(QueueClosedError("Command queue closed before command was sent"))
+
+    async def __run(self):
+        while True:
+            if self.depth == 0:
+                self.__has_items.clear()
+                await self.__has_items.wait()
+                continue
+            # Command is picked after the delays so that interactive command submitted meanwhile goes first
+            await self.__respect_gap()
+            if self.__rate_limiter is not None:
+                await self.__rate_limiter.wait()
+            item = self.__next_item()
+            if item is None or item.future.done():  # Cancelled by the caller or by the failed batch
+                continue
+            if self.__rate_limiter is not None and not item.budget_reserved and not self.__rate_limiter.try_acquire():
+                self.__fail(item, RateLimitExceededError("Device write budget exhausted, command rejected"))
+                continue
+            self.__account_wait(item)
+            try:
+                result = await self.__writer(item.command, item.expect_reply)
+            except asyncio.CancelledError:
+                item.future.cancel()
+                raise
+            except Exception as e:
+                self.__logger.debug("Command {} failed: {}".format(item.command.hex(), e))
+                self.__fail(item, e)
+            else:
+                if not item.future.done():
+                    item.future.set_result(result)
+            finally:
+                self.__last_write_at = time.monotonic()
+
+    @staticmethod
+    def __fail(item: _QueuedCommand, error: Exception):
+        if not item.future.done():
+            item.future.set_exception(error)
+        if item.batch is not None:
+            for f in item.batch:
+                if not f.done():
+                    f.cancel()
+
+    def __account_wait(self, item: _QueuedCommand):
+        stats = self.__stats[item.priority]
+        wait = time.monotonic() - item.enqueued_at
+        stats.sent += 1
+        stats.total_wait += wait
+        stats.max_wait = max(stats.max_wait, wait)
+
+    async def __respect_gap(self):
+        if self.__inter_frame_gap <= 0:
+            return
+        delay = self.__last_write_at + self.__inter_frame_gap - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
@@ -16,9 +16,9 @@
 
 import abc
 
-from typing import List
+from typing import List, Optional
 
-from prana_rc.contrib.api.dto import SetStateDTO, PranaDeviceInfoDTO, PranaStateDTO
+from prana_rc.contrib.api.dto import SetStateDTO, PranaDeviceInfoDTO, PranaStateDTO, PranaStatesDTO
 
 DEFAULT_TIMEOUT = 5
 DEFAULT_ATTEMPTS = 10
@@ -26,11 +26,27 @@ DEFAULT_ATTEMPTS = 10
 
 class PranaRCAsyncFacade(abc.ABC):
     @abc.abstractmethod
-    async def discover(self, timeout=DEFAULT_TIMEOUT) -> List[PranaDeviceInfoDTO]:
+    async def discover(self, timeout=DEFAULT_TIMEOUT, fresh: bool = False) -> List[PranaDeviceInfoDTO]:
         pass
 
     @abc.abstractmethod
-    async def get_state(self, address: str, timeout=DEFAULT_TIMEOUT, attempts=DEFAULT_ATTEMPTS) -> PranaStateDTO:
+    async def get_state(
+        self,
+        address: str,
+        timeout=DEFAULT_TIMEOUT,
+        attempts=DEFAULT_ATTEMPTS,
+        max_age: Optional[float] = None,
+        stale_while_revalidate: Optional[float] = None,
+    ) -> PranaStateDTO:
+        """
+        :param max_age: if set, the last received state not older than MAX_AGE seconds is returned without
+                        talking to the device
+        :param stale_while_revalidate: if set along with MAX_AGE, the last received state which is older than MAX_AGE
+                                       by no more than STALE_WHILE_REVALIDATE seconds is returned right away while
+                                       fresh state is read in background
+        If MAX_AGE is set and the only known state was persisted before server restart, it is returned flagged as
+        stale regardless of its age while fresh state is read in background.
+        """
         pass
 
     @abc.abstractmethod
@@ -42,3 +58,26 @@ class PranaRCAsyncFacade(abc.ABC):
         attempts=DEFAULT_ATTEMPTS,
     ) -> PranaStateDTO:
         pass
+
+    @abc.abstractmethod
+    async def get_states(
+        self, addresses: List[str], timeout=DEFAULT_TIMEOUT, attempts=DEFAULT_ATTEMPTS
+    ) -> PranaStatesDTO:
+        """
+        Reads state of the multiple devices at once. Failure of a single device doesn't fail the whole call,
+        error is reported in the result for this device instead.
+        """
+        pass
+
+    @abc.abstractmethod
+    async def set_states(
+        self,
+        addresses: List[str],
+        state: SetStateDTO,
+        timeout=DEFAULT_TIMEOUT,
+        attempts=DEFAULT_ATTEMPTS,
+    ) -> PranaStatesDTO:
+        """
+        Applies the same state to the multiple devices at once. Results are reported per device same as for get_states.
+        """
+        pass
@@ -0,0 +1,104 @@
+#    Prana RC
+#    Copyright (C) 2020 Dmitry Berezovsky
+#
+#    prana is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    prana is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import time
+from asyncio import Lock
+from typing import Awaitable, Callable, Dict, Generic, Optional, TypeVar
+
+from prana_rc.entity import PranaTargetState
+
+__all__ = ("StateIntentDebouncer",)
+
+_T = TypeVar("_T")
+
+StateApplier = Callable[[PranaTargetState], Awaitable[_T]]
+
+
+class _PendingIntent(Generic[_T]):
+    def __init__(self, target: PranaTargetState, apply: StateApplier, future: "asyncio.Future[_T]") -> None:
+        self.target = target
+        self.apply = apply
+        self.future = future
+        self.first_submitted_at = time.monotonic()
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+
+class StateIntentDebouncer(Generic[_T]):
+    """
+    Collects target states submitted for the same device within WINDOW seconds and applies them as one merged
+    target, later fields win. Every caller gets the result of the merged transition. Window is restarted by each
+    submit but intent is never delayed for more than MAX_DELAY seconds.
+    """
+
+    def __init__(self, window: float = 0.1, max_delay: float = 0.5) -> None:
+        self.__window = window
+        self.__max_delay = max(window, max_delay)
+        self.__pending: Dict[str, _PendingIntent[_T]] = {}
+        # Merged intents of the same device are applied one at a time
+        self.__apply_locks: Dict[str, Lock] = {}
+        # Number of merged intents which are being applied or wait for the lock, per device
+        self.__apply_users: Dict[str, int] = {}
+        self.superseded = 0
+
+    async def submit(self, key: str, target: PranaTargetState, apply: StateApplier) -> _T:
+        """
+        :param key: device address
+        :param target: desired state
+        :param apply: coroutine function which applies merged target. The one from the latest submit is used
+        :return: result of the merged transition
+        """
+        pending = self.__pending.get(key)
+        if pending is None:
+            pending = _PendingIntent(target, apply, asyncio.get_event_loop().create_future())
+            pending.future.add_done_callback(lambda f: f.cancelled() or f.exception())
+            self.__pending[key] = pending
+        else:
+            self.superseded += 1
+            pending.target = pending.target.updated_with(target)
+            pending.apply = apply
+            if pending.timer is not None:
+                pending.timer.cancel()
+        delay = min(self.__window, pending.first_submitted_at + self.__max_delay - time.monotonic())
+        pending.timer = asyncio.get_event_loop().call_later(max(0.0, delay), self.__flush, key)
+        return await asyncio.shield(pending.future)
+
+    def __flush(self, key: str):
+        pending = self.__pending.pop(key, None)
+        if pending is not None:
+            asyncio.ensure_future(self.__apply(key, pending))
+
+    async def __apply(self, key: str, pending: _PendingIntent[_T]):
+        lock = self.__apply_locks.get(key)
+        if lock is None:
+            lock = Lock()
+            self.__apply_locks[key] = lock
+        self.__apply_users[key] = self.__apply_users.get(key, 0) + 1
+        try:
+            async with lock:
+                result = await pending.apply(pending.target)
+        except Exception as e:
+            pending.future.set_exception(e)
+        else:
+            pending.future.set_result(result)
+        finally:
+            # Callers must not hang if applying was cancelled
+            if not pending.future.done():
+                pending.future.cancel()
+            self.__apply_users[key] -= 1
+            if self.__apply_users[key] == 0:
+                del self.__apply_users[key]
+                del self.__apply_locks[key]
@@ -17,9 +17,9 @@
 import datetime
 
 import pydantic
-from typing import Optional, List
+from typing import Any, Dict, Optional, List
 
-from prana_rc.entity import Speed, Mode
+from prana_rc.entity import Speed, Mode, StateLayout
 
 
 class SetStateDTO(pydantic.BaseModel):
@@ -62,9 +62,99 @@ class PranaStateDTO(pydantic.BaseModel):
     is_output_fan_on: Optional[bool] = None
     sensors: Optional[PranaSensorsStateDTO] = None
     timestamp: Optional[datetime.datetime] = None
+    # Time in seconds passed since the state was received from the device
+    age: Optional[float] = None
+    # Set if the state was persisted before server restart and wasn't confirmed by the device since then
+    stale: bool = False
+
+
+class DeviceStateResultDTO(pydantic.BaseModel):
+    address: str
+    state: Optional[PranaStateDTO] = None
+    # Set if operation failed for this particular device
+    error: Optional[str] = None
+
+
+class PranaStatesDTO(pydantic.BaseModel):
+    results: List[DeviceStateResultDTO] = []
+
+
+class SubscriptionDTO(pydantic.BaseModel):
+    subscription_id: str
+    # Subscription is removed if it isn't polled for this number of seconds
+    ttl: float
+
+
+class StateUpdateDTO(pydantic.BaseModel):
+    address: str
+    # Fields of PranaStateDTO changed since the previous update
+    changes: Dict[str, Any] = {}
+    timestamp: Optional[datetime.datetime] = None
+
+
+class StateUpdatesDTO(pydantic.BaseModel):
+    updates: List[StateUpdateDTO] = []
+
+
+class PranaDeviceDetailsDTO(pydantic.BaseModel):
+    address: str
+    firmware: str
+    state_layout: StateLayout
+
+
+class CircuitBreakerStatusDTO(pydantic.BaseModel):
+    address: str
+    state: str
+    consecutive_failures: int
+    retry_in: Optional[float] = None
+
+
+class BluetoothAdapterStatusDTO(pydantic.BaseModel):
+    iface: str
+    available: bool
+    consecutive_failures: int
+    retry_in: Optional[float] = None
+
+
+class CommandQueueStatsDTO(pydantic.BaseModel):
+    priority: str
+    depth: int
+    sent: int
+    dropped: int
+    avg_wait: float
+    max_wait: float
+
+
+class RateLimitStatsDTO(pydantic.BaseModel):
+    throttled: int
+    throttle_delay: float
+    rejected: int
+
+
+class ReplyRttDTO(pydantic.BaseModel):
+    address: str
+    srtt: Optional[float] = None
+    rttvar: Optional[float] = None
+    timeout: float
+    samples: int
+    timeouts: int
+
+
+class StateBrokerStatsDTO(pydantic.BaseModel):
+    subscribers: int
+    published: int
+    conflated: int
+    dropped: int
 
 
 class PranaHealthCheckResultDTO(pydantic.BaseModel):
     version: str
     timestamp: datetime.datetime
     current_connections: List[str]
+    devices_details: List[PranaDeviceDetailsDTO] = []
+    circuit_breakers: List[CircuitBreakerStatusDTO] = []
+    adapters: List[BluetoothAdapterStatusDTO] = []
+    command_queues: List[CommandQueueStatsDTO] = []
+    rate_limit: Optional[RateLimitStatsDTO] = None
+    reply_rtt: List[ReplyRttDTO] = []
+    state_broker: Optional[StateBrokerStatsDTO] = None
@@ -14,15 +14,16 @@
 #    You should have received a copy of the GNU General Public License
 #    along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import asyncio
 import datetime
-from asyncio import Lock
+import logging
 from asyncio.events import AbstractEventLoop
 
 from jsonrpc import Dispatcher
 from pydantic import validate_arguments
 from sizzlews.server.annotation import rpc_method
 from sizzlews.server.common import MethodDiscoveryMixin, SizzleWSHandler
-from typing import List, Optional
+from typing import Awaitable, Callable, Dict, List, Optional
 
 from prana_rc import utils, __version__
 from prana_rc.contrib.api import (
@@ -33,8 +34,28 @@ from prana_rc.contrib.api import (
     PranaStateDTO,
     PranaDeviceInfoDTO,
 )
-from prana_rc.contrib.api.dto import PranaHealthCheckResultDTO
-from prana_rc.entity import Mode, PranaDeviceInfo, PranaState
+from prana_rc.contrib.api.debounce import StateIntentDebouncer
+from prana_rc.contrib.api.subscription import StateSubscriptions, StateUpdate
+from prana_rc.contrib.api.dto import (
+    PranaHealthCheckResultDTO,
+    PranaDeviceDetailsDTO,
+    PranaSensorsStateDTO,
+    CircuitBreakerStatusDTO,
+    BluetoothAdapterStatusDTO,
+    CommandQueueStatsDTO,
+    RateLimitStatsDTO,
+    ReplyRttDTO,
+    DeviceStateResultDTO,
+    PranaStatesDTO,
+    SubscriptionDTO,
+    StateUpdateDTO,
+    StateUpdatesDTO,
+    StateBrokerStatsDTO,
+)
+from prana_rc.adapters import AdapterStatus
+from prana_rc.command_queue import CommandPriority, CommandQueueStats
+from prana_rc.entity import Mode, PranaDeviceInfo, PranaState, PranaDeviceDetails, PranaTargetState, Speed
+from prana_rc.retry import CircuitBreakerStatus
 from prana_rc.service import PranaDeviceManager, PranaDevice
 
 
@@ -51,10 +72,80 @@ class ToDTO(object):
         )
 
     @classmethod
-    def prana_state(cls, obj: Optional[PranaState]) -> Optional[PranaStateDTO]:
+    def prana_state(cls, obj: Optional[PranaState], stale: bool = False) -> Optional[PranaStateDTO]:
+        if obj is None:
+            return None
+        # State is produced by decoder and is valid by construction so validation could be skipped
+        fields = obj._asdict()
+        if obj.sensors is not None:
+            fields["sensors"] = PranaSensorsStateDTO.construct(**obj.sensors._asdict())
+        if obj.timestamp is not None:
+            fields["age"] = max(0.0, (datetime.datetime.now() - obj.timestamp).total_seconds())
+        return PranaStateDTO.construct(stale=stale, **fields)
+
+    @classmethod
+    def prana_device_details(cls, obj: Optional[PranaDeviceDetails]) -> Optional[PranaDeviceDetailsDTO]:
+        if obj is None:
+            return None
+        return PranaDeviceDetailsDTO(
+            address=obj.address,
+            firmware=obj.firmware,
+            state_layout=obj.state_layout,
+        )
+
+    @classmethod
+    def circuit_breaker_status(cls, obj: Optional[CircuitBreakerStatus]) -> Optional[CircuitBreakerStatusDTO]:
+        if obj is None:
+            return None
+        return CircuitBreakerStatusDTO(
+            address=obj.address,
+            state=obj.state.value,
+            consecutive_failures=obj.consecutive_failures,
+            retry_in=obj.retry_in,
+        )
+
+    @classmethod
+    def adapter_status(cls, obj: Optional[AdapterStatus]) -> Optional[BluetoothAdapterStatusDTO]:
         if obj is None:
             return None
-        return PranaStateDTO.parse_obj(obj.to_dict())
+        return BluetoothAdapterStatusDTO(
+            iface=obj.iface,
+            available=obj.available,
+            consecutive_failures=obj.consecutive_failures,
+            retry_in=obj.retry_in,
+        )
+
+    @classmethod
+    def state_update(cls, obj: StateUpdate) -> StateUpdateDTO:
+        return StateUpdateDTO(address=obj.address, changes=obj.changes, timestamp=obj.timestamp)
+
+    @classmethod
+    def command_queue_stats(cls, obj: CommandQueueStats) -> List[CommandQueueStatsDTO]:
+        return [CommandQueueStatsDTO(priority=priority, **stats) for priority, stats in obj.to_dict().items()]
+
+
+class FromDTO(object):
+    # Mode is applied after speed, so it takes precedence
+    MODE_SPEEDS = {Mode.NIGHT: Speed.LOW, Mode.NORMAL: Speed.SPEED_3, Mode.HIGH: Speed.HIGH}
+
+    @classmethod
+    def target_state(cls, obj: SetStateDTO) -> PranaTargetState:
+        if obj.brightness is not None and obj.brightness_pct is not None:
+            raise ValueError('Use either "brightness" or "brightness_pct" but not both at the same time.')
+        brightness = obj.brightness
+        if brightness is not None and (brightness < 0 or brightness > PranaDevice.MAX_BRIGHTNESS):
+            raise ValueError("brightness must be in range 0-{}".format(PranaDevice.MAX_BRIGHTNESS))
+        if obj.brightness_pct is not None:
+            if obj.brightness_pct < 0 or obj.brightness_pct > 100:
+                raise ValueError("brightness_pct is percent value (range 0-100)")
+            brightness = round(PranaDevice.MAX_BRIGHTNESS * obj.brightness_pct / 100)
+        return PranaTargetState(
+            speed=cls.MODE_SPEEDS[obj.mode] if obj.mode is not None else obj.speed,
+            heating=obj.heating,
+            winter_mode=obj.winter_mode,
+            brightness=brightness,
+            night_mode=True if obj.mode == Mode.NIGHT else None,
+        )
 
 
 class PranaRCApiHandler(MethodDiscoveryMixin, SizzleWSHandler, PranaRCAsyncFacade):
@@ -67,31 +158,83 @@ class PranaRCApiHandler(MethodDiscoveryMixin, SizzleWSHandler, PranaRCAsyncFacad
         dispatcher: Dispatcher = None,
         expose_version_api=True,
         expose_ping_api=True,
+        set_state_debounce: float = 0.1,
+        fleet_concurrency: int = 4,
+        subscription_ttl: float = 60,
     ) -> None:
+        """
+        :param set_state_debounce: set_state calls for the same device received within this number of seconds are
+                                   merged and applied as a single transition
+        :param fleet_concurrency: maximum number of devices get_states and set_states talk to at the same time
+        :param subscription_ttl: state subscriptions which are not polled for this number of seconds are removed
+        """
         super().__init__(dispatcher, expose_version_api, expose_ping_api)
         self.__device_manager = device_manager
+        self.__set_state_debouncer: StateIntentDebouncer[PranaState] = StateIntentDebouncer(set_state_debounce)
         # self.__devices_pool = {}  # type: Dict[str, PranaDevice]
+        self.__fleet_concurrency = fleet_concurrency
+        self.__subscription_ttl = subscription_ttl
+        self.__subscriptions = StateSubscriptions(device_manager.state_broker, subscription_ttl)
+        self.__revalidations: Dict[str, asyncio.Task] = {}
+        self.__logger = logging.getLogger(self.__class__.__name__)
         self.__loop = loop
-        self.__lock = Lock()
 
     async def get_connected_prana_device(
         self, device_addr: str, timeout=DEFAULT_TIMEOUT, attempts=DEFAULT_ATTEMPTS
     ) -> PranaDevice:
-        async with self.__lock:
-            prana_device = await self.__device_manager.connect(device_addr, timeout, attempts)
-            return prana_device
+        return await self.__device_manager.connect(device_addr, timeout, attempts)
 
     @rpc_method
-    async def discover(self, timeout=4) -> List[PranaDeviceInfoDTO]:
-        res = await self.__device_manager.discover(timeout)
+    async def discover(self, timeout=4, fresh: bool = False) -> List[PranaDeviceInfoDTO]:
+        res = await self.__device_manager.discover(timeout, fresh)
         return [utils.none_throws(ToDTO.prana_device_info(d)) for d in res]
 
     @rpc_method
-    async def get_state(self, address: str, timeout=DEFAULT_TIMEOUT, attempts=DEFAULT_ATTEMPTS) -> PranaStateDTO:
+    async def get_state(
+        self,
+        address: str,
+        timeout=DEFAULT_TIMEOUT,
+        attempts=DEFAULT_ATTEMPTS,
+        max_age: Optional[float] = None,
+        stale_while_revalidate: Optional[float] = None,
+    ) -> PranaStateDTO:
+        if max_age is not None:
+            state = self.__device_manager.get_last_state(address)
+            if state is not None and self.__device_manager.is_state_restored(address):
+                # State persisted before restart is served until connection is warmed up, regardless of its age
+                self.__revalidate(address, timeout, attempts)
+                return utils.none_throws(ToDTO.prana_state(state, stale=True))
+            if state is not None and state.timestamp is not None:
+                age = (datetime.datetime.now() - state.timestamp).total_seconds()
+                if age <= max_age:
+                    return utils.none_throws(ToDTO.prana_state(state))
+                if stale_while_revalidate is not None and age <= max_age + stale_while_revalidate:
+                    self.__revalidate(address, timeout, attempts)
+                    return utils.none_throws(ToDTO.prana_state(state))
         prana_device = await self.get_connected_prana_device(address, timeout, attempts)
-        state = await prana_device.read_state()
+        # Cached state is already known to be too old for the caller
+        state = await prana_device.read_state(force_read=max_age is not None)
         return utils.none_throws(ToDTO.prana_state(state))
 
+    def __revalidate(self, address: str, timeout: float, attempts: int):
+        """
+        Reads fresh state of the device in background unless it is already being read
+        """
+        task = self.__revalidations.get(address)
+        if task is not None and not task.done():
+            return
+
+        async def read_state():
+            try:
+                prana_device = await self.get_connected_prana_device(address, timeout, attempts)
+                await prana_device.read_state(force_read=True, priority=CommandPriority.BACKGROUND)
+            except Exception as e:
+                self.__logger.warning("Unable to refresh state of {}: {}".format(address, e))
+            finally:
+                self.__revalidations.pop(address, None)
+
+        self.__revalidations[address] = asyncio.ensure_future(read_state())
+
     @rpc_method
     @validate_arguments
     async def set_state(
@@ -101,32 +244,78 @@ class PranaRCApiHandler(MethodDiscoveryMixin, SizzleWSHandler, PranaRCAsyncFacad
         timeout=DEFAULT_TIMEOUT,
         attempts=DEFAULT_ATTEMPTS,
     ) -> PranaStateDTO:
+        target = self.__target_state(state)
+
+        async def apply(merged_target: PranaTargetState) -> PranaState:
+            prana_device = await self.get_connected_prana_device(address, timeout, attempts)
+            return (await prana_device.reconcile(merged_target)).state
+
+        new_state = await self.__set_state_debouncer.submit(address, target, apply)
+        return utils.none_throws(ToDTO.prana_state(new_state))
+
+    @rpc_method
+    async def get_states(
+        self, addresses: List[str], timeout=DEFAULT_TIMEOUT, attempts=DEFAULT_ATTEMPTS
+    ) -> PranaStatesDTO:
+        return await self.__for_each_device(addresses, lambda x: self.get_state(x, timeout, attempts))
+
+    @rpc_method
+    @validate_arguments
+    async def set_states(
+        self,
+        addresses: List[str],
+        state: SetStateDTO,
+        timeout=DEFAULT_TIMEOUT,
+        attempts=DEFAULT_ATTEMPTS,
+    ) -> PranaStatesDTO:
+        # Invalid request is reported once rather than repeated for each device
+        self.__target_state(state)
+        return await self.__for_each_device(addresses, lambda x: self.set_state(x, state, timeout, attempts))
+
+    @staticmethod
+    def __target_state(state: SetStateDTO) -> PranaTargetState:
         features = [state.speed, state.mode, state.winter_mode, state.heating, state.brightness, state.brightness_pct]
         if all(v is None for v in features):
             raise ValueError("At least one parameter must be set. Check your arguments.")
-        prana_device = await self.get_connected_prana_device(address, timeout, attempts)
-        if state.speed is not None:
-            await prana_device.set_speed(state.speed)
-        if state.heating is not None:
-            await prana_device.set_heating(state.heating)
-        if state.winter_mode is not None:
-            await prana_device.set_winter_mode(state.winter_mode)
-        if state.mode is not None:
-            if state.mode == Mode.NIGHT:
-                await prana_device.set_night_mode()
-            elif state.mode == Mode.NORMAL:
-                await prana_device.set_normal_speed()
-            elif state.mode == Mode.HIGH:
-                await prana_device.set_high_speed()
-        if state.brightness is not None or state.brightness_pct is not None:
-            if state.brightness is not None and state.brightness_pct is not None:
-                raise ValueError('Use either "brightness" or "brightness_pct" but not both at the same time.')
-            if state.brightness is not None:
-                await prana_device.set_brightness(state.brightness)
-            if state.brightness_pct is not None:
-                await prana_device.set_brightness_pct(state.brightness_pct)
-        new_state = await prana_device.read_state()
-        return utils.none_throws(ToDTO.prana_state(new_state))
+        return FromDTO.target_state(state)
+
+    async def __for_each_device(
+        self, addresses: List[str], operation: Callable[[str], Awaitable[PranaStateDTO]]
+    ) -> PranaStatesDTO:
+        slots = asyncio.Semaphore(self.__fleet_concurrency)
+
+        async def run(address: str) -> DeviceStateResultDTO:
+            async with slots:
+                try:
+                    return DeviceStateResultDTO(address=address, state=await operation(address))
+                except Exception as e:
+                    return DeviceStateResultDTO(address=address, error="{}: {}".format(e.__class__.__name__, e))
+
+        # Duplicates would compete for the same connection, each device is processed once
+        unique_addresses = list(dict.fromkeys(addresses))
+        return PranaStatesDTO(results=await asyncio.gather(*(run(x) for x in unique_addresses)))
+
+    @rpc_method
+    async def subscribe(self, addresses: Optional[List[str]] = None, min_interval: float = 1) -> SubscriptionDTO:
+        """
+        Subscribes to the state updates of the given devices (all if not set). Updates are fetched with poll_updates,
+        each update carries only the fields changed since the previous one and updates are delivered not more often
+        than once per MIN_INTERVAL seconds.
+        """
+        subscription = self.__subscriptions.subscribe(addresses, min_interval)
+        return SubscriptionDTO(subscription_id=subscription.id, ttl=self.__subscription_ttl)
+
+    @rpc_method
+    async def poll_updates(self, subscription_id: str, timeout: float = 30) -> StateUpdatesDTO:
+        """
+        Waits up to TIMEOUT seconds for the state updates (long polling). Empty list is returned on timeout.
+        """
+        updates = await self.__subscriptions.get(subscription_id).poll(min(timeout, self.__subscription_ttl))
+        return StateUpdatesDTO(updates=[ToDTO.state_update(x) for x in updates])
+
+    @rpc_method
+    async def unsubscribe(self, subscription_id: str) -> None:
+        self.__subscriptions.unsubscribe(subscription_id)
 
     @rpc_method
     async def healthcheck(self) -> PranaHealthCheckResultDTO:
@@ -134,6 +323,24 @@ class PranaRCApiHandler(MethodDiscoveryMixin, SizzleWSHandler, PranaRCAsyncFacad
             version=__version__.__version__,
             timestamp=datetime.datetime.now(),
             current_connections=self.__device_manager.get_connected_devices_addresses(),
+            devices_details=[
+                utils.none_throws(ToDTO.prana_device_details(d)) for d in self.__device_manager.get_devices_details()
+            ],
+            circuit_breakers=[
+                utils.none_throws(ToDTO.circuit_breaker_status(x))
+                for x in self.__device_manager.get_circuit_breakers_status()
+            ],
+            adapters=[utils.none_throws(ToDTO.adapter_status(x)) for x in self.__device_manager.get_adapters_status()],
+            command_queues=ToDTO.command_queue_stats(self.__device_manager.command_queue_stats),
+            rate_limit=RateLimitStatsDTO(**self.__device_manager.rate_limit_stats.to_dict()),
+            reply_rtt=[
+                ReplyRttDTO(address=address, **rtt._asdict())
+                for address, rtt in self.__device_manager.get_reply_rtt().items()
+            ],
+            state_broker=StateBrokerStatsDTO(
+                subscribers=self.__device_manager.state_broker.subscribers,
+                **self.__device_manager.state_broker.stats.to_dict(),
+            ),
         )
 
     @rpc_method
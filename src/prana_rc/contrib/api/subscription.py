@@ -0,0 +1,167 @@
+#    Prana RC
+#    Copyright (C) 2020 Dmitry Berezovsky
+#
+#    prana is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    prana is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import datetime
+import time
+import uuid
+from typing import Any, Collection, Dict, List, NamedTuple, Optional
+
+from prana_rc.broker import Mailbox, StateBroker
+from prana_rc.entity import PranaState
+
+__all__ = ("StateUpdate", "StateSubscription", "StateSubscriptions", "state_delta")
+
+
+class StateUpdate(NamedTuple):
+    address: str
+    # Fields which changed since the previous update delivered to the subscriber. Nested sensors are delta encoded too
+    changes: Dict[str, Any]
+    timestamp: Optional[datetime.datetime]
+
+
+def _state_fields(state: PranaState) -> Dict[str, Any]:
+    fields = state._asdict()
+    del fields["timestamp"]
+    if state.sensors is not None:
+        fields["sensors"] = state.sensors._asdict()
+    return fields
+
+
+def state_delta(previous: Optional[PranaState], current: PranaState) -> Dict[str, Any]:
+    """
+    Returns fields of CURRENT which differ from PREVIOUS. All fields are returned if there is no PREVIOUS state.
+    """
+    current_fields = _state_fields(current)
+    if previous is None:
+        return current_fields
+    previous_fields = _state_fields(previous)
+    delta: Dict[str, Any] = {}
+    for name, value in current_fields.items():
+        previous_value = previous_fields.get(name)
+        if value == previous_value:
+            continue
+        if isinstance(value, dict) and isinstance(previous_value, dict):
+            value = {k: v for k, v in value.items() if previous_value.get(k) != v}
+        delta[name] = value
+    return delta
+
+
+class StateSubscription(object):
+    """
+    Collects states of the devices subscriber is interested in until they are fetched with poll.
+    Subscriber receives only the fields changed since the previous delivered update and not more often than
+    once per MIN_INTERVAL seconds. States are kept in the bounded mailbox, subscriber which polls rarely
+    receives only the latest state of each device.
+    """
+
+    def __init__(self, subscription_id: str, mailbox: Mailbox, min_interval: float) -> None:
+        """
+        :param subscription_id: unique id of the subscription
+        :param mailbox: broker mailbox states are delivered to
+        :param min_interval: minimal time in seconds between two deliveries
+        """
+        self.__id = subscription_id
+        self.__mailbox = mailbox
+        self.__min_interval = min_interval
+        self.__delivered: Dict[str, PranaState] = {}
+        self.__delivered_at: Optional[float] = None
+        self.__polling = 0
+        self.__last_polled_at = time.monotonic()
+
+    @property
+    def id(self) -> str:
+        return self.__id
+
+    @property
+    def mailbox(self) -> Mailbox:
+        return self.__mailbox
+
+    def idle_for(self, now: Optional[float] = None) -> float:
+        """
+        Time in seconds passed since the subscriber fetched updates for the last time. 0 while poll is in progress.
+        """
+        if self.__polling > 0:
+            return 0.0
+        return (time.monotonic() if now is None else now) - self.__last_polled_at
+
+    async def poll(self, timeout: float) -> List[StateUpdate]:
+        """
+        Waits up to TIMEOUT seconds for the updates
+        :return: the latest update of each device changed since the previous poll, empty list on timeout
+        """
+        self.__polling += 1
+        try:
+            return await self.__poll(time.monotonic() + timeout)
+        finally:
+            self.__polling -= 1
+            self.__last_polled_at = time.monotonic()
+
+    async def __poll(self, deadline: float) -> List[StateUpdate]:
+        if self.__delivered_at is not None:
+            # Rate limit: updates received meanwhile are merged and delivered at once
+            await asyncio.sleep(max(0.0, min(deadline, self.__delivered_at + self.__min_interval) - time.monotonic()))
+        while True:
+            if not await self.__mailbox.wait(max(0.0, deadline - time.monotonic())):
+                return []
+            updates = []
+            for address, state in self.__mailbox.drain():
+                changes = state_delta(self.__delivered.get(address), state)
+                self.__delivered[address] = state
+                if len(changes) > 0:
+                    updates.append(StateUpdate(address=address, changes=changes, timestamp=state.timestamp))
+            if len(updates) > 0:
+                self.__delivered_at = time.monotonic()
+                return updates
+
+
+class StateSubscriptions(object):
+    """
+    Registry of the state subscriptions fed by the state broker. Subscriptions which were not polled for TTL seconds
+    are considered abandoned and removed.
+    """
+
+    def __init__(self, broker: StateBroker, ttl: float = 60) -> None:
+        self.__broker = broker
+        self.__ttl = ttl
+        self.__subscriptions: Dict[str, StateSubscription] = {}
+
+    def __len__(self) -> int:
+        return len(self.__subscriptions)
+
+    def subscribe(self, addresses: Optional[Collection[str]] = None, min_interval: float = 1) -> StateSubscription:
+        self.__expire()
+        subscription = StateSubscription(uuid.uuid4().hex, self.__broker.subscribe(addresses), min_interval)
+        self.__subscriptions[subscription.id] = subscription
+        return subscription
+
+    def get(self, subscription_id: str) -> StateSubscription:
+        self.__expire()
+        subscription = self.__subscriptions.get(subscription_id)
+        if subscription is None:
+            raise ValueError("Subscription {} doesn't exist or expired".format(subscription_id))
+        return subscription
+
+    def unsubscribe(self, subscription_id: str):
+        subscription = self.__subscriptions.pop(subscription_id, None)
+        if subscription is not None:
+            self.__broker.unsubscribe(subscription.mailbox)
+
+    def __expire(self):
+        now = time.monotonic()
+        expired = [k for k, v in self.__subscriptions.items() if v.idle_for(now) > self.__ttl]
+        for subscription_id in expired:
+            self.unsubscribe(subscription_id)
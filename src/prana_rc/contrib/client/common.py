@@ -18,7 +18,7 @@ import abc
 import json
 
 from sizzlews.client.common import SizzleWsAsyncClient
-from typing import List
+from typing import AsyncIterator, List, Optional
 
 from prana_rc import utils
 from prana_rc.contrib.api import (
@@ -29,21 +29,41 @@ from prana_rc.contrib.api import (
     PranaStateDTO,
     PranaDeviceInfoDTO,
 )
-from prana_rc.contrib.api.dto import PranaHealthCheckResultDTO
+from prana_rc.contrib.api.dto import (
+    PranaHealthCheckResultDTO,
+    PranaStatesDTO,
+    SubscriptionDTO,
+    StateUpdateDTO,
+    StateUpdatesDTO,
+)
 
 
 class PranaRCAsyncClient(SizzleWsAsyncClient, PranaRCAsyncFacade, metaclass=abc.ABCMeta):
-    async def discover(self, timeout=DEFAULT_TIMEOUT) -> List[PranaDeviceInfoDTO]:
+    async def discover(self, timeout=DEFAULT_TIMEOUT, fresh: bool = False) -> List[PranaDeviceInfoDTO]:
         # TODO: set expected response time. Requires ws-sizzle update to support lists
         return utils.safe_cast(
-            List[PranaDeviceInfoDTO], await self.async_invoke("prana.discover", timeout, expected_response_type=None)
+            List[PranaDeviceInfoDTO],
+            await self.async_invoke("prana.discover", timeout, fresh, expected_response_type=None),
         )
 
-    async def get_state(self, address: str, timeout=DEFAULT_TIMEOUT, attempts=DEFAULT_ATTEMPTS) -> PranaStateDTO:
+    async def get_state(
+        self,
+        address: str,
+        timeout=DEFAULT_TIMEOUT,
+        attempts=DEFAULT_ATTEMPTS,
+        max_age: Optional[float] = None,
+        stale_while_revalidate: Optional[float] = None,
+    ) -> PranaStateDTO:
         return utils.safe_cast(
             PranaStateDTO,
             await self.async_invoke(
-                "prana.get_state", address, timeout, attempts, expected_response_type=PranaStateDTO
+                "prana.get_state",
+                address,
+                timeout,
+                attempts,
+                max_age,
+                stale_while_revalidate,
+                expected_response_type=PranaStateDTO,
             ),
         )
 
@@ -61,6 +81,70 @@ class PranaRCAsyncClient(SizzleWsAsyncClient, PranaRCAsyncFacade, metaclass=abc.
             ),
         )
 
+    async def get_states(
+        self, addresses: List[str], timeout=DEFAULT_TIMEOUT, attempts=DEFAULT_ATTEMPTS
+    ) -> PranaStatesDTO:
+        return utils.safe_cast(
+            PranaStatesDTO,
+            await self.async_invoke(
+                "prana.get_states", addresses, timeout, attempts, expected_response_type=PranaStatesDTO
+            ),
+        )
+
+    async def set_states(
+        self,
+        addresses: List[str],
+        state: SetStateDTO,
+        timeout=DEFAULT_TIMEOUT,
+        attempts=DEFAULT_ATTEMPTS,
+    ) -> PranaStatesDTO:
+        return utils.safe_cast(
+            PranaStatesDTO,
+            await self.async_invoke(
+                "prana.set_states",
+                addresses,
+                json.loads(state.json()),
+                timeout,
+                attempts,
+                expected_response_type=PranaStatesDTO,
+            ),
+        )
+
+    async def subscribe(self, addresses: Optional[List[str]] = None, min_interval: float = 1) -> SubscriptionDTO:
+        return utils.safe_cast(
+            SubscriptionDTO,
+            await self.async_invoke("prana.subscribe", addresses, min_interval, expected_response_type=SubscriptionDTO),
+        )
+
+    async def poll_updates(self, subscription_id: str, timeout: float = 30) -> StateUpdatesDTO:
+        return utils.safe_cast(
+            StateUpdatesDTO,
+            await self.async_invoke(
+                "prana.poll_updates", subscription_id, timeout, expected_response_type=StateUpdatesDTO
+            ),
+        )
+
+    async def unsubscribe(self, subscription_id: str) -> None:
+        await self.async_invoke("prana.unsubscribe", subscription_id)
+
+    async def state_updates(
+        self, addresses: Optional[List[str]] = None, min_interval: float = 1, poll_timeout: float = 30
+    ) -> AsyncIterator[StateUpdateDTO]:
+        """
+        Yields state updates of the given devices (all if not set) as they arrive. Subscription is removed once
+        iteration is stopped.
+        Example:
+            async for update in client.state_updates(["00:11:22:33:44:55"]):
+                print(update.address, update.changes)
+        """
+        subscription = await self.subscribe(addresses, min_interval)
+        try:
+            while True:
+                for update in (await self.poll_updates(subscription.subscription_id, poll_timeout)).updates:
+                    yield update
+        finally:
+            await self.unsubscribe(subscription.subscription_id)
+
     async def healthcheck(self) -> PranaHealthCheckResultDTO:
         return utils.safe_cast(
             PranaHealthCheckResultDTO,
@@ -24,7 +24,9 @@ from sizzlews.server.tornado import (
 
 from prana_rc.cli_utils import CliExtension, CLI
 from prana_rc.contrib.api.handler import PranaRCApiHandler
+from prana_rc.rate_limit import RateLimitPolicy
 from prana_rc.service import PranaDeviceManager
+from prana_rc.state_store import StateStore
 
 
 class HttpServerCLIExtension(CliExtension):
@@ -54,11 +56,139 @@ class HttpServerCLIExtension(CliExtension):
             help="Http path to bind rpc endpoint. E.g. /rpc will mount rpc server to "
             "http://localhost:<port>/rpc endpoint. If nothing is rpc will be mounted to the root. ",
         )
+        parser.add_argument(
+            "--state-max-age",
+            dest="state_max_age",
+            action="store",
+            required=False,
+            type=float,
+            default=5,
+            help="Time in seconds the last received device state is served from cache without querying the device.",
+        )
+        parser.add_argument(
+            "--max-connections",
+            dest="max_connections",
+            action="store",
+            required=False,
+            type=int,
+            default=5,
+            help="Maximum number of simultaneous device connections. "
+            "Least recently used idle connection is closed when the limit is reached.",
+        )
+        parser.add_argument(
+            "--idle-timeout",
+            dest="idle_timeout",
+            action="store",
+            required=False,
+            type=float,
+            default=600,
+            help="Time in seconds after which unused device connection is closed. 0 disables.",
+        )
+        parser.add_argument(
+            "--max-concurrent-connects",
+            dest="max_concurrent_connects",
+            action="store",
+            required=False,
+            type=int,
+            default=3,
+            help="Maximum number of connection attempts to different devices running at the same time.",
+        )
+        parser.add_argument(
+            "--keepalive-interval",
+            dest="keepalive_interval",
+            action="store",
+            required=False,
+            type=float,
+            default=30,
+            help="Interval in seconds between keepalive reads of the connected devices. Dropped connections are "
+            "re-established in background. 0 disables.",
+        )
+        parser.add_argument(
+            "--passive-scan",
+            dest="passive_scan",
+            action="store_true",
+            required=False,
+            default=False,
+            help="If set advertisements are collected in background and discover responds from the cache instantly.",
+        )
+        parser.add_argument(
+            "--advertisement-ttl",
+            dest="advertisement_ttl",
+            action="store",
+            required=False,
+            type=float,
+            default=60,
+            help="Time in seconds device is reported by passive discover after its last advertisement.",
+        )
+        parser.add_argument(
+            "--rate-limit",
+            dest="rate_limit",
+            action="store",
+            required=False,
+            type=float,
+            default=10,
+            help="Sustained number of writes per second allowed for each device. 0 disables limit.",
+        )
+        parser.add_argument(
+            "--rate-limit-burst",
+            dest="rate_limit_burst",
+            action="store",
+            required=False,
+            type=int,
+            default=10,
+            help="Number of writes each device accepts back-to-back after idle period.",
+        )
+        parser.add_argument(
+            "--rate-limit-policy",
+            dest="rate_limit_policy",
+            action="store",
+            required=False,
+            choices=[x.value for x in RateLimitPolicy],
+            default=RateLimitPolicy.BACKPRESSURE.value,
+            help="Whether writes exceeding the budget are delayed (backpressure) or rejected.",
+        )
+        parser.add_argument(
+            "--set-state-debounce",
+            dest="set_state_debounce",
+            action="store",
+            required=False,
+            type=float,
+            default=0.1,
+            help="Time in seconds set_state calls for the same device are collected and applied as a single change.",
+        )
+        parser.add_argument(
+            "--state-store",
+            dest="state_store",
+            action="store",
+            required=False,
+            type=str,
+            default=None,
+            help="Path to SQLite database to persist the last state of each device in. Persisted states are served "
+            "flagged as stale after restart until connections are re-established.",
+        )
 
     async def handle(self, args: argparse.Namespace):
         CLI.print_info("Prana RC: Starting in HTTP server mode")
-        device_manager = PranaDeviceManager(iface=args.iface)
-        prana_api = PranaRCApiHandler(device_manager, asyncio.get_event_loop())
+        state_store = StateStore(args.state_store) if args.state_store else None
+        device_manager = PranaDeviceManager(
+            iface=args.iface,
+            state_max_age=args.state_max_age,
+            max_connections=args.max_connections,
+            idle_timeout=args.idle_timeout or None,
+            max_concurrent_connects=args.max_concurrent_connects,
+            keepalive_interval=args.keepalive_interval or None,
+            passive_scan=args.passive_scan,
+            advertisement_ttl=args.advertisement_ttl,
+            rate_limit=args.rate_limit or None,
+            rate_limit_burst=args.rate_limit_burst,
+            rate_limit_policy=RateLimitPolicy(args.rate_limit_policy),
+            state_store=state_store,
+        )
+        await device_manager.start_background_scan()
+        warm_up = asyncio.ensure_future(device_manager.warm_up())
+        prana_api = PranaRCApiHandler(
+            device_manager, asyncio.get_event_loop(), set_state_debounce=args.set_state_debounce
+        )
         bootstrap_torando_rpc_application(prana_api, args.http_port, args.http_path)
         CLI.print_info("HTTP: Listening on http://0.0.0.0:{}{}".format(args.http_port, args.http_path))
         try:
@@ -66,5 +196,9 @@ class HttpServerCLIExtension(CliExtension):
                 await asyncio.sleep(5)
         except CancelledError:
             CLI.print_info("Received shutdown signal. Closing connections...")
+            warm_up.cancel()
+            await device_manager.stop_background_scan()
             await device_manager.disconnect_all()
+            if state_store is not None:
+                state_store.close()
             CLI.print_info("Connections closed")
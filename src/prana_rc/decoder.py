@@ -0,0 +1,206 @@
+#    Prana RC
+#    Copyright (C) 2020 Dmitry Berezovsky
+#
+#    prana is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    prana is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import datetime
+import logging
+import struct
+from typing import Callable, Optional, Tuple, Union
+
+from prana_rc.entity import PranaState, PranaSensorsState, StateLayout
+
+__all__ = (
+    "decode_state",
+    "decode_device_details_payload",
+    "state_decoder_for",
+    "detect_state_layout",
+    "state_layout_evidence",
+    "StateDecoder",
+    "STATE_MSG_PREFIX",
+    "STATE_REPLY_PREFIX",
+    "DEVICE_DETAILS_MSG_PREFIX",
+    "STATE_FRAME_LAYOUT",
+)
+
+STATE_MSG_PREFIX = b"\xbe\xef"
+# Prefix of the frame sent in reply to the read state command
+STATE_REPLY_PREFIX = b"\xbe\xef\x05\x01"
+DEVICE_DETAILS_MSG_PREFIX = b"\xbe\xef\x05\x02"
+
+Frame = Union[bytes, bytearray, memoryview]
+StateDecoder = Callable[[Frame], Optional[PranaState]]
+_TemperatureReader = Callable[[int, int, int, int, int], Tuple[float, float]]
+
+# All the fields of the state frame we are interested in, unpacked with a single call.
+# Offsets:    prefix | 10 is_on | 12 brightness | 14 heating | 16 night | 20 auto | 22 flows_locked
+#             26 speed_locked | 28 input fan | 30 speed_in | 32 output fan | 34 speed_out | 42 winter_mode
+#             49 temperature_in (legacy) | 51 temperature_in | 54-55 temperature_out (55 is legacy one)
+#             60 humidity | 61 co2 | 63 voc | 78 pressure
+STATE_FRAME_LAYOUT = struct.Struct(">2s8xBxBxBxB3xBxB3xBxBxBxBxB7xB6xBxHxBB4xBHH13xB")
+
+SENSOR_VALUE_MASK = 0b0011111111111111
+
+# Brightness is reported as a single bit flag, level is the position of that bit
+BRIGHTNESS_LEVELS = tuple(x.bit_length() for x in range(256))
+
+_logger = logging.getLogger(__name__)
+
+
+class _HexFrame(object):
+    """Defers hex formatting of the frame until log record is actually rendered"""
+
+    __slots__ = ("frame",)
+
+    def __init__(self, frame: memoryview) -> None:
+        self.frame = frame
+
+    def __str__(self):
+        return ",".join("0x{:02x}".format(x) for x in self.frame)
+
+
+def _extended_temperatures(co2: int, legacy_in: int, t_in: int, t_out_hi: int, t_out_lo: int) -> Tuple[float, float]:
+    return (t_in & SENSOR_VALUE_MASK) / 10.0, (((t_out_hi << 8) | t_out_lo) & SENSOR_VALUE_MASK) / 10.0
+
+
+def _legacy_temperatures(co2: int, legacy_in: int, t_in: int, t_out_hi: int, t_out_lo: int) -> Tuple[float, float]:
+    return legacy_in / 10.0, t_out_lo / 10.0
+
+
+def _detected_temperatures(co2: int, legacy_in: int, t_in: int, t_out_hi: int, t_out_lo: int) -> Tuple[float, float]:
+    if detect_state_layout(co2) == StateLayout.EXTENDED:
+        return _extended_temperatures(co2, legacy_in, t_in, t_out_hi, t_out_lo)
+    return _legacy_temperatures(co2, legacy_in, t_in, t_out_hi, t_out_lo)
+
+
+_TEMPERATURE_READERS = {
+    StateLayout.AUTO: _detected_temperatures,
+    StateLayout.LEGACY: _legacy_temperatures,
+    StateLayout.EXTENDED: _extended_temperatures,
+}
+
+
+def detect_state_layout(co2: Optional[int]) -> StateLayout:
+    """
+    Guesses frame layout by the CO2 value. Only devices with extended layout report meaningful CO2
+    """
+    return StateLayout.EXTENDED if co2 is not None and 0 < co2 < 10000 else StateLayout.LEGACY
+
+
+def state_layout_evidence(sensors: Optional[PranaSensorsState]) -> Optional[StateLayout]:
+    """
+    Tells which layout the frame decoded with auto detection has, unlike detect_state_layout doesn't guess.
+    Only extended layout is indicated, by plausible CO2 reading. Missing CO2 reading proves nothing: extended
+    sensor might read 0 as well.
+    :return: None if the frame carries no evidence, e.g. device has no sensors or CO2 reading is out of range
+    """
+    if sensors is None or sensors.co2 is None:
+        return None
+    if 0 < sensors.co2 < 10000:
+        return StateLayout.EXTENDED
+    return None
+
+
+def state_decoder_for(layout: StateLayout) -> StateDecoder:
+    """
+    Returns decoder specialized for the given frame layout
+    """
+    read_temperatures = _TEMPERATURE_READERS[layout]
+    return lambda frame: _decode_state(frame, None, read_temperatures)
+
+
+def decode_state(frame: Frame, timestamp: Optional[datetime.datetime] = None) -> Optional[PranaState]:
+    """
+    Decodes state frame received from the device. Frame layout is detected for the each frame,
+    use state_decoder_for if layout is known.
+    :param frame: raw frame
+    :param timestamp: time the frame was received, current time will be used if not set
+    :return: decoded state or None if given frame is not a state frame
+    """
+    return _decode_state(frame, timestamp, _detected_temperatures)
+
+
+def decode_device_details_payload(frame: Frame) -> Optional[str]:
+    """
+    Extracts payload of the device details frame
+    :return: hex encoded payload or None if given frame is not a device details frame
+    """
+    view = memoryview(frame)
+    prefix_len = len(DEVICE_DETAILS_MSG_PREFIX)
+    if view[:prefix_len] != DEVICE_DETAILS_MSG_PREFIX:
+        return None
+    return bytes(view[prefix_len:]).rstrip(b"\x00").hex()
+
+
+def _decode_state(
+    frame: Frame, timestamp: Optional[datetime.datetime], read_temperatures: _TemperatureReader
+) -> Optional[PranaState]:
+    view = memoryview(frame)
+    if view[:2] != STATE_MSG_PREFIX or view[:4] == DEVICE_DETAILS_MSG_PREFIX:
+        return None
+    if len(view) < STATE_FRAME_LAYOUT.size:
+        raise ValueError("State frame is too short: {} bytes".format(len(view)))
+    if _logger.isEnabledFor(logging.DEBUG):
+        _logger.debug("State data: %s", _HexFrame(view))
+    (
+        _,
+        is_on,
+        brightness,
+        heating,
+        night_mode,
+        auto_mode,
+        flows_locked,
+        speed_locked,
+        input_fan,
+        speed_in,
+        output_fan,
+        speed_out,
+        winter_mode,
+        temperature_in_legacy,
+        temperature_in,
+        temperature_out_hi,
+        temperature_out_lo,
+        humidity,
+        co2,
+        voc,
+        pressure,
+    ) = STATE_FRAME_LAYOUT.unpack_from(view)
+    humidity -= 128
+    sensors = None
+    # Add sensors to the state only in case device has corresponding hardware
+    if humidity > 0:
+        co2 &= SENSOR_VALUE_MASK
+        temperature_in, temperature_out = read_temperatures(
+            co2, temperature_in_legacy, temperature_in, temperature_out_hi, temperature_out_lo
+        )
+        # Positional arguments follow field order of the entities, it is notably cheaper than keywords
+        sensors = PranaSensorsState(
+            temperature_in, temperature_out, humidity, 512 + pressure, voc & SENSOR_VALUE_MASK, co2
+        )
+    return PranaState(
+        speed_locked // 10,
+        speed_in // 10,
+        speed_out // 10,
+        night_mode != 0,
+        auto_mode != 0,
+        flows_locked != 0,
+        is_on != 0,
+        heating != 0,
+        winter_mode != 0,
+        input_fan != 0,
+        output_fan != 0,
+        BRIGHTNESS_LEVELS[brightness],
+        sensors,
+        timestamp or datetime.datetime.now(),
+    )
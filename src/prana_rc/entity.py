@@ -64,6 +64,24 @@ class Mode(Enum):
     HIGH = "high"
 
 
+class StateLayout(Enum):
+    """
+    Layout of the state frame. Depends on device firmware
+    """
+
+    AUTO = "auto"  # Not known yet, detected for each frame
+    LEGACY = "legacy"  # Temperatures are reported as single bytes
+    EXTENDED = "extended"  # 14-bit temperatures, CO2 and VOC sensors
+
+
+class PranaDeviceDetails(NamedTuple):
+    address: str
+    # Hex encoded payload of the device details frame. Format is not documented, so the whole payload identifies
+    # firmware and frame layout is learned per payload
+    firmware: str
+    state_layout: StateLayout = StateLayout.AUTO
+
+
 class PranaDeviceInfo(NamedTuple):
     address: str
     bt_device_name: str
@@ -71,14 +89,53 @@ class PranaDeviceInfo(NamedTuple):
     rssi: int
 
 
-class PranaSensorsState(object):
-    def __init__(self) -> None:
-        self.temperature_in: Optional[float] = None
-        self.temperature_out: Optional[float] = None
-        self.humidity: Optional[int] = None
-        self.pressure: Optional[int] = None
-        self.voc: Optional[int] = None
-        self.co2: Optional[int] = None
+class SpeedChangeResult(NamedTuple):
+    target: Speed
+    planned_writes: int
+    sent_writes: int
+
+
+class PranaTargetState(NamedTuple):
+    """
+    Desired state of the device. Fields which are not set are left as is.
+    """
+
+    speed: Optional[Speed] = None
+    heating: Optional[bool] = None
+    winter_mode: Optional[bool] = None
+    brightness: Optional[int] = None
+    # Only enabling night mode is supported, any other speed change leaves it
+    night_mode: Optional[bool] = None
+
+    def updated_with(self, newer: "PranaTargetState") -> "PranaTargetState":
+        """
+        Merges two targets, fields set in NEWER take precedence
+        """
+        fields = {k: v for k, v in newer._asdict().items() if v is not None}
+        if newer.speed is not None and newer.night_mode is None:
+            # Newer speed change cancels night mode requested before
+            fields["night_mode"] = None
+        return self._replace(**fields)
+
+
+class ReconcileResult(NamedTuple):
+    # State of the device after reconciliation
+    state: "PranaState"
+    planned_writes: int
+    sent_writes: int
+    # True if resulting state matches the target
+    converged: bool
+    # True if resulting state was received via notification, False if it was read from the device
+    verified_by_notification: bool
+
+
+class PranaSensorsState(NamedTuple):
+    temperature_in: Optional[float] = None
+    temperature_out: Optional[float] = None
+    humidity: Optional[int] = None
+    pressure: Optional[int] = None
+    voc: Optional[int] = None
+    co2: Optional[int] = None
 
     def __repr__(self):
         return (
@@ -91,32 +148,28 @@ class PranaSensorsState(object):
         )
 
     def to_dict(self) -> dict:
-        return dict(
-            temperature_in=self.temperature_in,
-            temperature_out=self.temperature_out,
-            humidity=self.humidity,
-            pressure=self.pressure,
-            voc=self.voc,
-            co2=self.co2,
-        )
-
-
-class PranaState(object):
-    def __init__(self) -> None:
-        self.speed_locked: Optional[int] = None
-        self.speed_in: Optional[int] = None
-        self.speed_out: Optional[int] = None
-        self.night_mode: Optional[bool] = None
-        self.auto_mode: Optional[bool] = None
-        self.flows_locked: Optional[bool] = None
-        self.is_on: Optional[bool] = None
-        self.mini_heating_enabled: Optional[bool] = None
-        self.winter_mode_enabled: Optional[bool] = None
-        self.is_input_fan_on: Optional[bool] = None
-        self.is_output_fan_on: Optional[bool] = None
-        self.brightness: Optional[int] = None
-        self.sensors: Optional[PranaSensorsState] = None
-        self.timestamp: Optional[datetime.datetime] = None
+        return self._asdict()
+
+
+class PranaState(NamedTuple):
+    """
+    Immutable snapshot of the device state. Use _replace() to derive modified copy.
+    """
+
+    speed_locked: Optional[int] = None
+    speed_in: Optional[int] = None
+    speed_out: Optional[int] = None
+    night_mode: Optional[bool] = None
+    auto_mode: Optional[bool] = None
+    flows_locked: Optional[bool] = None
+    is_on: Optional[bool] = None
+    mini_heating_enabled: Optional[bool] = None
+    winter_mode_enabled: Optional[bool] = None
+    is_input_fan_on: Optional[bool] = None
+    is_output_fan_on: Optional[bool] = None
+    brightness: Optional[int] = None
+    sensors: Optional[PranaSensorsState] = None
+    timestamp: Optional[datetime.datetime] = None
 
     @property
     def speed(self):
@@ -138,23 +191,11 @@ class PranaState(object):
         return res
 
     def to_dict(self) -> dict:
-        return dict(
-            speed_locked=self.speed_locked,
-            speed_in=self.speed_in,
-            speed_out=self.speed_out,
-            night_mode=self.night_mode,
-            auto_mode=self.auto_mode,
-            flows_locked=self.flows_locked,
-            is_on=self.is_on,
-            mini_heating_enabled=self.mini_heating_enabled,
-            winter_mode_enabled=self.winter_mode_enabled,
-            is_input_fan_on=self.is_input_fan_on,
-            is_output_fan_on=self.is_output_fan_on,
-            timestamp=self.timestamp if self.timestamp is not None else None,
-            speed=self.speed,
-            brightness=self.brightness,
-            sensors=self.sensors.to_dict() if self.sensors is not None else None,
-        )
+        res = self._asdict()
+        res["speed"] = self.speed
+        if self.sensors is not None:
+            res["sensors"] = self.sensors._asdict()
+        return res
 
 
 # TODO: Deprecated???
@@ -0,0 +1,147 @@
+#    Prana RC
+#    Copyright (C) 2020 Dmitry Berezovsky
+#
+#    prana is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    prana is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import contextvars
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+
+__all__ = ("RadioScheduler",)
+
+# Set while the current task performs background work, commands it sends don't count as foreground traffic
+_background_work = contextvars.ContextVar("background_work", default=False)
+
+
+class RadioScheduler(object):
+    """
+    Arbitrates a single bluetooth adapter between command traffic, connection setup and scanning.
+    Priorities from the highest to the lowest:
+        * commands - never wait, interrupt running scan window
+        * connection setup - interrupts running scan window and waits until scanning is stopped
+        * background work (polling) and scan windows - start only once foreground traffic is idle for SETTLE_TIME
+    Scanning is time sliced into windows not longer than SCAN_WINDOW so foreground work never waits for the
+    whole discovery.
+    """
+
+    def __init__(self, scan_window: float = 1.0, settle_time: float = 0.1, background_concurrency: int = 1) -> None:
+        """
+        :param scan_window: maximum duration of a single scan window in seconds
+        :param settle_time: time in seconds foreground traffic must be idle before background work is started
+        :param background_concurrency: maximum number of background jobs running at the same time
+        """
+        self.__scan_window = scan_window
+        self.__settle_time = settle_time
+        self.__background_slots = asyncio.BoundedSemaphore(background_concurrency)
+        self.__foreground = 0
+        self.__foreground_idle_since = 0.0
+        self.__foreground_idle = asyncio.Event()
+        self.__foreground_idle.set()
+        # Scan windows of the same adapter might overlap (background scanning and discovery)
+        self.__scan_windows = 0
+        self.__scan_stopped = asyncio.Event()
+        self.__scan_stopped.set()
+        self.__preempted = asyncio.Event()
+        self.scan_preemptions = 0
+
+    @property
+    def is_scanning(self) -> bool:
+        return not self.__scan_stopped.is_set()
+
+    @asynccontextmanager
+    async def command(self) -> AsyncIterator[None]:
+        """
+        Marks command traffic. Commands sent by background work are not prioritized.
+        """
+        if _background_work.get():
+            yield
+            return
+        self.__enter_foreground()
+        try:
+            yield
+        finally:
+            self.__leave_foreground()
+
+    @asynccontextmanager
+    async def connection_setup(self) -> AsyncIterator[None]:
+        self.__enter_foreground()
+        try:
+            await self.__scan_stopped.wait()
+            yield
+        finally:
+            self.__leave_foreground()
+
+    @asynccontextmanager
+    async def background(self) -> AsyncIterator[None]:
+        """
+        Runs low priority work (e.g. polling) once the adapter is not used by foreground traffic
+        """
+        async with self.__background_slots:
+            await self.__wait_foreground_settled()
+            token = _background_work.set(True)
+            try:
+                yield
+            finally:
+                _background_work.reset(token)
+
+    @asynccontextmanager
+    async def scan_window(self) -> AsyncIterator[float]:
+        """
+        Waits until foreground traffic is idle and reserves the adapter for scanning.
+        Scanning must be stopped once window length yielded by the context manager expires or
+        wait_preempted returns True, whichever comes first.
+        """
+        await self.__wait_foreground_settled()
+        self.__scan_windows += 1
+        self.__scan_stopped.clear()
+        self.__preempted.clear()
+        try:
+            yield self.__scan_window
+        finally:
+            self.__scan_windows -= 1
+            if self.__scan_windows == 0:
+                self.__scan_stopped.set()
+
+    async def wait_preempted(self, timeout: float) -> bool:
+        """
+        Waits up to TIMEOUT seconds for foreground work to preempt the scan window
+        :return: True if scan window was preempted
+        """
+        try:
+            await asyncio.wait_for(self.__preempted.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        self.scan_preemptions += 1
+        return True
+
+    def __enter_foreground(self):
+        self.__foreground += 1
+        self.__foreground_idle.clear()
+        self.__preempted.set()
+
+    def __leave_foreground(self):
+        self.__foreground -= 1
+        if self.__foreground == 0:
+            self.__foreground_idle_since = time.monotonic()
+            self.__foreground_idle.set()
+
+    async def __wait_foreground_settled(self):
+        while True:
+            await self.__foreground_idle.wait()
+            remaining = self.__foreground_idle_since + self.__settle_time - time.monotonic()
+            if remaining <= 0 and self.__foreground == 0:
+                return
+            await asyncio.sleep(max(0.0, remaining))
@@ -0,0 +1,113 @@
+#    Prana RC
+#    Copyright (C) 2020 Dmitry Berezovsky
+#
+#    prana is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    prana is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import time
+from enum import Enum
+from typing import Optional
+
+__all__ = ("RateLimiter", "RateLimitPolicy", "RateLimitStats", "RateLimitExceededError")
+
+
+class RateLimitPolicy(Enum):
+    BACKPRESSURE = "backpressure"  # Command waits until budget allows to send it
+    REJECT = "reject"  # Command fails with RateLimitExceededError
+
+
+class RateLimitExceededError(RuntimeError):
+    pass
+
+
+class RateLimitStats(object):
+    def __init__(self) -> None:
+        # Commands delayed because of exhausted budget
+        self.throttled = 0
+        # Total time in seconds commands were delayed for
+        self.throttle_delay = 0.0
+        # Commands rejected because of exhausted budget
+        self.rejected = 0
+
+    def to_dict(self) -> dict:
+        return dict(throttled=self.throttled, throttle_delay=self.throttle_delay, rejected=self.rejected)
+
+
+class RateLimiter(object):
+    """
+    Token bucket which limits the number of writes sent to a single device. Bucket holds up to BURST tokens and is
+    refilled with RATE tokens per second, each write consumes one token.
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        burst: int,
+        policy: RateLimitPolicy = RateLimitPolicy.BACKPRESSURE,
+        stats: Optional[RateLimitStats] = None,
+    ) -> None:
+        """
+        :param rate: sustained number of writes per second
+        :param burst: maximum number of writes which could be sent back-to-back after idle period
+        :param policy: what to do with the write once budget is exhausted
+        :param stats: counters to account throttled and rejected writes in
+        """
+        if rate <= 0 or burst < 1:
+            raise ValueError("rate must be positive and burst must be at least 1")
+        self.__rate = rate
+        self.__burst = burst
+        self.__policy = policy
+        self.__stats = stats or RateLimitStats()
+        self.__tokens = float(burst)
+        self.__updated_at = time.monotonic()
+
+    @property
+    def policy(self) -> RateLimitPolicy:
+        return self.__policy
+
+    @property
+    def stats(self) -> RateLimitStats:
+        return self.__stats
+
+    def __refill(self):
+        now = time.monotonic()
+        self.__tokens = min(float(self.__burst), self.__tokens + (now - self.__updated_at) * self.__rate)
+        self.__updated_at = now
+
+    async def wait(self):
+        """
+        Applies backpressure: waits until there is a token available. Does nothing for REJECT policy.
+        """
+        if self.__policy != RateLimitPolicy.BACKPRESSURE:
+            return
+        self.__refill()
+        if self.__tokens >= 1:
+            return
+        delay = (1 - self.__tokens) / self.__rate
+        self.__stats.throttled += 1
+        self.__stats.throttle_delay += delay
+        await asyncio.sleep(delay)
+
+    def try_acquire(self, count: int = 1) -> bool:
+        """
+        Consumes COUNT tokens if all of them are available, otherwise consumes nothing
+        :param count: number of writes to reserve budget for
+        :return: False if budget is exhausted
+        """
+        self.__refill()
+        if self.__tokens >= count:
+            self.__tokens -= count
+            return True
+        self.__stats.rejected += count
+        return False
@@ -0,0 +1,73 @@
+#    Prana RC
+#    Copyright (C) 2020 Dmitry Berezovsky
+#
+#    prana is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    prana is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+from typing import List, Tuple
+
+__all__ = ("ReplyMatcher",)
+
+
+class ReplyMatcher(object):
+    """
+    Correlates incoming notification frames with the commands waiting for reply.
+    Waiter must be registered BEFORE the command is written so that fast replies are never lost.
+    """
+
+    def __init__(self) -> None:
+        self.__waiters: List[Tuple[bytes, asyncio.Future]] = []
+
+    def expect(self, prefix: bytes) -> "asyncio.Future[bytearray]":
+        """
+        Registers waiter for the frame starting with PREFIX
+        :param prefix: expected prefix of the reply frame
+        :return: future which will be resolved with the matched frame
+        """
+        future = asyncio.get_event_loop().create_future()
+        self.__waiters.append((prefix, future))
+        return future
+
+    def discard(self, future: asyncio.Future):
+        self.__waiters = [x for x in self.__waiters if x[1] is not future]
+
+    def dispatch(self, frame: bytearray) -> bool:
+        """
+        Resolves the oldest waiter which matches given frame
+        :param frame: received frame
+        :return: True if frame was consumed by waiter, False if it is unsolicited
+        """
+        for i, (prefix, future) in enumerate(self.__waiters):
+            if future.done():
+                continue
+            if frame[: len(prefix)] == prefix:
+                del self.__waiters[i]
+                future.set_result(frame)
+                return True
+        return False
+
+    def fail_all(self, error: Exception):
+        """
+        Fails all the waiters with ERROR, e.g. when connection is lost and replies will never arrive
+        """
+        for prefix, future in self.__waiters:
+            if not future.done():
+                future.set_exception(error)
+        self.__waiters = []
+
+    def cancel_all(self):
+        for prefix, future in self.__waiters:
+            if not future.done():
+                future.cancel()
+        self.__waiters = []
@@ -0,0 +1,144 @@
+#    Prana RC
+#    Copyright (C) 2020 Dmitry Berezovsky
+#
+#    prana is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    prana is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import abc
+import random
+import time
+from enum import Enum
+from typing import NamedTuple, Optional
+
+__all__ = (
+    "RetryPolicy",
+    "FixedDelayRetryPolicy",
+    "ExponentialBackoffRetryPolicy",
+    "CircuitBreaker",
+    "CircuitBreakerStatus",
+    "CircuitState",
+    "CircuitOpenError",
+)
+
+
+class RetryPolicy(abc.ABC):
+    @abc.abstractmethod
+    def delay(self, attempt: int) -> float:
+        """
+        Returns time in seconds to wait before the next attempt
+        :param attempt: number of the failed attempt, starting from 1
+        """
+        pass
+
+
+class FixedDelayRetryPolicy(RetryPolicy):
+    def __init__(self, delay: float) -> None:
+        self.__delay = delay
+
+    def delay(self, attempt: int) -> float:
+        return self.__delay
+
+
+class ExponentialBackoffRetryPolicy(RetryPolicy):
+    """
+    Delay grows exponentially with each attempt up to MAX_DELAY. Jitter randomly shortens the delay by up to the
+    given fraction so that retries of different devices do not hit the adapter at the same time.
+    """
+
+    def __init__(self, base_delay: float = 0.5, factor: float = 2, max_delay: float = 10, jitter: float = 0.5) -> None:
+        if not 0 <= jitter <= 1:
+            raise ValueError("jitter must be in range 0-1")
+        self.__base_delay = base_delay
+        self.__factor = factor
+        self.__max_delay = max_delay
+        self.__jitter = jitter
+
+    def delay(self, attempt: int) -> float:
+        delay = min(self.__max_delay, self.__base_delay * self.__factor ** max(0, attempt - 1))
+        return delay * (1 - self.__jitter * random.random())
+
+
+class CircuitState(Enum):
+    CLOSED = "closed"  # Device operates normally
+    OPEN = "open"  # Device failed too many times, calls are rejected until cooldown expires
+    HALF_OPEN = "half_open"  # Cooldown expired, next call is a trial
+
+
+class CircuitBreakerStatus(NamedTuple):
+    address: str
+    state: CircuitState
+    consecutive_failures: int
+    retry_in: Optional[float]
+
+
+class CircuitOpenError(RuntimeError):
+    def __init__(self, address: str, retry_in: float) -> None:
+        super().__init__(
+            "Device {} is unavailable after repeated failures. Next attempt allowed in {:.1f}s".format(
+                address, retry_in
+            )
+        )
+        self.address = address
+        self.retry_in = retry_in
+
+
+class CircuitBreaker(object):
+    """
+    Rejects calls to the device for COOLDOWN seconds once it failed FAILURE_THRESHOLD times in a row.
+    """
+
+    def __init__(self, address: str, failure_threshold: int = 5, cooldown: float = 30) -> None:
+        self.__address = address
+        self.__failure_threshold = failure_threshold
+        self.__cooldown = cooldown
+        self.__consecutive_failures = 0
+        self.__opened_at: Optional[float] = None
+
+    @property
+    def state(self) -> CircuitState:
+        if self.__opened_at is None:
+            return CircuitState.CLOSED
+        if time.monotonic() - self.__opened_at >= self.__cooldown:
+            return CircuitState.HALF_OPEN
+        return CircuitState.OPEN
+
+    def check(self):
+        """
+        Raises CircuitOpenError if calls to the device are not allowed at the moment
+        """
+        if self.state == CircuitState.OPEN:
+            raise CircuitOpenError(self.__address, self.__retry_in())
+
+    def record_success(self):
+        self.__consecutive_failures = 0
+        self.__opened_at = None
+
+    def record_failure(self):
+        self.__consecutive_failures += 1
+        # Failed trial call re-opens the circuit immediately
+        if self.__opened_at is not None or self.__consecutive_failures >= self.__failure_threshold:
+            self.__opened_at = time.monotonic()
+
+    def status(self) -> CircuitBreakerStatus:
+        state = self.state
+        return CircuitBreakerStatus(
+            address=self.__address,
+            state=state,
+            consecutive_failures=self.__consecutive_failures,
+            retry_in=self.__retry_in() if state == CircuitState.OPEN else None,
+        )
+
+    def __retry_in(self) -> float:
+        if self.__opened_at is None:
+            return 0
+        return max(0.0, self.__opened_at + self.__cooldown - time.monotonic())
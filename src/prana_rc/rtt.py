@@ -0,0 +1,86 @@
+#    Prana RC
+#    Copyright (C) 2020 Dmitry Berezovsky
+#
+#    prana is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    prana is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from typing import NamedTuple, Optional
+
+__all__ = ("RttEstimator", "RttStatus")
+
+
+class RttStatus(NamedTuple):
+    srtt: Optional[float]
+    rttvar: Optional[float]
+    timeout: float
+    samples: int
+    timeouts: int
+
+
+class RttEstimator(object):
+    """
+    Estimates write-to-reply latency of the device the same way TCP does (RFC 6298): smoothed RTT and its variance
+    are updated with each sample, reply timeout is SRTT + 4 * RTTVAR. Timeout is doubled on each lost reply and
+    restored by the next sample.
+    """
+
+    ALPHA = 1 / 8
+    BETA = 1 / 4
+
+    def __init__(self, initial_timeout: float = 1.0, min_timeout: float = 0.2, max_timeout: float = 5.0) -> None:
+        """
+        :param initial_timeout: reply timeout used until the first sample is received
+        :param min_timeout: lower bound of the reply timeout, protects against spurious timeouts on fast links
+        :param max_timeout: upper bound of the reply timeout
+        """
+        self.__min_timeout = min_timeout
+        self.__max_timeout = max_timeout
+        self.__srtt: Optional[float] = None
+        self.__rttvar: Optional[float] = None
+        self.__timeout = self.__clamp(initial_timeout)
+        self.__samples = 0
+        self.__timeouts = 0
+
+    @property
+    def timeout(self) -> float:
+        return self.__timeout
+
+    def add_sample(self, rtt: float):
+        """
+        Accounts measured round trip time. Samples of retried commands must not be accounted (Karn's rule): reply
+        can't be matched with the particular attempt.
+        """
+        if self.__srtt is None or self.__rttvar is None:
+            self.__srtt = rtt
+            self.__rttvar = rtt / 2
+        else:
+            self.__rttvar = (1 - self.BETA) * self.__rttvar + self.BETA * abs(self.__srtt - rtt)
+            self.__srtt = (1 - self.ALPHA) * self.__srtt + self.ALPHA * rtt
+        self.__samples += 1
+        self.__timeout = self.__clamp(self.__srtt + 4 * self.__rttvar)
+
+    def on_timeout(self):
+        self.__timeouts += 1
+        self.__timeout = self.__clamp(self.__timeout * 2)
+
+    def status(self) -> RttStatus:
+        return RttStatus(
+            srtt=self.__srtt,
+            rttvar=self.__rttvar,
+            timeout=self.__timeout,
+            samples=self.__samples,
+            timeouts=self.__timeouts,
+        )
+
+    def __clamp(self, timeout: float) -> float:
+        return min(self.__max_timeout, max(self.__min_timeout, timeout))
@@ -0,0 +1,155 @@
+#    Prana RC
+#    Copyright (C) 2020 Dmitry Berezovsky
+#
+#    prana is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    prana is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import logging
+import time
+from typing import Callable, Dict, List, Mapping, NamedTuple, Optional
+
+import bleak
+
+from prana_rc.radio import RadioScheduler
+
+__all__ = ("Advertisement", "AdvertisementCache", "BackgroundScanner")
+
+
+class Advertisement(NamedTuple):
+    address: str
+    bt_device_name: str
+    # Smoothed signal strength as seen by each adapter
+    rssi_by_iface: Dict[str, float]
+    # time.monotonic() of the last received advertisement
+    last_seen: float
+
+    @property
+    def rssi(self) -> int:
+        return round(max(self.rssi_by_iface.values()))
+
+
+class AdvertisementCache(object):
+    """
+    Keeps the latest advertisement of each device for TTL seconds. RSSI is smoothed with exponentially weighted
+    moving average so that a single weak packet doesn't change adapter choice.
+    """
+
+    def __init__(self, ttl: float = 60, rssi_smoothing: float = 0.3) -> None:
+        """
+        :param ttl: time in seconds device is kept in cache after its last advertisement
+        :param rssi_smoothing: weight of the new RSSI sample, 1 disables smoothing
+        """
+        if not 0 < rssi_smoothing <= 1:
+            raise ValueError("rssi_smoothing must be in range (0, 1]")
+        self.__ttl = ttl
+        self.__rssi_smoothing = rssi_smoothing
+        self.__advertisements: Dict[str, Advertisement] = {}
+
+    def update(self, iface: str, address: str, name: Optional[str], rssi: int, now: Optional[float] = None):
+        now = time.monotonic() if now is None else now
+        known = self.__advertisements.get(address)
+        if known is None or now - known.last_seen > self.__ttl:
+            rssi_by_iface = {iface: float(rssi)}
+        else:
+            rssi_by_iface = dict(known.rssi_by_iface)
+            previous = rssi_by_iface.get(iface)
+            rssi_by_iface[iface] = (
+                float(rssi) if previous is None else previous + self.__rssi_smoothing * (rssi - previous)
+            )
+        self.__advertisements[address] = Advertisement(
+            address=address,
+            bt_device_name=(name or (known.bt_device_name if known is not None else "")).strip(),
+            rssi_by_iface=rssi_by_iface,
+            last_seen=now,
+        )
+
+    def devices(self, now: Optional[float] = None) -> List[Advertisement]:
+        """
+        Returns advertisements which are not expired yet, expired ones are evicted
+        """
+        now = time.monotonic() if now is None else now
+        expired = [k for k, v in self.__advertisements.items() if now - v.last_seen > self.__ttl]
+        for address in expired:
+            del self.__advertisements[address]
+        return list(self.__advertisements.values())
+
+    def __len__(self) -> int:
+        return len(self.__advertisements)
+
+
+class BackgroundScanner(object):
+    """
+    Listens to advertisements on the given adapters in background and puts the matching ones into the cache.
+    Scanning goes through the adapter scheduler in scan windows, so it is paused while connection is being
+    established or commands are sent.
+    """
+
+    # Delay in seconds before scanning is restarted on the adapter which failed to scan
+    RETRY_DELAY = 5
+
+    def __init__(
+        self,
+        radios: Mapping[str, RadioScheduler],
+        cache: AdvertisementCache,
+        name_filter: Callable[[Optional[str]], bool] = lambda x: True,
+    ) -> None:
+        """
+        :param radios: scheduler of each adapter to scan on
+        :param cache: cache to put received advertisements to
+        :param name_filter: only devices which names match the filter are cached
+        """
+        self.__radios = dict(radios)
+        self.__cache = cache
+        self.__name_filter = name_filter
+        self.__tasks: Dict[str, asyncio.Task] = {}
+        self.__logger = logging.getLogger(self.__class__.__name__)
+
+    @property
+    def is_running(self) -> bool:
+        return len(self.__tasks) > 0
+
+    async def start(self):
+        for iface, radio in self.__radios.items():
+            if iface not in self.__tasks:
+                self.__tasks[iface] = asyncio.ensure_future(self.__scan(iface, radio))
+
+    async def stop(self):
+        tasks, self.__tasks = self.__tasks, {}
+        for task in tasks.values():
+            task.cancel()
+        await asyncio.gather(*tasks.values(), return_exceptions=True)
+
+    async def __scan(self, iface: str, radio: RadioScheduler):
+        scanner = bleak.BleakScanner(detection_callback=self.__detection_callback_for(iface), adapter=iface)
+        while True:
+            try:
+                async with radio.scan_window() as window:
+                    await scanner.start()
+                    try:
+                        await radio.wait_preempted(window)
+                    finally:
+                        await scanner.stop()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.__logger.warning("Scanning on {} failed: {}".format(iface, e))
+                await asyncio.sleep(self.RETRY_DELAY)
+
+    def __detection_callback_for(self, iface: str):
+        def detection_callback(device, advertisement_data):
+            name = advertisement_data.local_name or device.name
+            if self.__name_filter(name):
+                self.__cache.update(iface, device.address, name, advertisement_data.rssi)
+
+        return detection_callback
@@ -17,32 +17,240 @@
 import asyncio
 import datetime
 import logging
-import struct
+import time
 from asyncio import AbstractEventLoop, Lock
-from math import log2
-from typing import Dict, List, Union, Optional
+from collections import Counter, OrderedDict
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable, Dict, List, Sequence, Set, Union, Optional, Tuple
 
 import bleak
 from bleak.exc import BleakDBusError
 
-from prana_rc import utils
-from prana_rc.entity import PranaState, PranaDeviceInfo, Speed, PranaSensorsState
+from prana_rc import utils, decoder
+from prana_rc.adapters import AdapterPool, AdapterStatus, is_adapter_error, parse_adapters
+from prana_rc.broker import StateBroker
+from prana_rc.command_queue import CommandPriority, CommandQueue, CommandQueueStats
+from prana_rc.radio import RadioScheduler
+from prana_rc.rate_limit import RateLimiter, RateLimitPolicy, RateLimitStats
+from prana_rc.reply_matcher import ReplyMatcher
+from prana_rc.rtt import RttEstimator, RttStatus
+from prana_rc.scanner import Advertisement, AdvertisementCache, BackgroundScanner
+from prana_rc.state_store import StateStore
+from prana_rc.retry import (
+    RetryPolicy,
+    ExponentialBackoffRetryPolicy,
+    CircuitBreaker,
+    CircuitBreakerStatus,
+    CircuitState,
+)
+from prana_rc.entity import (
+    PranaState,
+    PranaDeviceInfo,
+    Speed,
+    SpeedChangeResult,
+    PranaDeviceDetails,
+    PranaTargetState,
+    ReconcileResult,
+    StateLayout,
+)
 from prana_rc.utils import none_throws
 
+FrameListener = Callable[[bytearray], None]
+DisconnectListener = Callable[["PranaDevice"], None]
+StateListener = Callable[["PranaDevice", PranaState], None]
+
+
+class StateCacheStats(object):
+    def __init__(self) -> None:
+        self.hits = 0
+        self.misses = 0
+        # Number of callers which joined already running read instead of issuing their own one
+        self.coalesced = 0
+
+    def to_dict(self) -> dict:
+        return dict(hits=self.hits, misses=self.misses, coalesced=self.coalesced)
+
+
+class ConnectionPoolStats(object):
+    def __init__(self) -> None:
+        # Connect requests served by already established connection
+        self.hits = 0
+        # Connect requests which required new connection to be established
+        self.misses = 0
+        # Idle connections closed to make room for the new one
+        self.evictions = 0
+        # Connections closed after being idle for longer than idle timeout
+        self.expirations = 0
+        # Connections dropped by the device or the adapter
+        self.drops = 0
+        # Dropped connections re-established in background
+        self.reconnects = 0
+
+    def to_dict(self) -> dict:
+        return dict(
+            hits=self.hits,
+            misses=self.misses,
+            evictions=self.evictions,
+            expirations=self.expirations,
+            drops=self.drops,
+            reconnects=self.reconnects,
+        )
+
+
+class DeviceDetailsRegistry(object):
+    """
+    Keeps details of the devices known to the manager and state frame layout learned for each firmware.
+    Layout is learned once CONFIRMATION_FRAMES consecutive frames of the device agree on it.
+    """
+
+    def __init__(self, confirmation_frames: int = 3) -> None:
+        self.__confirmation_frames = confirmation_frames
+        self.__details: Dict[str, PranaDeviceDetails] = {}
+        self.__layouts: Dict[str, StateLayout] = {}
+        # Layout candidate of each device and the number of consecutive frames which agree on it
+        self.__observations: Dict[str, Tuple[StateLayout, int]] = {}
+        # Devices which didn't reply to the details request, it is not repeated for them
+        self.__unanswered: Set[str] = set()
+
+    def register(self, address: str, firmware: str) -> PranaDeviceDetails:
+        details = PranaDeviceDetails(
+            address=address, firmware=firmware, state_layout=self.__layouts.get(firmware, StateLayout.AUTO)
+        )
+        self.__details[address] = details
+        return details
+
+    def observe_layout(self, address: str, layout: StateLayout) -> Optional[StateLayout]:
+        """
+        Accounts layout indicated by the frame received from the device. Disagreeing frame restarts confirmation.
+        :return: layout learned for the device firmware, if confirmed by this frame
+        """
+        details = self.__details.get(address)
+        if details is None:
+            return None
+        candidate, frames = self.__observations.get(address, (layout, 0))
+        frames = frames + 1 if candidate == layout else 1
+        self.__observations[address] = (layout, frames)
+        if frames < self.__confirmation_frames:
+            return None
+        del self.__observations[address]
+        self.__layouts[details.firmware] = layout
+        self.__details[address] = details._replace(state_layout=layout)
+        return layout
+
+    def get(self, address: str) -> Optional[PranaDeviceDetails]:
+        return self.__details.get(address)
+
+    def mark_unanswered(self, address: str):
+        self.__unanswered.add(address)
+
+    def is_unanswered(self, address: str) -> bool:
+        return address in self.__unanswered
+
+    def all(self) -> List[PranaDeviceDetails]:
+        return list(self.__details.values())
+
 
 class PranaDeviceManager(object):
     PRANA_DEVICE_NAME_PREFIXES = ["PRNAQaq", "PRANA"]
 
-    def __init__(self, iface: str = "hci0", loop: Optional[AbstractEventLoop] = None) -> None:
-        self.__ble_interface = iface
+    def __init__(
+        self,
+        iface: Union[str, Sequence[str]] = "hci0",
+        loop: Optional[AbstractEventLoop] = None,
+        command_gap: float = 0.02,
+        state_max_age: float = 5,
+        max_connections: int = 5,
+        idle_timeout: Optional[float] = 600,
+        max_concurrent_connects: int = 3,
+        retry_policy: Optional[RetryPolicy] = None,
+        breaker_failure_threshold: int = 5,
+        breaker_cooldown: float = 30,
+        keepalive_interval: Optional[float] = 30,
+        passive_scan: bool = False,
+        advertisement_ttl: float = 60,
+        rate_limit: Optional[float] = 10,
+        rate_limit_burst: int = 10,
+        rate_limit_policy: RateLimitPolicy = RateLimitPolicy.BACKPRESSURE,
+        state_store: Optional[StateStore] = None,
+    ) -> None:
+        """
+        :param iface: bluetooth interface(s) to be used, either a sequence or a comma separated string. Each device
+                      is assigned to the least loaded adapter which can reach it
+        :param loop: event loop
+        :param command_gap: minimal delay in seconds between two consecutive writes to the device
+        :param state_max_age: time in seconds the last received state is considered relevant
+        :param max_connections: maximum number of simultaneously managed connections. Least recently used idle
+                                connection is closed when the limit is reached
+        :param idle_timeout: connections which were not used for this number of seconds are closed. None or 0 disables
+        :param max_concurrent_connects: maximum number of connection attempts running at the same time
+        :param retry_policy: defines delay between connection attempts. Exponential backoff with jitter by default
+        :param breaker_failure_threshold: number of consecutive failed connection attempts after which connects to
+                                          the device are rejected for BREAKER_COOLDOWN seconds
+        :param breaker_cooldown: time in seconds connects to the failing device are rejected for
+        :param keepalive_interval: managed connections are probed with state read every KEEPALIVE_INTERVAL seconds,
+                                   dropped ones are re-established. None or 0 disables
+        :param passive_scan: if set, advertisements are collected in background and discover returns devices seen
+                             during the last ADVERTISEMENT_TTL seconds without scanning
+        :param advertisement_ttl: time in seconds device is reported by passive discover after its last advertisement
+        :param rate_limit: sustained number of writes per second allowed for each device. None disables
+        :param rate_limit_burst: number of writes each device accepts back-to-back after idle period
+        :param rate_limit_policy: whether writes exceeding the budget are delayed or rejected
+        :param state_store: persists the last state of each device. States persisted before restart are reported
+                            as restored until fresh state is received from the device
+        """
+        self.__adapters = AdapterPool(parse_adapters(iface))
+        self.__radios = {x: RadioScheduler() for x in self.__adapters.adapters}
         self.__loop = loop
+        self.__command_gap = command_gap
+        self.__state_max_age = state_max_age
+        self.__state_cache_stats = StateCacheStats()
+        self.__command_queue_stats = CommandQueueStats()
+        self.__rate_limit = rate_limit
+        self.__rate_limit_burst = rate_limit_burst
+        self.__rate_limit_policy = rate_limit_policy
+        self.__rate_limit_stats = RateLimitStats()
+        self.__details_registry = DeviceDetailsRegistry()
         self.__logger = logging.getLogger(self.__class__.__name__)
-        self.__managed_devices: Dict["str", PranaDevice] = {}
+        # Ordered from the least to the most recently used
+        self.__managed_devices: "OrderedDict[str, PranaDevice]" = OrderedDict()
+        self.__last_used: Dict[str, float] = {}
+        self.__max_connections = max_connections
+        self.__idle_timeout = idle_timeout if idle_timeout is not None and idle_timeout > 0 else None
+        self.__pool_stats = ConnectionPoolStats()
+        self.__idle_watcher: Optional[asyncio.Task] = None
+        # Connect lock of each device and the number of tasks holding or waiting for it
+        self.__connect_locks: Dict[str, Tuple[Lock, int]] = {}
+        self.__connect_slots = asyncio.BoundedSemaphore(max_concurrent_connects)
+        self.__retry_policy = retry_policy or ExponentialBackoffRetryPolicy()
+        self.__breaker_failure_threshold = breaker_failure_threshold
+        self.__breaker_cooldown = breaker_cooldown
+        self.__breakers: Dict[str, CircuitBreaker] = {}
+        # Learned reply latency outlives the connection so that reconnected device doesn't start from scratch
+        self.__rtt_estimators: Dict[str, RttEstimator] = {}
+        self.__keepalive_interval = (
+            keepalive_interval if keepalive_interval is not None and keepalive_interval > 0 else None
+        )
+        self.__supervisor: Optional[asyncio.Task] = None
+        self.__reconnects: Dict[str, asyncio.Task] = {}
+        self.__reconnect_timeout: float = 5
+        self.__state_broker = StateBroker()
+        # The latest state received from each device, outlives the connection
+        self.__last_states: Dict[str, PranaState] = {}
+        self.__state_store = state_store
+        if state_store is not None:
+            self.__last_states.update(state_store.load())
+        # Devices whose last state was loaded from the store and wasn't received since start
+        self.__restored_states: Set[str] = set(self.__last_states.keys())
+        self.__advertisements: Optional[AdvertisementCache] = None
+        self.__scanner: Optional[BackgroundScanner] = None
+        if passive_scan:
+            self.__advertisements = AdvertisementCache(advertisement_ttl)
+            self.__scanner = BackgroundScanner(self.__radios, self.__advertisements, self.__is_prana_name)
         self.__lock = Lock()
 
     @classmethod
-    def __is_prana_device(cls, dev: "bleak.backends.device.BLEDevice"):
-        return dev.name and len(list(filter(dev.name.startswith, cls.PRANA_DEVICE_NAME_PREFIXES))) > 0
+    def __is_prana_name(cls, name: Optional[str]) -> bool:
+        return bool(name) and len(list(filter(utils.none_throws(name).startswith, cls.PRANA_DEVICE_NAME_PREFIXES))) > 0
 
     @classmethod
     def __prana_dev_name_2_name(cls, dev_name: str):
@@ -64,53 +272,401 @@ class PranaDeviceManager(object):
             raise ValueError("Device must be specified either by mac address or by PranaDeviceInfo instance")
         return address
 
-    async def discover(self, timeout: int = 5) -> List[PranaDeviceInfo]:
+    async def discover(self, timeout: int = 5, fresh: bool = False) -> List[PranaDeviceInfo]:
         """
-        Listens to devices advertisement for TIMEOUT seconds and returns the list of discovered devices
+        Listens to devices advertisement for TIMEOUT seconds and returns the list of discovered devices.
+        In passive scan mode devices are returned from the advertisement cache immediately.
         :param timeout: time to wait for devices in seconds
+        :param fresh: if set, advertisement cache is bypassed and devices are discovered by the active scan
         :return: list of discovered devices
         """
+        if self.__scanner is not None and not fresh:
+            if not self.__scanner.is_running:
+                await self.start_background_scan()
+                await asyncio.sleep(timeout)  # Let the cache fill up
+            return self.__devices_from_cache()
+        adapters = self.__adapters.adapters
         async with self.__lock:
-            discovered_devs = await bleak.discover(timeout)
-        return list(
-            map(
-                lambda dev: PranaDeviceInfo(
-                    address=dev.address,
-                    bt_device_name=(dev.name or "").strip(),
-                    name=self.__prana_dev_name_2_name(dev.name),
-                    rssi=dev.rssi,
-                ),
-                filter(PranaDeviceManager.__is_prana_device, discovered_devs),
+            results = await asyncio.gather(*[self.__scan(iface, timeout) for iface in adapters], return_exceptions=True)
+        # The same device might be seen by several adapters, the strongest signal is reported
+        best_seen: "OrderedDict[str, Advertisement]" = OrderedDict()
+        errors = []
+        for iface, result in zip(adapters, results):
+            if isinstance(result, BaseException):
+                self.__logger.warning("Discovery on {} failed: {}".format(iface, result))
+                self.__adapters.record_failure(iface)
+                errors.append(result)
+                continue
+            prana_devs = [x for x in result if self.__is_prana_name(x.bt_device_name)]
+            self.__adapters.record_discovery(iface, {dev.address: dev.rssi for dev in prana_devs})
+            for dev in prana_devs:
+                if self.__advertisements is not None:
+                    self.__advertisements.update(iface, dev.address, dev.bt_device_name, dev.rssi)
+                if dev.address not in best_seen or dev.rssi > best_seen[dev.address].rssi:
+                    best_seen[dev.address] = dev
+        if len(errors) == len(adapters):
+            raise errors[0]
+        return [
+            PranaDeviceInfo(
+                address=dev.address,
+                bt_device_name=dev.bt_device_name.strip(),
+                name=self.__prana_dev_name_2_name(dev.bt_device_name),
+                rssi=dev.rssi,
             )
-        )
+            for dev in best_seen.values()
+        ]
+
+    async def __scan(self, iface: str, timeout: float) -> List[Advertisement]:
+        """
+        Actively scans on the adapter for TIMEOUT seconds in total. Scanning is split into short windows which give
+        way to connects and commands, so discovery takes longer while the adapter is busy (up to 3 * TIMEOUT).
+        """
+        radio = self.__radios[iface]
+        scanner = bleak.BleakScanner(adapter=iface)
+        found: Dict[str, Advertisement] = {}
+        scanned = 0.0
+        give_up_at = time.monotonic() + 3 * timeout
+        while scanned < timeout and time.monotonic() < give_up_at:
+            async with radio.scan_window() as window:
+                started_at = time.monotonic()
+                await scanner.start()
+                try:
+                    await radio.wait_preempted(min(window, timeout - scanned))
+                finally:
+                    await scanner.stop()
+                scanned += time.monotonic() - started_at
+            seen_at = time.monotonic()
+            for dev, advertisement_data in scanner.discovered_devices_and_advertisement_data.values():
+                known = found.get(dev.address)
+                # Name is not present in every advertisement, the last one received is kept
+                name = advertisement_data.local_name or dev.name or (known.bt_device_name if known else "")
+                found[dev.address] = Advertisement(dev.address, name, {iface: advertisement_data.rssi}, seen_at)
+        return list(found.values())
+
+    def __devices_from_cache(self) -> List[PranaDeviceInfo]:
+        advertisements = utils.none_throws(self.__advertisements).devices()
+        self.__sync_reachability(advertisements)
+        return [
+            PranaDeviceInfo(
+                address=x.address,
+                bt_device_name=x.bt_device_name,
+                name=self.__prana_dev_name_2_name(x.bt_device_name),
+                rssi=x.rssi,
+            )
+            for x in advertisements
+        ]
+
+    def __sync_reachability(self, advertisements: List[Advertisement]):
+        for iface in self.__adapters.adapters:
+            self.__adapters.record_discovery(
+                iface, {x.address: round(x.rssi_by_iface[iface]) for x in advertisements if iface in x.rssi_by_iface}
+            )
+
+    async def start_background_scan(self):
+        """
+        Starts collecting advertisements in background. Has effect only in passive scan mode.
+        """
+        if self.__scanner is not None:
+            await self.__scanner.start()
+
+    async def stop_background_scan(self):
+        if self.__scanner is not None:
+            await self.__scanner.stop()
 
     async def connect(self, target: Union[str, PranaDeviceInfo], timeout: float = 5, attempts=1) -> "PranaDevice":
         address = self.__addr_for_target(target)
         device = self.__managed_devices.get(address, None)
+        if device is not None:
+            self.__last_used[address] = time.monotonic()
+            self.__managed_devices.move_to_end(address)
+            if await device.is_connected():
+                self.__pool_stats.hits += 1
+                return device
+        # Connects to the same device are serialized while different devices are connected in parallel
+        async with self.__connect_lock_for(address):
+            return await self.__connect(address, timeout, attempts)
+
+    @asynccontextmanager
+    async def __connect_lock_for(self, address: str) -> AsyncIterator[None]:
+        """
+        Serializes connects to the device. Lock is forgotten once no task holds or waits for it
+        """
+        lock, users = self.__connect_locks.get(address, (Lock(), 0))
+        self.__connect_locks[address] = (lock, users + 1)
+        try:
+            async with lock:
+                yield
+        finally:
+            lock, users = self.__connect_locks[address]
+            if users > 1:
+                self.__connect_locks[address] = (lock, users - 1)
+            else:
+                del self.__connect_locks[address]
+
+    def __breaker_for(self, address: str) -> CircuitBreaker:
+        breaker = self.__breakers.get(address)
+        if breaker is None:
+            breaker = CircuitBreaker(address, self.__breaker_failure_threshold, self.__breaker_cooldown)
+            self.__breakers[address] = breaker
+        return breaker
+
+    async def __connect(self, address: str, timeout: float, attempts: int) -> "PranaDevice":
+        device = self.__managed_devices.get(address, None)
+        if device is not None and await device.is_connected():  # Connected by concurrent caller
+            self.__pool_stats.hits += 1
+            self.__last_used[address] = time.monotonic()
+            return device
+        breaker = self.__breaker_for(address)
+        breaker.check()
+        self.__pool_stats.misses += 1
         if device is None:  # If not found in managed devices list
-            device = PranaDevice(address, self.__loop, self.__ble_interface)
+            await self.__make_room()
+            if self.__advertisements is not None:
+                self.__sync_reachability(self.__advertisements.devices())
+            iface = self.__adapters.choose(address, self.__adapters_load())
+            device = PranaDevice(
+                address,
+                self.__loop,
+                iface,
+                radio=self.__radios[iface],
+                command_gap=self.__command_gap,
+                state_max_age=self.__state_max_age,
+                state_cache_stats=self.__state_cache_stats,
+                command_queue_stats=self.__command_queue_stats,
+                rate_limiter=self.__new_rate_limiter(),
+                rtt_estimator=self.__rtt_estimators.setdefault(address, RttEstimator()),
+                details_registry=self.__details_registry,
+            )
+            device.add_disconnect_listener(self.__on_connection_dropped)
+            device.add_state_listener(self.__on_state_received)
             self.__managed_devices[address] = device
-        # if not await device.is_connected():
+        self.__last_used[address] = time.monotonic()
+        self.__ensure_background_tasks()
         attempts_left = attempts
         while attempts_left > 0:
             current_attempt = (attempts - attempts_left) + 1
             try:
-                await device.connect(timeout)
+                await self.__failover_adapter(device)
+                # Slot is held for a single attempt only so failing device doesn't block others between retries
+                async with self.__connect_slots, self.__radios[device.iface].connection_setup():
+                    await device.connect(timeout)
+                breaker.record_success()
+                self.__adapters.record_success(device.iface)
                 return device
             except Exception as e:
-                if attempts == 1:
+                breaker.record_failure()
+                # Device being out of range or offline counts only towards its own breaker
+                if is_adapter_error(e):
+                    self.__adapters.record_failure(device.iface)
+                if attempts == 1 or breaker.state == CircuitState.OPEN:
+                    await self.__release(address)
+                    breaker.check()
                     raise e
                 self.__logger.warning("Connection failed. Attempt #{} Re-connecting...".format(current_attempt))
                 attempts_left -= 1
-                await asyncio.sleep(0.5)
+                await asyncio.sleep(self.__retry_policy.delay(current_attempt))
+        # Do not keep clients of the devices we can't connect to
+        await self.__release(address)
         raise RuntimeError("Connection to device {} failed after {} attempts".format(address, attempts))
 
+    def __new_rate_limiter(self) -> Optional[RateLimiter]:
+        if self.__rate_limit is None:
+            return None
+        return RateLimiter(
+            self.__rate_limit, self.__rate_limit_burst, self.__rate_limit_policy, self.__rate_limit_stats
+        )
+
+    def __adapters_load(self) -> Dict[str, int]:
+        return Counter(x.iface for x in self.__managed_devices.values())
+
+    async def __failover_adapter(self, device: "PranaDevice"):
+        """
+        Moves disconnected device to another adapter in case its current one stopped responding
+        """
+        if self.__adapters.is_available(device.iface):
+            return
+        load = self.__adapters_load()
+        load[device.iface] -= 1
+        iface = self.__adapters.choose(device.address, load)
+        if iface != device.iface:
+            self.__logger.info(
+                "Adapter {} is not responding. Moving device {} to {}".format(device.iface, device.address, iface)
+            )
+            await device.switch_adapter(iface, self.__radios[iface])
+
+    async def __make_room(self):
+        while len(self.__managed_devices) >= self.__max_connections:
+            candidate = next((addr for addr, dev in self.__managed_devices.items() if not dev.is_busy), None)
+            if candidate is None:
+                raise RuntimeError(
+                    "Connection limit ({}) reached and all the connections are busy".format(self.__max_connections)
+                )
+            self.__logger.info("Connection limit reached. Evicting least recently used device {}".format(candidate))
+            self.__pool_stats.evictions += 1
+            await self.__release(candidate)
+
+    async def __release(self, address: str):
+        """
+        Removes device from the pool and closes its connection. Never raises.
+        """
+        device = self.__managed_devices.pop(address, None)
+        self.__last_used.pop(address, None)
+        breaker = self.__breakers.get(address)
+        # Breaker is kept while it carries failures, otherwise it would never trip for the device connected on demand
+        if breaker is not None and breaker.status().consecutive_failures == 0:
+            del self.__breakers[address]
+        if device is None:
+            return
+        try:
+            await device.disconnect()
+        except Exception as e:
+            self.__logger.debug("Error while disconnecting {}: {}".format(address, e))
+
+    def __ensure_background_tasks(self):
+        if self.__idle_timeout is not None and (self.__idle_watcher is None or self.__idle_watcher.done()):
+            self.__idle_watcher = asyncio.ensure_future(self.__close_idle_connections())
+        if self.__keepalive_interval is not None and (self.__supervisor is None or self.__supervisor.done()):
+            self.__supervisor = asyncio.ensure_future(self.__supervise_connections())
+
+    async def __close_idle_connections(self):
+        idle_timeout = utils.none_throws(self.__idle_timeout)
+        while True:
+            await asyncio.sleep(max(1.0, idle_timeout / 2))
+            now = time.monotonic()
+            for address, device in list(self.__managed_devices.items()):
+                if device.is_busy or now - self.__last_used.get(address, now) < idle_timeout:
+                    continue
+                self.__logger.debug("Closing connection to {}: idle for more than {}s".format(address, idle_timeout))
+                self.__pool_stats.expirations += 1
+                await self.__release(address)
+
+    @property
+    def state_broker(self) -> StateBroker:
+        """
+        Fans states received from the managed devices out to the consumers with bounded mailboxes
+        """
+        return self.__state_broker
+
+    def get_last_state(self, address: str) -> Optional[PranaState]:
+        """
+        Returns the latest state received from the device without talking to it. Check state timestamp to find out
+        how old it is.
+        """
+        return self.__last_states.get(address)
+
+    def is_state_restored(self, address: str) -> bool:
+        """
+        Whether the last state of the device was loaded from the state store and might not reflect the current state
+        """
+        return address in self.__restored_states
+
+    async def warm_up(self, timeout: float = 5, attempts: int = 1):
+        """
+        Connects to the devices whose state was restored from the store and refreshes their state, so that the first
+        requests after restart don't pay for connection setup. Never raises.
+        """
+
+        async def refresh(address: str):
+            try:
+                device = await self.connect(address, timeout, attempts)
+                await device.read_state(force_read=True, priority=CommandPriority.BACKGROUND)
+            except Exception as e:
+                self.__logger.warning("Unable to warm up connection to {}: {}".format(address, e))
+
+        # Warming up more devices than the pool holds would only evict the ones just connected
+        addresses = sorted(self.__restored_states)[: self.__max_connections]
+        await asyncio.gather(*(refresh(x) for x in addresses))
+
+    def __on_state_received(self, device: "PranaDevice", state: PranaState):
+        self.__last_states[device.address] = state
+        self.__restored_states.discard(device.address)
+        if self.__state_store is not None:
+            self.__state_store.put(device.address, state)
+        self.__state_broker.publish(device.address, state)
+
+    def __on_connection_dropped(self, device: "PranaDevice"):
+        address = device.address
+        if self.__managed_devices.get(address) is not device:
+            return
+        self.__pool_stats.drops += 1
+        self.__logger.info("Connection to {} dropped. Reconnecting in background...".format(address))
+        pending = self.__reconnects.get(address)
+        if pending is None or pending.done():
+            self.__reconnects[address] = asyncio.ensure_future(self.__restore_connection(address))
+
+    async def __supervise_connections(self):
+        """
+        Probes managed connections with state reads so that dropped links are detected and re-established
+        before the next user request. Probes do not count as usage for the idle timeout.
+        """
+        keepalive_interval = utils.none_throws(self.__keepalive_interval)
+        while True:
+            await asyncio.sleep(keepalive_interval)
+            await asyncio.gather(*[self.__keepalive(address) for address in list(self.__managed_devices.keys())])
+
+    async def __keepalive(self, address: str):
+        device = self.__managed_devices.get(address)
+        if device is None or device.is_busy:  # Busy device proves the link is alive by itself
+            return
+        if not await device.is_connected():
+            await self.__restore_connection(address)
+            return
+        try:
+            # Keepalive reads give way to user requests and are spread in time on each adapter
+            async with self.__radios[device.iface].background():
+                await device.read_state(force_read=True, priority=CommandPriority.BACKGROUND)
+        except Exception as e:
+            self.__logger.debug("Keepalive of {} failed: {}".format(address, e))
+
+    async def __restore_connection(self, address: str):
+        """
+        Re-establishes dropped connection of the managed device, subscribes to notifications and resyncs state.
+        Never raises, failed attempt is repeated by the next keepalive.
+        """
+        async with self.__connect_lock_for(address):
+            device = self.__managed_devices.get(address)
+            if device is None or await device.is_connected():
+                return
+            breaker = self.__breaker_for(address)
+            if breaker.state == CircuitState.OPEN:
+                return
+            try:
+                await self.__failover_adapter(device)
+                async with self.__connect_slots:
+                    # Device might be evicted from the pool while waiting for the slot
+                    if self.__managed_devices.get(address) is not device:
+                        return
+                    async with self.__radios[device.iface].connection_setup():
+                        await device.connect(self.__reconnect_timeout)
+                breaker.record_success()
+                self.__adapters.record_success(device.iface)
+                if self.__managed_devices.get(address) is not device:
+                    self.__logger.debug("Device {} was evicted while reconnecting, closing connection".format(address))
+                    await device.disconnect()
+                    return
+                self.__pool_stats.reconnects += 1
+                await device.read_state(force_read=True)
+            except Exception as e:
+                if not await device.is_connected():
+                    breaker.record_failure()
+                    if is_adapter_error(e):
+                        self.__adapters.record_failure(device.iface)
+                self.__logger.warning("Unable to restore connection to {}: {}".format(address, e))
+
     async def disconnect_all(self):
+        background_tasks = [self.__idle_watcher, self.__supervisor] + list(self.__reconnects.values())
+        for task in background_tasks:
+            if task is not None:
+                task.cancel()
+        self.__idle_watcher = None
+        self.__supervisor = None
+        self.__reconnects = {}
         for addr, dev in list(self.__managed_devices.items()):
             try:
                 self.__logger.info("Disconnecting {}...".format(dev.address))
                 await dev.disconnect()
                 del self.__managed_devices[addr]
+                self.__last_used.pop(addr, None)
             except Exception as e:
                 self.__logger.exception("Unable to disconnect device {}: {}".format(dev.address, str(e)))
 
@@ -121,11 +677,67 @@ class PranaDeviceManager(object):
         """
         return list(self.__managed_devices.keys())
 
+    @property
+    def state_cache_stats(self) -> StateCacheStats:
+        """
+        Hit/miss counters of the state cache aggregated across all managed devices
+        """
+        return self.__state_cache_stats
+
+    @property
+    def command_queue_stats(self) -> CommandQueueStats:
+        """
+        Depth, drops and wait time of the device command queues per priority, aggregated across all managed devices
+        """
+        return self.__command_queue_stats
+
+    @property
+    def rate_limit_stats(self) -> RateLimitStats:
+        """
+        Number of writes throttled or rejected by the per device rate limit, aggregated across all managed devices
+        """
+        return self.__rate_limit_stats
+
+    @property
+    def pool_stats(self) -> ConnectionPoolStats:
+        """
+        Connection pool counters: hits, misses, evictions and idle expirations
+        """
+        return self.__pool_stats
+
+    @property
+    def retry_policy(self) -> RetryPolicy:
+        return self.__retry_policy
+
+    def get_circuit_breakers_status(self) -> List[CircuitBreakerStatus]:
+        """
+        Returns status of circuit breakers of the managed devices and of the devices which recently failed to connect
+        """
+        return [x.status() for x in self.__breakers.values()]
+
+    def get_adapters_status(self) -> List[AdapterStatus]:
+        """
+        Returns status of the bluetooth adapters used by manager
+        """
+        return self.__adapters.status()
+
+    def get_reply_rtt(self) -> Dict[str, RttStatus]:
+        """
+        Returns learned reply latency and current reply timeout of each device manager talked to
+        """
+        return {address: x.status() for address, x in self.__rtt_estimators.items()}
+
+    def get_devices_details(self) -> List[PranaDeviceDetails]:
+        """
+        Returns firmware details of the devices read since manager has been started
+        """
+        return self.__details_registry.all()
+
 
 class PranaDevice(object):
     CONTROL_SERVICE_UUID = "0000baba-0000-1000-8000-00805f9b34fb"
     CONTROL_RW_CHARACTERISTIC_UUID = "0000cccc-0000-1000-8000-00805f9b34fb"
-    STATE_MSG_PREFIX = b"\xbe\xef"
+    STATE_MSG_PREFIX = decoder.STATE_MSG_PREFIX
     MAX_BRIGHTNESS = 6
 
     class Cmd:
@@ -150,13 +762,52 @@ class PranaDevice(object):
         READ_DEVICE_DETAILS = bytearray([0xBE, 0xEF, 0x05, 0x02, 0x00, 0x00, 0x00, 0x00, 0x5A])
         CHANGE_BRIGHTNESS = bytearray([0xBE, 0xEF, 0x04, 0x02])
 
+    # Prefix of the reply frame for commands which expect reply
+    REPLY_PREFIXES: Dict[bytes, bytes] = {
+        bytes(Cmd.READ_STATE): decoder.STATE_REPLY_PREFIX,
+        bytes(Cmd.READ_DEVICE_DETAILS): decoder.DEVICE_DETAILS_MSG_PREFIX,
+    }
+    # Number of times read command is sent if reply is not received within learned reply timeout
+    REPLY_ATTEMPTS = 3
+    # Commands sent once with the fixed reply timeout. Details are read during connect which must not be stalled
+    # by the device which doesn't support the request, and their timeouts must not skew learned reply latency
+    FIXED_REPLY_TIMEOUTS: Dict[bytes, float] = {
+        bytes(Cmd.READ_DEVICE_DETAILS): 1.0,
+    }
+    # Commands whose effect depends on the current state, they must not be planned from outdated state
+    RELATIVE_COMMANDS = frozenset(
+        bytes(x)
+        for x in (Cmd.SPEED_UP, Cmd.SPEED_DOWN, Cmd.TOGGLE_HEATING, Cmd.TOGGLE_WINTER_MODE, Cmd.CHANGE_BRIGHTNESS)
+    )
+
     def __init__(
         self,
         target: Union[str, PranaDeviceInfo],
         loop: Optional[AbstractEventLoop] = None,
         iface: str = "hci0",
+        radio: Optional[RadioScheduler] = None,
+        command_gap: float = 0.02,
+        state_max_age: float = 5,
+        state_cache_stats: Optional[StateCacheStats] = None,
+        command_queue_stats: Optional[CommandQueueStats] = None,
+        rate_limiter: Optional[RateLimiter] = None,
+        rtt_estimator: Optional[RttEstimator] = None,
+        details_registry: Optional[DeviceDetailsRegistry] = None,
     ) -> None:
-        self.__address = None
+        """
+        :param target: mac address or PranaDeviceInfo instance
+        :param loop: event loop
+        :param iface: bluetooth interface to be used
+        :param radio: scheduler of the adapter traffic, commands sent by the device are reported to it
+        :param command_gap: minimal delay in seconds between two consecutive writes
+        :param state_max_age: time in seconds the last received state is considered relevant
+        :param state_cache_stats: counters to account state cache hits and misses in
+        :param command_queue_stats: counters to account command queue depth, drops and wait time in
+        :param rate_limiter: limits the rate of writes to the device, not limited if not set
+        :param rtt_estimator: learns reply latency of the device and derives reply timeout from it
+        :param details_registry: registry to store device details and learned frame layout in
+        """
+        self.__address = ""
         if isinstance(target, PranaDeviceInfo):
             self.__address = target.address
         elif isinstance(target, str):
@@ -166,31 +817,121 @@ class PranaDevice(object):
                 "PranaDevice constructor error: Target must be either mac address or PranaDeviceInfo instance"
             )
         self.__iface = iface
+        self.__radio = radio or RadioScheduler()
         self.__client = self.__new_client()
         self.__has_connect_attempts = False
-        self.__notification_bytes: Optional[bytearray] = None
         self.__state: Optional[PranaState] = None
-        self.__read_state_event: Optional[asyncio.Event] = None
+        self.__state_max_age = state_max_age
+        self.__state_cache_stats = state_cache_stats or StateCacheStats()
+        self.__inflight_read: Optional["asyncio.Future[PranaState]"] = None
+        self.__inflight_read_priority = CommandPriority.INTERACTIVE
+        self.__pending_commands = 0
+        self.__details_registry = details_registry or DeviceDetailsRegistry()
+        self.__state_layout = StateLayout.AUTO
+        self.__decode_state = decoder.state_decoder_for(StateLayout.AUTO)
+        self.__replies = ReplyMatcher()
+        self.__rtt = rtt_estimator or RttEstimator()
+        self.__frame_listeners: List[FrameListener] = []
+        self.__disconnect_listeners: List[DisconnectListener] = []
+        self.__state_listeners: List[StateListener] = []
+        self.__disconnect_requested = False
         self.__lock = Lock()
+        self.__command_queue = CommandQueue(
+            self.__write_command, inter_frame_gap=command_gap, stats=command_queue_stats, rate_limiter=rate_limiter
+        )
         self.__logger = logging.getLogger(self.__class__.__name__)
 
     def __new_client(self) -> bleak.BleakClient:
-        return bleak.BleakClient(self.__address, device=self.__iface)
+        return bleak.BleakClient(
+            self.__address, adapter=self.__iface, disconnected_callback=self.__on_client_disconnected
+        )
+
+    def __on_client_disconnected(self, client: bleak.BleakClient):
+        if self.__disconnect_requested or client is not self.__client:
+            return
+        self.__logger.warning("Device {} dropped the connection".format(self.__address))
+        # Commands waiting for reply will never get it, fail them right away
+        self.__replies.fail_all(ConnectionError("Device {} dropped the connection".format(self.__address)))
+        for listener in list(self.__disconnect_listeners):
+            try:
+                listener(self)
+            except Exception:
+                self.__logger.exception("Disconnect listener failed")
 
     async def __verify_connected(self):
         if not await self.is_connected():
             raise RuntimeError("Illegal state: device must be connected before running any commands")
 
     def notification_handler(self, sender, data):
-        """Simple notification handler which prints the data received."""
-        self.__notification_bytes = data
-        # Notify waiters
-        if self.__read_state_event is not None:
-            self.__read_state_event.set()
+        """
+        Routes received frame either to the command waiting for reply or, if frame is unsolicited,
+        updates cached state and notifies frame listeners.
+        """
+        if self.__replies.dispatch(data):
+            return  # The frame will be parsed by the waiter
+        try:
+            state = self.__parse_state(data)
+            if state is not None:
+                self.__update_state(state)
+        except Exception as e:
+            self.__logger.warning("Unable to parse notification frame: {}".format(e))
+        for listener in list(self.__frame_listeners):
+            try:
+                listener(data)
+            except Exception:
+                self.__logger.exception("Frame listener failed")
+
+    def add_frame_listener(self, listener: FrameListener) -> Callable[[], None]:
+        """
+        Subscribes LISTENER to the unsolicited frames received from the device.
+        :return: function which removes subscription
+        """
+        self.__frame_listeners.append(listener)
+
+        def unsubscribe():
+            if listener in self.__frame_listeners:
+                self.__frame_listeners.remove(listener)
+
+        return unsubscribe
+
+    def add_state_listener(self, listener: StateListener) -> Callable[[], None]:
+        """
+        Subscribes LISTENER to the decoded states, both read on request and received as notifications.
+        :return: function which removes subscription
+        """
+        self.__state_listeners.append(listener)
+
+        def unsubscribe():
+            if listener in self.__state_listeners:
+                self.__state_listeners.remove(listener)
+
+        return unsubscribe
+
+    def __update_state(self, state: PranaState):
+        self.__state = state
+        for listener in list(self.__state_listeners):
+            try:
+                listener(self, state)
+            except Exception:
+                self.__logger.exception("State listener failed")
+
+    def add_disconnect_listener(self, listener: DisconnectListener) -> Callable[[], None]:
+        """
+        Subscribes LISTENER to the connection drops. Disconnects requested via disconnect method are not reported.
+        :return: function which removes subscription
+        """
+        self.__disconnect_listeners.append(listener)
+
+        def unsubscribe():
+            if listener in self.__disconnect_listeners:
+                self.__disconnect_listeners.remove(listener)
+
+        return unsubscribe
 
     async def connect(self, timeout: float = 2):
         async with self.__lock:
             if not await self.is_connected():
+                self.__disconnect_requested = False
                 try:
                     await self.__client.connect(timeout=timeout)
                     self.__has_connect_attempts = True
@@ -199,11 +940,69 @@ class PranaDevice(object):
                     self.__client = self.__client = self.__new_client()
                     raise
                 await self.__client.start_notify(self.CONTROL_RW_CHARACTERISTIC_UUID, self.notification_handler)
-                # TODO: shall we subscribe for disconnect callback and change status?
                 # TODO: Verify prana service exists to ensure it is prana device
+                await self.__read_device_details()
+
+    async def __read_device_details(self):
+        """
+        Reads device details on the first connection and selects state decoder for the device firmware.
+        Details are not requested again on reconnect, neither from the device which didn't reply to the request.
+        """
+        known = self.__details_registry.get(self.__address)
+        if known is not None:
+            self.__use_state_layout(known.state_layout)
+            return
+        if self.__details_registry.is_unanswered(self.__address):
+            return
+        try:
+            frame = await self._send_command(self.Cmd.READ_DEVICE_DETAILS, expect_reply=True)
+        except Exception as e:
+            self.__logger.warning("Unable to read details of device {}: {}".format(self.__address, e))
+            self.__details_registry.mark_unanswered(self.__address)
+            return
+        firmware = decoder.decode_device_details_payload(frame)
+        if not firmware:
+            # Nothing to key learned layout on, frames are decoded with auto detection
+            self.__details_registry.mark_unanswered(self.__address)
+            return
+        details = self.__details_registry.register(self.__address, firmware)
+        self.__use_state_layout(details.state_layout)
+
+    def __use_state_layout(self, layout: StateLayout):
+        if layout != self.__state_layout:
+            self.__logger.debug("Device {}: using {} state layout".format(self.__address, layout.value))
+        self.__state_layout = layout
+        self.__decode_state = decoder.state_decoder_for(layout)
+
+    @property
+    def iface(self) -> str:
+        return self.__iface
+
+    async def switch_adapter(self, iface: str, radio: Optional[RadioScheduler] = None):
+        """
+        Makes the next connect go through the given bluetooth adapter. Device must be disconnected.
+        """
+        async with self.__lock:
+            if await self.is_connected():
+                raise RuntimeError("Illegal state: adapter can't be switched while device is connected")
+            self.__iface = iface
+            self.__radio = radio or RadioScheduler()
+            self.__client = self.__new_client()
+            self.__has_connect_attempts = False
+
+    @property
+    def rtt(self) -> RttStatus:
+        return self.__rtt.status()
+
+    @property
+    def details(self) -> Optional[PranaDeviceDetails]:
+        return self.__details_registry.get(self.__address)
 
     async def disconnect(self):
         async with self.__lock:
+            self.__disconnect_requested = True
+            await self.__command_queue.close()
+            self.__replies.cancel_all()
             await self.__client.disconnect()
 
     async def is_connected(self):
@@ -215,19 +1014,91 @@ class PranaDevice(object):
             self.__logger.error("Is Connected: Failed to verify connection status")
             return False
 
-    async def _send_command(self, command: bytearray, expect_reply=False):
-        async with self.__lock:
-            # Invalidate state
-            self.__state = None
-            await self.__client.write_gatt_char(self.CONTROL_RW_CHARACTERISTIC_UUID, command, response=expect_reply)
-            if expect_reply:
-                self.__read_state_event = asyncio.Event()
-                await asyncio.wait_for(self.__wait_for_read_event(), timeout=1)
-                return self.__notification_bytes
-            # await asyncio.sleep(0.6)
-            # result = await self.__client.read_gatt_char(self.CONTROL_RW_CHARACTERISTIC_UUID, use_cached=False)
-            # if expect_reply:
-            #     return result
+    def submit_command(
+        self, command: bytearray, expect_reply=False, priority: CommandPriority = CommandPriority.INTERACTIVE
+    ) -> "asyncio.Future[Optional[bytearray]]":
+        """
+        Put command into the device command queue without waiting for it to be sent
+        :param command: command to send
+        :param expect_reply: if set, the future will be resolved with reply payload
+        :param priority: interactive commands are sent before queued background ones
+        :return: future resolved once command is sent
+        """
+        return self.__track(self.__command_queue.submit(command, expect_reply, priority))
+
+    def __track(self, future: asyncio.Future) -> asyncio.Future:
+        self.__pending_commands += 1
+        future.add_done_callback(self.__on_command_done)
+        return future
+
+    def __on_command_done(self, future: asyncio.Future):
+        self.__pending_commands -= 1
+
+    @property
+    def is_busy(self) -> bool:
+        """
+        True if there are commands which are not completed yet
+        """
+        return self.__pending_commands > 0
+
+    async def _send_command(
+        self, command: bytearray, expect_reply=False, priority: CommandPriority = CommandPriority.INTERACTIVE
+    ):
+        async with self.__radio.command():
+            return await self.submit_command(command, expect_reply, priority)
+
+    async def _send_commands(self, commands: List[bytearray]) -> int:
+        """
+        Sends the sequence of write-without-response commands as a single pipelined batch
+        :return: number of commands which were actually sent
+        """
+        sent, error = await self.__send_batch(commands)
+        if error is not None:
+            raise error
+        return sent
+
+    async def __send_batch(self, commands: List[bytearray]) -> Tuple[int, Optional[BaseException]]:
+        async with self.__radio.command():
+            futures = [self.__track(x) for x in self.__command_queue.submit_many(commands)]
+            results = await asyncio.gather(*futures, return_exceptions=True)
+        errors = [x for x in results if isinstance(x, BaseException)]
+        return len(results) - len(errors), errors[0] if len(errors) > 0 else None
+
+    async def __write_command(self, command: bytearray, expect_reply: bool) -> Optional[bytearray]:
+        # Invalidate state
+        self.__state = None
+        if not expect_reply:
+            await self.__client.write_gatt_char(self.CONTROL_RW_CHARACTERISTIC_UUID, command, response=False)
+            return None
+        prefix = self.REPLY_PREFIXES.get(bytes(command))
+        if prefix is None:
+            raise ValueError("Reply to command {} can't be recognized".format(command.hex()))
+        fixed_timeout = self.FIXED_REPLY_TIMEOUTS.get(bytes(command))
+        # Only read commands expect reply, so it is safe to repeat them when reply is lost
+        attempts = 1 if fixed_timeout is not None else self.REPLY_ATTEMPTS
+        for attempt in range(1, attempts + 1):
+            # Waiter must be registered before write, otherwise fast reply could be missed
+            reply = self.__replies.expect(prefix)
+            try:
+                sent_at = time.monotonic()
+                await self.__client.write_gatt_char(self.CONTROL_RW_CHARACTERISTIC_UUID, command, response=True)
+                frame = await asyncio.wait_for(reply, timeout=fixed_timeout or self.__rtt.timeout)
+            except asyncio.TimeoutError:
+                if fixed_timeout is None:
+                    self.__rtt.on_timeout()
+                self.__logger.debug(
+                    "No reply from {} to {}. Attempt #{}".format(self.__address, command.hex(), attempt)
+                )
+                continue
+            finally:
+                self.__replies.discard(reply)
+            # Karn's rule: reply to the repeated command might be the late reply to the previous attempt
+            if attempt == 1 and fixed_timeout is None:
+                self.__rtt.add_sample(time.monotonic() - sent_at)
+            return frame
+        raise asyncio.TimeoutError(
+            "No reply from {} to {} after {} attempts".format(self.__address, command.hex(), attempts)
+        )
 
     async def set_high_speed(self):
         await self.__verify_connected()
@@ -249,46 +1120,88 @@ class PranaDevice(object):
         await self.__verify_connected()
         await self._send_command(self.Cmd.ENABLE_NIGHT_MODE)
 
-    async def set_normal_speed(self):
-        await self.set_speed(Speed.SPEED_3)
+    async def set_normal_speed(self) -> SpeedChangeResult:
+        return await self.set_speed(Speed.SPEED_3)
 
-    async def set_speed(self, speed: Speed):
-        if speed == Speed.LOW:
-            await self.set_low_speed()
-        elif speed == Speed.HIGH:
-            await self.set_high_speed()
-        elif speed == Speed.OFF:
-            await self.turn_off()
-        else:
-            # Other speeds couldn't be set with one single command
-            direction_up = speed.value <= 5
-            if direction_up:
-                await self.set_low_speed()
-                counter = Speed.LOW.value
-                while counter != speed.value:
-                    await self.speed_up()
-                    counter += 1
-            else:
-                await self.set_high_speed()
-                counter = Speed.HIGH.value
-                while counter != speed.value:
-                    await self.speed_down()
-                    counter -= 1
+    async def set_speed(self, speed: Speed) -> SpeedChangeResult:
+        """
+        Changes speed using the shortest command sequence available from the current speed.
+        Current speed is taken from the cached state or read from the device in case the target speed
+        can't be set with a single command.
+        :param speed: target speed
+        :return: number of planned and actually sent writes
+        """
+        await self.__verify_connected()
+        state = self.__state if self.__has_relevant_state() else None
+        if state is None and speed not in (Speed.OFF, Speed.LOW, Speed.HIGH):
+            state = await self.read_state()
+        plan = self._plan_speed_change(self.__speed_for_planning(state), speed)
+        sent_writes, error = await self.__send_batch(plan)
+        self.__logger.debug(
+            "Speed change to {}: planned {} writes, sent {}".format(speed.value, len(plan), sent_writes)
+        )
+        if error is not None:
+            raise error
+        return SpeedChangeResult(target=speed, planned_writes=len(plan), sent_writes=sent_writes)
+
+    @classmethod
+    def _plan_speed_change(cls, current_speed: Optional[int], target: Speed) -> List[bytearray]:
+        """
+        Builds the cheapest sequence of commands which brings device from CURRENT_SPEED to TARGET.
+        :param current_speed: current speed (0 means device is off) or None if it is unknown
+        :param target: target speed
+        :return: list of commands to be sent
+        """
+        if current_speed == target.value:
+            return []
+        if target == Speed.OFF:
+            return [cls.Cmd.STOP]
+        if target == Speed.LOW:
+            return [cls.Cmd.ENABLE_NIGHT_MODE]
+        if target == Speed.HIGH:
+            return [cls.Cmd.ENABLE_HIGH_SPEED]
+        candidates = []
+        # Direct step is only possible when device is running, otherwise it must be reset first
+        if current_speed is not None and current_speed > Speed.OFF.value:
+            step = cls.Cmd.SPEED_UP if target.value > current_speed else cls.Cmd.SPEED_DOWN
+            candidates.append([step] * abs(target.value - current_speed))
+        candidates.append([cls.Cmd.ENABLE_NIGHT_MODE] + [cls.Cmd.SPEED_UP] * (target.value - Speed.LOW.value))
+        candidates.append([cls.Cmd.ENABLE_HIGH_SPEED] + [cls.Cmd.SPEED_DOWN] * (Speed.HIGH.value - target.value))
+        return min(candidates, key=len)
+
+    @staticmethod
+    def __speed_for_planning(state: Optional[PranaState]) -> Optional[int]:
+        if state is None:
+            return None
+        if not state.is_on:
+            return Speed.OFF.value
+        # In auto mode or with independent flows there is no single speed to step from
+        if state.auto_mode or (not state.flows_locked and state.speed_in != state.speed_out):
+            return None
+        return int(state.speed)
 
     async def set_brightness(self, brightness: int):
         if brightness < 0 or brightness > 6:
             raise ValueError("brightness value must be in range 0-6")
         original_state = await self.read_state()
-        original_brightness = none_throws(original_state.brightness)
-        if brightness == original_brightness:
+        plan = self._plan_brightness_change(none_throws(original_state.brightness), brightness)
+        if len(plan) == 0:
             return
-        if brightness > original_brightness:
-            counter = brightness - original_brightness
+        await self.__verify_connected()
+        await self._send_commands(plan)
+
+    @classmethod
+    def _plan_brightness_change(cls, current: int, target: int) -> List[bytearray]:
+        """
+        Brightness can only be increased, it wraps around after reaching MAX_BRIGHTNESS
+        """
+        if target == current:
+            return []
+        if target > current:
+            counter = target - current
         else:
-            counter = brightness + (self.MAX_BRIGHTNESS - original_brightness)
-        while counter > 0:
-            await self.brightness_up()
-            counter -= 1
+            counter = target + (cls.MAX_BRIGHTNESS - current)
+        return [cls.Cmd.CHANGE_BRIGHTNESS] * counter
 
     async def set_brightness_pct(self, brightness_pct: int):
         """
@@ -318,68 +1231,145 @@ class PranaDevice(object):
         await self.__verify_connected()
         await self._send_command(self.Cmd.STOP)
 
-    async def turn_on(self, speed=Speed.SPEED_3):
-        await self.set_speed(speed)
+    async def turn_on(self, speed=Speed.SPEED_3) -> SpeedChangeResult:
+        return await self.set_speed(speed)
+
+    async def reconcile(self, target: PranaTargetState) -> ReconcileResult:
+        """
+        Brings device to the TARGET state. Current state is read once (or taken from the cache), all the required
+        commands are sent as a single batch and the result is verified by the state notification. Device is polled
+        only if no matching notification is received within the reply timeout. Cached state is used only if the
+        plan has no toggles or steps, otherwise actual state is read.
+        :param target: desired state, fields which are not set are left as is
+        """
+        if target.brightness is not None and not 0 <= target.brightness <= self.MAX_BRIGHTNESS:
+            raise ValueError("brightness value must be in range 0-{}".format(self.MAX_BRIGHTNESS))
+        await self.__verify_connected()
+        from_cache = self.__has_relevant_state()
+        state = await self.read_state()
+        plan = self._plan_reconciliation(state, target)
+        if from_cache and any(bytes(x) in self.RELATIVE_COMMANDS for x in plan):
+            state = await self.read_state(force_read=True)
+            plan = self._plan_reconciliation(state, target)
+        if len(plan) == 0:
+            return ReconcileResult(state, 0, 0, self._state_matches(state, target), False)
+        notified = asyncio.Event()
+        unsubscribe = self.add_frame_listener(lambda frame: notified.set())
+        try:
+            sent_writes, error = await self.__send_batch(plan)
+            if error is not None:
+                raise error
+            new_state = await self.__wait_for_state_notification(target, self.__rtt.timeout, notified)
+        finally:
+            unsubscribe()
+        verified_by_notification = new_state is not None
+        if new_state is None:
+            new_state = await self.read_state(force_read=True)
+        converged = self._state_matches(new_state, target)
+        if not converged:
+            self.__logger.warning("Device {} didn't reach target state {}".format(self.__address, target))
+        return ReconcileResult(new_state, len(plan), sent_writes, converged, verified_by_notification)
+
+    async def __wait_for_state_notification(
+        self, target: PranaTargetState, timeout: float, notified: asyncio.Event
+    ) -> Optional[PranaState]:
+        deadline = time.monotonic() + timeout
+        while True:
+            # State received via notification is kept in cache until the next write
+            if self.__state is not None and self._state_matches(self.__state, target):
+                return self.__state
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            notified.clear()
+            try:
+                await asyncio.wait_for(notified.wait(), remaining)
+            except asyncio.TimeoutError:
+                return None
+
+    @classmethod
+    def _plan_reconciliation(cls, state: PranaState, target: PranaTargetState) -> List[bytearray]:
+        """
+        Builds the shortest sequence of commands which brings device from STATE to TARGET
+        """
+        plan: List[bytearray] = []
+        if target.speed is not None:
+            plan.extend(cls._plan_speed_change(cls.__speed_for_planning(state), target.speed))
+        if target.night_mode and not state.night_mode and cls.Cmd.ENABLE_NIGHT_MODE not in plan:
+            plan.append(cls.Cmd.ENABLE_NIGHT_MODE)
+        if target.heating is not None and state.mini_heating_enabled != target.heating:
+            plan.append(cls.Cmd.TOGGLE_HEATING)
+        if target.winter_mode is not None and state.winter_mode_enabled != target.winter_mode:
+            plan.append(cls.Cmd.TOGGLE_WINTER_MODE)
+        if target.brightness is not None:
+            plan.extend(cls._plan_brightness_change(none_throws(state.brightness), target.brightness))
+        return plan
+
+    @staticmethod
+    def _state_matches(state: PranaState, target: PranaTargetState) -> bool:
+        if target.speed is not None:
+            if target.speed == Speed.OFF:
+                if state.is_on:
+                    return False
+            elif not state.is_on or state.speed != target.speed.value:
+                return False
+        return (
+            (target.night_mode is None or bool(state.night_mode) == target.night_mode)
+            and (target.heating is None or state.mini_heating_enabled == target.heating)
+            and (target.winter_mode is None or state.winter_mode_enabled == target.winter_mode)
+            and (target.brightness is None or state.brightness == target.brightness)
+        )
 
     def __parse_state(self, data: bytearray) -> Optional[PranaState]:
-        if not data[:2] == self.STATE_MSG_PREFIX:
-            return None
-        self.__logger.debug("State data:")
-        self.__logger.debug(",".join("0x{:02x}".format(x) for x in data))
-        s = PranaState()
-        s.timestamp = datetime.datetime.now()
-        s.brightness = int(log2(data[12]) + 1)
-        s.speed_locked = int(data[26] / 10)
-        s.speed_in = int(data[30] / 10)
-        s.speed_out = int(data[34] / 10)
-        s.auto_mode = bool(data[20])
-        s.night_mode = bool(data[16])
-        s.flows_locked = bool(data[22])
-        s.is_on = bool(data[10])
-        s.mini_heating_enabled = bool(data[14])
-        s.winter_mode_enabled = bool(data[42])
-        s.is_input_fan_on = bool(data[28])
-        s.is_output_fan_on = bool(data[32])
-        # Reading sensors
-        sensors = PranaSensorsState()
-        sensors.humidity = int(data[60] - 128)
-        sensors.pressure = 512 + int(data[78])
-        # co2 and voc
-        sensors.co2 = int(struct.unpack_from(">h", data, 61)[0] & 0b0011111111111111)
-        sensors.voc = int(struct.unpack_from(">h", data, 63)[0] & 0b0011111111111111)
-        if 0 < sensors.co2 < 10000:
-            # Different version of firmware ???
-            sensors.temperature_in = float(struct.unpack_from(">h", data, 51)[0] & 0b0011111111111111) / 10.0
-            sensors.temperature_out = float(struct.unpack_from(">h", data, 54)[0] & 0b0011111111111111) / 10.0
-        else:
-            sensors.temperature_in = float(data[49]) / 10
-            sensors.temperature_out = float(data[55]) / 10
-        # Add sensors to the state only in case device has corresponding hardware
-        if sensors.humidity > 0:
-            s.sensors = sensors
-        return s
+        state = self.__decode_state(data)
+        if self.__state_layout == StateLayout.AUTO and state is not None:
+            evidence = decoder.state_layout_evidence(state.sensors)
+            if evidence is not None:
+                learned = self.__details_registry.observe_layout(self.__address, evidence)
+                if learned is not None:
+                    self.__use_state_layout(learned)
+        return state
 
-    async def read_state(self, force_read: bool = False) -> PranaState:
+    async def read_state(
+        self, force_read: bool = False, priority: CommandPriority = CommandPriority.INTERACTIVE
+    ) -> PranaState:
         """
-        Read state from the devcie and return it as an object
+        Read state from the device and return it as an object. Cached state is returned in case it is not older than
+        STATE_MAX_AGE seconds. Concurrent callers share a single read command.
         :param force_read: If set, cached state will be ignored and read command to the device will be generated
+        :param priority: priority of the read command. Background reads might be dropped if device is busy
         :return:
         """
         await self.__verify_connected()
-        state_bin = await self._send_command(self.Cmd.READ_STATE, expect_reply=True)
+        if not force_read and self.__has_relevant_state():
+            self.__state_cache_stats.hits += 1
+            return utils.none_throws(self.__state)
+        if (
+            self.__inflight_read is not None
+            and not self.__inflight_read.done()
+            and self.__inflight_read_priority <= priority
+        ):
+            # Join the read which is already in progress unless it has lower priority and might be dropped
+            self.__state_cache_stats.coalesced += 1
+            return await asyncio.shield(self.__inflight_read)
+        self.__state_cache_stats.misses += 1
+        self.__inflight_read = asyncio.ensure_future(self.__read_state_from_device(priority))
+        self.__inflight_read_priority = priority
+        self.__inflight_read.add_done_callback(lambda f: f.cancelled() or f.exception())
+        return await asyncio.shield(self.__inflight_read)
+
+    async def __read_state_from_device(self, priority: CommandPriority) -> PranaState:
+        state_bin = await self._send_command(self.Cmd.READ_STATE, expect_reply=True, priority=priority)
         state = self.__parse_state(state_bin)
         if state is not None:
-            self.__state = state
+            self.__update_state(state)
         return utils.none_throws(state)
 
-    async def __wait_for_read_event(self):
-        if self.__read_state_event is not None:
-            await self.__read_state_event.wait()
-
     def __has_relevant_state(self) -> bool:
         return not (
             self.__state is None
-            or (datetime.datetime.now() - utils.none_throws(self.__state.timestamp)).total_seconds() > 60
+            or (datetime.datetime.now() - utils.none_throws(self.__state.timestamp)).total_seconds()
+            > self.__state_max_age
         )
 
     @property
@@ -0,0 +1,101 @@
+#    Prana RC
+#    Copyright (C) 2020 Dmitry Berezovsky
+#
+#    prana is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    prana is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import datetime
+import json
+import logging
+import sqlite3
+from typing import Any, Dict, Optional
+
+from prana_rc.entity import PranaSensorsState, PranaState
+
+__all__ = ("StateStore",)
+
+
+class StateStore(object):
+    """
+    Persists the last state of each device to SQLite database so it survives restart. Writes are batched: states
+    are kept in memory and flushed to disk at most once per FLUSH_INTERVAL seconds and on close.
+    """
+
+    def __init__(self, path: str, flush_interval: float = 5) -> None:
+        """
+        :param path: database file, created if doesn't exist
+        :param flush_interval: maximum time in seconds received state stays in memory before it is written to disk
+        """
+        self.__flush_interval = flush_interval
+        self.__pending: Dict[str, PranaState] = {}
+        self.__flush_timer: Optional[asyncio.TimerHandle] = None
+        self.__logger = logging.getLogger(self.__class__.__name__)
+        self.__db = sqlite3.connect(path)
+        with self.__db:
+            self.__db.execute("CREATE TABLE IF NOT EXISTS device_state (address TEXT PRIMARY KEY, state TEXT NOT NULL)")
+
+    def load(self) -> Dict[str, PranaState]:
+        """
+        Returns the last persisted state of each device. Records which can't be parsed are skipped.
+        """
+        states = {}
+        for address, serialized in self.__db.execute("SELECT address, state FROM device_state"):
+            try:
+                states[address] = self.__deserialize(serialized)
+            except Exception as e:
+                self.__logger.warning("Ignoring persisted state of {}: {}".format(address, e))
+        return states
+
+    def put(self, address: str, state: PranaState):
+        self.__pending[address] = state
+        if self.__flush_timer is None:
+            self.__flush_timer = asyncio.get_event_loop().call_later(self.__flush_interval, self.flush)
+
+    def flush(self):
+        if self.__flush_timer is not None:
+            self.__flush_timer.cancel()
+            self.__flush_timer = None
+        pending, self.__pending = self.__pending, {}
+        if len(pending) == 0:
+            return
+        try:
+            with self.__db:
+                self.__db.executemany(
+                    "INSERT OR REPLACE INTO device_state (address, state) VALUES (?, ?)",
+                    [(address, self.__serialize(state)) for address, state in pending.items()],
+                )
+        except sqlite3.Error as e:
+            self.__logger.warning("Unable to persist device states: {}".format(e))
+
+    def close(self):
+        self.flush()
+        self.__db.close()
+
+    @staticmethod
+    def __serialize(state: PranaState) -> str:
+        fields: Dict[str, Any] = state._asdict()
+        if state.sensors is not None:
+            fields["sensors"] = state.sensors._asdict()
+        if state.timestamp is not None:
+            fields["timestamp"] = state.timestamp.isoformat()
+        return json.dumps(fields)
+
+    @staticmethod
+    def __deserialize(serialized: str) -> PranaState:
+        fields = {k: v for k, v in json.loads(serialized).items() if k in PranaState._fields}
+        if fields.get("sensors") is not None:
+            fields["sensors"] = PranaSensorsState(**fields["sensors"])
+        if fields.get("timestamp") is not None:
+            fields["timestamp"] = datetime.datetime.fromisoformat(fields["timestamp"])
+        return PranaState(**fields)
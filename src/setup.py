@@ -106,7 +106,7 @@ setup(
     # py_modules=["app", 'cli', 'daemonize'],
 
     install_requires=[
-        'bleak>=0.11.0',
+        'bleak>=0.19.0',
         'typing>=3.6',
     ],
 
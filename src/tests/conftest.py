@@ -0,0 +1,128 @@
+#    Prana RC
+#    Copyright (C) 2020 Dmitry Berezovsky
+#
+#    prana is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    prana is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import logging
+
+import pytest
+from bleak.exc import BleakError
+
+# Sample state frames covering different hardware / firmware layouts
+SAMPLE_STATE_FRAMES = {
+    # Running at speed 4, sensors with CO2 / VOC
+    "sensors": bytes.fromhex(
+        "beef0501000000000000010004000000000000000000010000002800010028000100280000000000000000000000000000000000d7"
+        "00005a00000000ad026c007b00000000000000000000000000f300"
+    ),
+    # Night mode, older firmware which reports temperatures as single bytes
+    "legacy_sensors": bytes.fromhex(
+        "beef0501000000000000010020000100010000000000010000000a0001000a0001000a0000000000000001000000000000dd000000"
+        "00002500000000b40000000000000000000000000000000000f000"
+    ),
+    # Idle device without sensors
+    "no_sensors": bytes.fromhex(
+        "beef0501000000000000000001000000000000000000000000001e00000014000000320000000000000000000000000000000000"
+        "000000000000000000000000000000000000000000000000000000"
+    ),
+}
+
+SAMPLE_DETAILS_FRAME = bytes.fromhex("beef0502012a")
+
+
+class FakeBleakClient(object):
+    """
+    Emulates connection to the prana device. Replies to read commands with sample frames
+    """
+
+    instances = []  # type: list
+    connect_delays = {}  # type: dict
+    failing_adapters = set()  # type: set
+    unreachable_devices = set()  # type: set
+
+    def __init__(self, address, **kwargs):
+        self.address = address
+        self.iface = kwargs.get("adapter")
+        self.is_connected = False
+        self.written = []
+        self.state_frame = SAMPLE_STATE_FRAMES["sensors"]
+        self.notification_handler = None
+        # Number of the following read commands device won't reply to
+        self.lost_replies = 0
+        # If set, device switches to this state and notifies about it once it receives a control command
+        self.state_after_control = None
+        self.disconnected_callback = kwargs.get("disconnected_callback")
+        FakeBleakClient.instances.append(self)
+
+    async def connect(self, timeout=None):
+        await asyncio.sleep(FakeBleakClient.connect_delays.get(self.address, 0))
+        if self.iface in FakeBleakClient.failing_adapters:
+            raise BleakError("Bluetooth adapter {} is not available".format(self.iface))
+        if self.address in FakeBleakClient.unreachable_devices:
+            raise asyncio.TimeoutError()
+        self.is_connected = True
+
+    async def disconnect(self):
+        self.is_connected = False
+        if self.disconnected_callback is not None:
+            self.disconnected_callback(self)
+
+    def drop(self):
+        """Emulates connection loss caused by the device"""
+        self.is_connected = False
+        self.disconnected_callback(self)
+
+    async def start_notify(self, uuid, handler):
+        self.notification_handler = handler
+
+    async def write_gatt_char(self, uuid, data, response=False):
+        self.written.append(bytes(data))
+        if self.lost_replies > 0 and data[:3] == b"\xbe\xef\x05":
+            self.lost_replies -= 1
+            return
+        if data[:4] == b"\xbe\xef\x05\x01":
+            self.notification_handler(uuid, bytearray(self.state_frame))
+        elif data[:4] == b"\xbe\xef\x05\x02":
+            self.notification_handler(uuid, bytearray(SAMPLE_DETAILS_FRAME))
+        elif self.state_after_control is not None:
+            self.state_frame = self.state_after_control
+            self.notification_handler(uuid, bytearray(self.state_frame))
+
+
+@pytest.fixture
+def fake_bleak_client(monkeypatch):
+    import prana_rc.service
+
+    FakeBleakClient.instances = []
+    FakeBleakClient.connect_delays = {}
+    FakeBleakClient.failing_adapters = set()
+    FakeBleakClient.unreachable_devices = set()
+    monkeypatch.setattr(prana_rc.service.bleak, "BleakClient", FakeBleakClient)
+    return FakeBleakClient
+
+
+@pytest.fixture(params=sorted(SAMPLE_STATE_FRAMES.keys()))
+def state_frame(request) -> bytes:
+    return SAMPLE_STATE_FRAMES[request.param]
+
+
+@pytest.fixture
+def no_frame_dumps():
+    # Frame dumps are only produced when debug logging is enabled, keep them out of measurements
+    logger = logging.getLogger("prana_rc.decoder")
+    level = logger.level
+    logger.setLevel(logging.INFO)
+    yield
+    logger.setLevel(level)
@@ -0,0 +1,114 @@
+#    Prana RC
+#    Copyright (C) 2020 Dmitry Berezovsky
+#
+#    prana is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    prana is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+
+import pytest
+
+from bleak.exc import BleakDBusError, BleakError
+
+from prana_rc.adapters import AdapterPool, is_adapter_error, parse_adapters
+from prana_rc.retry import FixedDelayRetryPolicy
+from prana_rc.service import PranaDeviceManager
+
+
+class TestAdapterPool:
+
+    def test_parse_adapters(self):
+        assert parse_adapters("hci0") == ["hci0"]
+        assert parse_adapters("hci0, hci1,hci0") == ["hci0", "hci1"]
+        assert parse_adapters(("hci1", "hci2")) == ["hci1", "hci2"]
+        with pytest.raises(ValueError):
+            parse_adapters(" , ")
+
+    def test_least_loaded_adapter_is_chosen(self):
+        pool = AdapterPool(["hci0", "hci1"])
+        assert pool.choose("00:00:00:00:00:01", {"hci0": 1}) == "hci1"
+        assert pool.choose("00:00:00:00:00:01", {"hci0": 1, "hci1": 1}) == "hci0"
+
+    def test_only_adapters_which_see_device_are_used(self):
+        pool = AdapterPool(["hci0", "hci1", "hci2"])
+        pool.record_discovery("hci0", {"00:00:00:00:00:01": -90})
+        pool.record_discovery("hci2", {"00:00:00:00:00:01": -60})
+        # Equal load, stronger signal wins
+        assert pool.choose("00:00:00:00:00:01", {}) == "hci2"
+        assert pool.choose("00:00:00:00:00:01", {"hci2": 2, "hci1": 0}) == "hci0"
+
+    def test_unresponsive_adapter_is_skipped(self):
+        pool = AdapterPool(["hci0", "hci1"], failure_threshold=2)
+        pool.record_failure("hci0")
+        assert pool.is_available("hci0")
+        pool.record_failure("hci0")
+        assert not pool.is_available("hci0")
+        assert pool.choose("00:00:00:00:00:01", {"hci1": 5}) == "hci1"
+        pool.record_success("hci0")
+        assert pool.is_available("hci0")
+
+
+class TestMultiAdapterManager:
+
+    def test_devices_are_spread_across_adapters(self, fake_bleak_client):
+        async def scenario():
+            manager = PranaDeviceManager(iface="hci0,hci1", idle_timeout=None, keepalive_interval=None)
+            devices = [await manager.connect("00:00:00:00:00:0{}".format(i)) for i in range(1, 5)]
+            ifaces = [x.iface for x in devices]
+            await manager.disconnect_all()
+            return ifaces
+
+        assert sorted(asyncio.run(scenario())) == ["hci0", "hci0", "hci1", "hci1"]
+
+    def test_connection_fails_over_to_another_adapter(self, fake_bleak_client):
+        fake_bleak_client.failing_adapters.add("hci0")
+
+        async def scenario():
+            manager = PranaDeviceManager(
+                iface=["hci0", "hci1"],
+                idle_timeout=None,
+                keepalive_interval=None,
+                retry_policy=FixedDelayRetryPolicy(0),
+            )
+            device = await manager.connect("00:00:00:00:00:01", attempts=4)
+            status = {x.iface: x.available for x in manager.get_adapters_status()}
+            await manager.disconnect_all()
+            return device.iface, status
+
+        iface, status = asyncio.run(scenario())
+        assert iface == "hci1"
+        assert status == {"hci0": False, "hci1": True}
+
+    def test_unreachable_device_does_not_affect_adapter(self, fake_bleak_client):
+        fake_bleak_client.unreachable_devices.add("00:00:00:00:00:01")
+
+        async def scenario():
+            manager = PranaDeviceManager(
+                iface=["hci0", "hci1"],
+                idle_timeout=None,
+                keepalive_interval=None,
+                retry_policy=FixedDelayRetryPolicy(0),
+            )
+            with pytest.raises(RuntimeError):
+                await manager.connect("00:00:00:00:00:01", attempts=4)
+            return manager.get_adapters_status()
+
+        status = asyncio.run(scenario())
+        assert all(x.available and x.consecutive_failures == 0 for x in status)
+
+    def test_adapter_errors(self):
+        assert is_adapter_error(BleakError("Bluetooth adapter hci0 not found"))
+        assert is_adapter_error(BleakDBusError("org.bluez.Error.NotReady", []))
+        assert not is_adapter_error(BleakDBusError("org.bluez.Error.Failed", ["le-connection-abort-by-local"]))
+        assert not is_adapter_error(BleakError("Device with address 00:00:00:00:00:01 was not found"))
+        assert not is_adapter_error(asyncio.TimeoutError())
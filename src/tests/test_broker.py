@@ -0,0 +1,71 @@
+#    Prana RC
+#    Copyright (C) 2020 Dmitry Berezovsky
+#
+#    prana is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    prana is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+
+from prana_rc.broker import Mailbox, StateBroker
+from prana_rc.entity import PranaState
+
+STATE = PranaState(speed_locked=3, is_on=True, brightness=2)
+
+
+class TestMailbox:
+
+    def test_latest_state_of_each_device_is_kept(self):
+        async def scenario():
+            mailbox = Mailbox(capacity=2)
+            for brightness in range(5):
+                mailbox.put("00:00:00:00:00:01", STATE._replace(brightness=brightness))
+            mailbox.put("00:00:00:00:00:02", STATE)
+            mailbox.put("00:00:00:00:00:03", STATE)
+            return mailbox.drain(), mailbox
+
+        pending, mailbox = asyncio.run(scenario())
+        assert [x[0] for x in pending] == ["00:00:00:00:00:02", "00:00:00:00:00:03"]
+        assert mailbox.conflated == 4
+        assert mailbox.dropped == 1
+        assert len(mailbox) == 0
+
+    def test_wait(self):
+        async def scenario():
+            mailbox = Mailbox(capacity=1, addresses=["00:00:00:00:00:01"])
+            mailbox.put("00:00:00:00:00:02", STATE)
+            filtered = await mailbox.wait(0.01)
+            asyncio.get_running_loop().call_later(0.01, mailbox.put, "00:00:00:00:00:01", STATE)
+            return filtered, await mailbox.wait(1)
+
+        assert asyncio.run(scenario()) == (False, True)
+
+
+class TestStateBroker:
+
+    def test_slow_consumer_does_not_affect_others(self):
+        async def scenario():
+            broker = StateBroker(mailbox_capacity=4)
+            slow = broker.subscribe()
+            fast = broker.subscribe()
+            received = []
+            for i in range(100):
+                broker.publish("00:00:00:00:00:{:02x}".format(i % 10), STATE._replace(brightness=i))
+                received.extend(fast.drain())
+            return received, slow, broker
+
+        received, slow, broker = asyncio.run(scenario())
+        assert len(received) == 100
+        assert len(slow) == 4
+        # The latest states of the most recently updated devices are kept
+        assert [x[1].brightness for x in slow.drain()] == [96, 97, 98, 99]
+        assert broker.stats.to_dict() == dict(published=100, conflated=0, dropped=96)
@@ -0,0 +1,104 @@
+#    Prana RC
+#    Copyright (C) 2020 Dmitry Berezovsky
+#    
+#    prana is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#    
+#    prana is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#    
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+
+import pytest
+
+from prana_rc.command_queue import CommandDroppedError, CommandPriority, CommandQueue
+
+
+class TestCommandQueue:
+
+    def test_commands_are_sent_in_order(self):
+        sent = []
+
+        async def writer(command, expect_reply):
+            sent.append(bytes(command))
+            return b"reply" if expect_reply else None
+
+        async def scenario():
+            queue = CommandQueue(writer)
+            futures = queue.submit_many([bytearray(b"\x01"), bytearray(b"\x02")])
+            reply = await queue.submit(bytearray(b"\x03"), expect_reply=True)
+            await asyncio.gather(*futures)
+            await queue.close()
+            return reply
+
+        assert asyncio.run(scenario()) == b"reply"
+        assert sent == [b"\x01", b"\x02", b"\x03"]
+
+    def test_failed_command_cancels_rest_of_batch(self):
+        sent = []
+
+        async def writer(command, expect_reply):
+            if command == bytearray(b"\x02"):
+                raise IOError("write failed")
+            sent.append(bytes(command))
+
+        async def scenario():
+            queue = CommandQueue(writer)
+            futures = queue.submit_many([bytearray(b"\x01"), bytearray(b"\x02"), bytearray(b"\x03")])
+            results = await asyncio.gather(*futures, return_exceptions=True)
+            await queue.close()
+            return results
+
+        results = asyncio.run(scenario())
+        assert results[0] is None
+        assert isinstance(results[1], IOError)
+        assert isinstance(results[2], asyncio.CancelledError)
+        assert sent == [b"\x01"]
+
+    def test_interactive_commands_go_before_background(self):
+        sent = []
+
+        async def writer(command, expect_reply):
+            sent.append(bytes(command))
+
+        async def scenario():
+            queue = CommandQueue(writer)
+            background = [queue.submit(bytearray([x]), priority=CommandPriority.BACKGROUND) for x in (1, 2)]
+            interactive = queue.submit_many([bytearray(b"\x03"), bytearray(b"\x04")])
+            await asyncio.gather(*background, *interactive)
+            await queue.close()
+            return queue.stats.to_dict()
+
+        stats = asyncio.run(scenario())
+        assert sent == [b"\x03", b"\x04", b"\x01", b"\x02"]
+        assert stats["interactive"]["sent"] == 2
+        assert stats["background"]["sent"] == 2
+        assert stats["background"]["depth"] == 0
+        assert stats["background"]["avg_wait"] >= stats["interactive"]["avg_wait"]
+
+    def test_background_commands_are_dropped_when_saturated(self):
+        async def writer(command, expect_reply):
+            pass
+
+        async def scenario():
+            queue = CommandQueue(writer, saturation_depth=2)
+            interactive = queue.submit_many([bytearray(b"\x01"), bytearray(b"\x02")])
+            dropped = queue.submit(bytearray(b"\x03"), priority=CommandPriority.BACKGROUND)
+            with pytest.raises(CommandDroppedError):
+                await dropped
+            # Interactive commands are never dropped
+            await asyncio.gather(*interactive, queue.submit(bytearray(b"\x04")))
+            await queue.close()
+            return queue.stats.to_dict()
+
+        stats = asyncio.run(scenario())
+        assert stats["background"]["dropped"] == 1
+        assert stats["interactive"]["dropped"] == 0
+        assert stats["interactive"]["sent"] == 3
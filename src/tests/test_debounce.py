@@ -0,0 +1,103 @@
+#    Prana RC
+#    Copyright (C) 2020 Dmitry Berezovsky
+#
+#    prana is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    prana is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+
+from prana_rc.contrib.api.debounce import StateIntentDebouncer
+from prana_rc.entity import PranaTargetState, Speed
+
+
+class TestStateIntentDebouncer:
+
+    def test_burst_is_applied_once(self):
+        applied = []
+
+        async def apply(target):
+            applied.append(target)
+            return "state after {}".format(len(applied))
+
+        async def scenario():
+            debouncer = StateIntentDebouncer(window=0.05)
+            calls = [
+                debouncer.submit("00:00:00:00:00:01", PranaTargetState(brightness=1, heating=True), apply),
+                debouncer.submit("00:00:00:00:00:01", PranaTargetState(brightness=2), apply),
+                debouncer.submit("00:00:00:00:00:01", PranaTargetState(brightness=3, speed=Speed.SPEED_5), apply),
+                debouncer.submit("00:00:00:00:00:02", PranaTargetState(speed=Speed.OFF), apply),
+            ]
+            return await asyncio.gather(*calls), debouncer.superseded
+
+        results, superseded = asyncio.run(scenario())
+        assert sorted(applied, key=lambda x: x.speed.value) == [
+            PranaTargetState(speed=Speed.OFF),
+            PranaTargetState(speed=Speed.SPEED_5, heating=True, brightness=3),
+        ]
+        # All the callers of the same device get the same final result
+        assert len(set(results[:3])) == 1
+        assert superseded == 2
+
+    def test_intent_is_not_delayed_forever(self):
+        applied = []
+
+        async def apply(target):
+            applied.append(target)
+
+        async def scenario():
+            debouncer = StateIntentDebouncer(window=0.05, max_delay=0.1)
+            calls = []
+            for brightness in range(6):
+                calls.append(
+                    asyncio.ensure_future(
+                        debouncer.submit("00:00:00:00:00:01", PranaTargetState(brightness=brightness), apply)
+                    )
+                )
+                await asyncio.sleep(0.03)
+            await asyncio.gather(*calls)
+
+        asyncio.run(scenario())
+        assert len(applied) == 2
+        assert applied[-1].brightness == 5
+
+    def test_error_is_delivered_to_all_callers(self):
+        async def apply(target):
+            raise RuntimeError("device is unavailable")
+
+        async def scenario():
+            debouncer = StateIntentDebouncer(window=0.01)
+            return await asyncio.gather(
+                debouncer.submit("00:00:00:00:00:01", PranaTargetState(brightness=1), apply),
+                debouncer.submit("00:00:00:00:00:01", PranaTargetState(brightness=2), apply),
+                return_exceptions=True,
+            )
+
+        results = asyncio.run(scenario())
+        assert len(results) == 2
+        assert all(isinstance(x, RuntimeError) for x in results)
+
+    def test_cancelled_apply_is_delivered_to_callers(self):
+        async def apply(target):
+            raise asyncio.CancelledError()
+
+        async def scenario():
+            debouncer = StateIntentDebouncer(window=0.01)
+            return await asyncio.gather(
+                debouncer.submit("00:00:00:00:00:01", PranaTargetState(brightness=1), apply),
+                debouncer.submit("00:00:00:00:00:01", PranaTargetState(brightness=2), apply),
+                return_exceptions=True,
+            )
+
+        results = asyncio.run(asyncio.wait_for(scenario(), timeout=1))
+        assert len(results) == 2
+        assert all(isinstance(x, asyncio.CancelledError) for x in results)
@@ -0,0 +1,100 @@
+#    Prana RC
+#    Copyright (C) 2020 Dmitry Berezovsky
+#
+#    prana is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    prana is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import pytest
+
+from conftest import SAMPLE_STATE_FRAMES
+from prana_rc.decoder import (
+    decode_state,
+    decode_device_details_payload,
+    state_decoder_for,
+    state_layout_evidence,
+)
+from prana_rc.entity import StateLayout
+
+
+class TestDecodeState:
+
+    def test_sensors_frame(self):
+        state = decode_state(SAMPLE_STATE_FRAMES["sensors"])
+        assert state.is_on and state.flows_locked and not state.night_mode
+        assert state.speed == 4
+        assert state.brightness == 3
+        assert state.sensors.humidity == 45
+        assert state.sensors.co2 == 620
+        assert state.sensors.voc == 123
+        assert state.sensors.pressure == 755
+        assert state.sensors.temperature_in == 21.5
+        assert state.sensors.temperature_out == 9.0
+
+    def test_legacy_sensors_frame(self):
+        state = decode_state(SAMPLE_STATE_FRAMES["legacy_sensors"])
+        assert state.night_mode and state.mini_heating_enabled and state.winter_mode_enabled
+        assert state.speed == 1
+        assert state.brightness == 6
+        assert state.sensors.co2 == 0
+        assert state.sensors.temperature_in == 22.1
+        assert state.sensors.temperature_out == 3.7
+
+    def test_frame_without_sensors(self):
+        state = decode_state(SAMPLE_STATE_FRAMES["no_sensors"])
+        assert not state.is_on
+        assert state.speed == 0
+        assert (state.speed_in, state.speed_out) == (2, 5)
+        assert state.sensors is None
+
+    def test_not_a_state_frame(self):
+        assert decode_state(b"\x00\x01\x02") is None
+
+    def test_truncated_frame(self):
+        with pytest.raises(ValueError):
+            decode_state(SAMPLE_STATE_FRAMES["sensors"][:40])
+
+
+class TestStateDecoderFor:
+
+    def test_extended_layout_ignores_co2_heuristic(self):
+        # Sensor reports no CO2 yet, per-frame detection would fall back to legacy temperatures
+        frame = bytearray(SAMPLE_STATE_FRAMES["sensors"])
+        frame[61:63] = b"\x00\x00"
+        assert decode_state(frame).sensors.temperature_in == 0.0
+        assert state_decoder_for(StateLayout.EXTENDED)(frame).sensors.temperature_in == 21.5
+
+    def test_legacy_layout(self):
+        state = state_decoder_for(StateLayout.LEGACY)(SAMPLE_STATE_FRAMES["legacy_sensors"])
+        assert state.sensors.temperature_in == 22.1
+        assert state.sensors.temperature_out == 3.7
+
+    def test_layout_evidence(self):
+        assert state_layout_evidence(decode_state(SAMPLE_STATE_FRAMES["sensors"]).sensors) == StateLayout.EXTENDED
+        # Missing CO2 reading doesn't tell legacy firmware from extended one
+        assert state_layout_evidence(decode_state(SAMPLE_STATE_FRAMES["legacy_sensors"]).sensors) is None
+        assert state_layout_evidence(decode_state(SAMPLE_STATE_FRAMES["no_sensors"]).sensors) is None
+        # Extended sensor which hasn't measured CO2 yet still reports VOC
+        frame = bytearray(SAMPLE_STATE_FRAMES["sensors"])
+        frame[61:63] = b"\x00\x00"
+        assert state_layout_evidence(decode_state(frame).sensors) is None
+
+
+class TestDecodeDeviceDetails:
+
+    def test_details_frame(self):
+        frame = b"\xbe\xef\x05\x02\x01\x2a\x00\x00"
+        assert decode_device_details_payload(frame) == "012a"
+        assert decode_state(frame) is None
+
+    def test_not_a_details_frame(self):
+        assert decode_device_details_payload(SAMPLE_STATE_FRAMES["sensors"]) is None
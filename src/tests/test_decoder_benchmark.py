@@ -0,0 +1,36 @@
+#    Prana RC
+#    Copyright (C) 2020 Dmitry Berezovsky
+#    
+#    prana is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#    
+#    prana is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#    
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import pytest
+
+from prana_rc.decoder import decode_state
+
+pytest.importorskip("pytest_benchmark")
+
+pytestmark = pytest.mark.usefixtures("no_frame_dumps")
+
+
+class TestDecoderBenchmark:
+
+    def test_decode_state(self, benchmark, state_frame):
+        state = benchmark(decode_state, state_frame)
+        assert state is not None
+
+    def test_decode_state_bytearray(self, benchmark, state_frame):
+        # Bleak delivers notifications as bytearray
+        frame = bytearray(state_frame)
+        state = benchmark(decode_state, frame)
+        assert state is not None
@@ -0,0 +1,59 @@
+#    Prana RC
+#    Copyright (C) 2020 Dmitry Berezovsky
+#    
+#    prana is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#    
+#    prana is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#    
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import gc
+import tracemalloc
+
+import pytest
+
+from conftest import SAMPLE_STATE_FRAMES
+from prana_rc.decoder import decode_state
+
+pytest.importorskip("pytest_benchmark")
+
+pytestmark = pytest.mark.usefixtures("no_frame_dumps")
+
+RETAINED_STATES = 2000
+
+
+class TestStateBenchmark:
+
+    def test_memory_per_retained_state(self, benchmark):
+        frame = SAMPLE_STATE_FRAMES["sensors"]
+
+        def retain():
+            gc.collect()
+            tracemalloc.start()
+            before = tracemalloc.get_traced_memory()[0]
+            states = [decode_state(frame) for _ in range(RETAINED_STATES)]
+            used = tracemalloc.get_traced_memory()[0] - before
+            tracemalloc.stop()
+            assert len(states) == RETAINED_STATES
+            return used / RETAINED_STATES
+
+        bytes_per_state = benchmark.pedantic(retain, rounds=3, iterations=1)
+        benchmark.extra_info["bytes_per_state"] = round(bytes_per_state)
+
+    def test_to_dict(self, benchmark, state_frame):
+        state = decode_state(state_frame)
+        result = benchmark(state.to_dict)
+        assert result["speed"] == state.speed
+
+    def test_to_dto(self, benchmark, state_frame):
+        handler = pytest.importorskip("prana_rc.contrib.api.handler")
+        state = decode_state(state_frame)
+        dto = benchmark(handler.ToDTO.prana_state, state)
+        assert dto.dict()["speed_in"] == state.speed_in
@@ -0,0 +1,212 @@
+#    Prana RC
+#    Copyright (C) 2020 Dmitry Berezovsky
+#
+#    prana is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    prana is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import datetime
+
+import pytest
+
+pytest.importorskip("sizzlews")
+
+from prana_rc.broker import StateBroker  # noqa: E402
+from prana_rc.contrib.api import SetStateDTO  # noqa: E402
+from prana_rc.contrib.api.handler import FromDTO, PranaRCApiHandler  # noqa: E402
+from prana_rc.entity import Mode, PranaState, Speed  # noqa: E402
+
+UNREACHABLE = "00:00:00:00:00:03"
+
+
+class FakeDevice:
+    def __init__(self, address, last_states=None):
+        self.address = address
+        self.state = PranaState(speed_locked=2, is_on=True)
+        self.last_states = {} if last_states is None else last_states
+
+    async def read_state(self, **kwargs):
+        self.state = self.state._replace(timestamp=datetime.datetime.now())
+        self.last_states[self.address] = self.state
+        return self.state
+
+    async def reconcile(self, target):
+        self.state = self.state._replace(speed_locked=target.speed.value, is_on=target.speed != Speed.OFF)
+        return type("ReconcileResult", (), {"state": self.state})
+
+
+class FakeDeviceManager:
+    def __init__(self):
+        self.active = 0
+        self.max_active = 0
+        self.state_broker = StateBroker()
+        self.last_states = {}
+        self.restored_states = set()
+        self.connects = 0
+
+    def get_last_state(self, address):
+        return self.last_states.get(address)
+
+    def is_state_restored(self, address):
+        return address in self.restored_states
+
+    async def connect(self, address, timeout, attempts):
+        self.connects += 1
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        try:
+            await asyncio.sleep(0.02)
+            if address == UNREACHABLE:
+                raise TimeoutError("device is not reachable")
+            return FakeDevice(address, self.last_states)
+        finally:
+            self.active -= 1
+
+
+class TestFleetMethods:
+
+    def test_get_states_reports_errors_per_device(self):
+        manager = FakeDeviceManager()
+        addresses = ["00:00:00:00:00:0{}".format(i) for i in range(1, 7)]
+
+        async def scenario():
+            handler = PranaRCApiHandler(manager, asyncio.get_running_loop(), fleet_concurrency=2)
+            return await handler.get_states(addresses + addresses[:1])
+
+        result = asyncio.run(scenario())
+        assert [x.address for x in result.results] == addresses
+        assert manager.max_active == 2
+        failed = [x for x in result.results if x.error is not None]
+        assert [x.address for x in failed] == [UNREACHABLE]
+        assert failed[0].state is None and "not reachable" in failed[0].error
+        assert all(x.state.speed_locked == 2 for x in result.results if x.error is None)
+
+    def test_set_states_applies_target_to_each_device(self):
+        async def scenario():
+            handler = PranaRCApiHandler(FakeDeviceManager(), asyncio.get_running_loop(), set_state_debounce=0)
+            return await handler.set_states(["00:00:00:00:00:01", UNREACHABLE], SetStateDTO(speed=Speed.SPEED_5))
+
+        result = asyncio.run(scenario())
+        assert result.results[0].state.speed_locked == 5 and result.results[0].error is None
+        assert result.results[1].state is None and result.results[1].error is not None
+
+    def test_set_states_rejects_invalid_request_once(self):
+        async def scenario():
+            handler = PranaRCApiHandler(FakeDeviceManager(), asyncio.get_running_loop())
+            await handler.set_states(["00:00:00:00:00:01"], SetStateDTO())
+
+        with pytest.raises(ValueError):
+            asyncio.run(scenario())
+
+
+class TestFromDTO:
+
+    @pytest.mark.parametrize("brightness", [-1, 7])
+    def test_brightness_out_of_range_is_rejected(self, brightness):
+        with pytest.raises(ValueError):
+            FromDTO.target_state(SetStateDTO(brightness=brightness))
+
+    def test_night_mode_is_targeted(self):
+        target = FromDTO.target_state(SetStateDTO(mode=Mode.NIGHT))
+        assert target.speed == Speed.LOW and target.night_mode
+        assert FromDTO.target_state(SetStateDTO(mode=Mode.NORMAL)).night_mode is None
+
+    def test_brightness_pct_is_converted(self):
+        assert FromDTO.target_state(SetStateDTO(brightness_pct=50)).brightness == 3
+
+
+class TestStateSubscription:
+
+    def test_poll_returns_published_changes(self):
+        manager = FakeDeviceManager()
+
+        async def scenario():
+            handler = PranaRCApiHandler(manager, asyncio.get_running_loop())
+            subscription = await handler.subscribe(min_interval=0)
+            device = FakeDevice("00:00:00:00:00:01")
+            manager.state_broker.publish(device.address, device.state)
+            manager.state_broker.publish(device.address, device.state._replace(speed_locked=4))
+            updates = await handler.poll_updates(subscription.subscription_id, timeout=0.1)
+            await handler.unsubscribe(subscription.subscription_id)
+            return updates
+
+        updates = asyncio.run(scenario()).updates
+        assert len(updates) == 1
+        assert updates[0].address == "00:00:00:00:00:01"
+        assert updates[0].changes["speed_locked"] == 4
+
+
+class TestCachedState:
+    ADDRESS = "00:00:00:00:00:01"
+
+    def received_ago(self, manager, seconds):
+        timestamp = datetime.datetime.now() - datetime.timedelta(seconds=seconds)
+        manager.last_states[self.ADDRESS] = PranaState(speed_locked=1, is_on=True, timestamp=timestamp)
+
+    def test_fresh_state_is_served_from_cache(self):
+        manager = FakeDeviceManager()
+        self.received_ago(manager, 3)
+
+        async def scenario():
+            handler = PranaRCApiHandler(manager, asyncio.get_running_loop())
+            return await handler.get_state(self.ADDRESS, max_age=10)
+
+        state = asyncio.run(scenario())
+        assert manager.connects == 0
+        assert state.speed_locked == 1
+        assert 3 <= state.age < 4
+
+    def test_stale_state_is_served_while_revalidating(self):
+        manager = FakeDeviceManager()
+        self.received_ago(manager, 12)
+
+        async def scenario():
+            handler = PranaRCApiHandler(manager, asyncio.get_running_loop())
+            stale = await asyncio.gather(*(handler.get_state(self.ADDRESS, max_age=10, stale_while_revalidate=5),) * 3)
+            await asyncio.sleep(0.05)
+            return stale, await handler.get_state(self.ADDRESS, max_age=10)
+
+        stale, fresh = asyncio.run(scenario())
+        assert [x.speed_locked for x in stale] == [1, 1, 1]
+        # Single background refresh for concurrent callers
+        assert manager.connects == 1
+        assert fresh.speed_locked == 2 and fresh.age < 1
+
+    def test_expired_state_is_read_from_device(self):
+        manager = FakeDeviceManager()
+        self.received_ago(manager, 20)
+
+        async def scenario():
+            handler = PranaRCApiHandler(manager, asyncio.get_running_loop())
+            return await handler.get_state(self.ADDRESS, max_age=10, stale_while_revalidate=5)
+
+        state = asyncio.run(scenario())
+        assert manager.connects == 1
+        assert state.speed_locked == 2
+
+    def test_restored_state_is_served_flagged_stale(self):
+        manager = FakeDeviceManager()
+        self.received_ago(manager, 3600)
+        manager.restored_states.add(self.ADDRESS)
+
+        async def scenario():
+            handler = PranaRCApiHandler(manager, asyncio.get_running_loop())
+            restored = await handler.get_state(self.ADDRESS, max_age=10)
+            await asyncio.sleep(0.05)
+            manager.restored_states.clear()
+            return restored, await handler.get_state(self.ADDRESS, max_age=10)
+
+        restored, fresh = asyncio.run(scenario())
+        assert restored.stale and restored.speed_locked == 1
+        assert not fresh.stale and fresh.speed_locked == 2
+        assert manager.connects == 1
@@ -0,0 +1,111 @@
+#    Prana RC
+#    Copyright (C) 2020 Dmitry Berezovsky
+#
+#    prana is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    prana is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import time
+
+from prana_rc.radio import RadioScheduler
+
+
+class TestRadioScheduler:
+
+    def test_command_preempts_scan_window(self):
+        async def scenario():
+            radio = RadioScheduler(scan_window=10, settle_time=0)
+
+            async def scan():
+                async with radio.scan_window() as window:
+                    return await radio.wait_preempted(window)
+
+            scan_task = asyncio.ensure_future(scan())
+            await asyncio.sleep(0.01)
+            started_at = time.monotonic()
+            async with radio.command():
+                pass
+            preempted = await scan_task
+            return preempted, time.monotonic() - started_at
+
+        preempted, elapsed = asyncio.run(scenario())
+        assert preempted
+        assert elapsed < 1
+
+    def test_connection_setup_waits_for_scan_to_stop(self):
+        events = []
+
+        async def scenario():
+            radio = RadioScheduler(settle_time=0)
+
+            async def scan():
+                async with radio.scan_window():
+                    await radio.wait_preempted(10)
+                    events.append("scan stopped")
+
+            async def connect():
+                async with radio.connection_setup():
+                    events.append("connecting")
+
+            scan_task = asyncio.ensure_future(scan())
+            await asyncio.sleep(0.01)
+            await connect()
+            await scan_task
+
+        asyncio.run(asyncio.wait_for(scenario(), timeout=1))
+        assert events == ["scan stopped", "connecting"]
+
+    def test_connection_setup_waits_for_overlapping_scans(self):
+        events = []
+
+        async def scenario():
+            radio = RadioScheduler(settle_time=0)
+
+            async def scan(name, stop_delay):
+                async with radio.scan_window():
+                    await radio.wait_preempted(10)
+                    await asyncio.sleep(stop_delay)
+                    events.append("{} stopped".format(name))
+
+            async def connect():
+                async with radio.connection_setup():
+                    events.append("connecting ({})".format("scanning" if radio.is_scanning else "idle"))
+
+            scans = [asyncio.ensure_future(scan("background", 0)), asyncio.ensure_future(scan("discovery", 0.05))]
+            await asyncio.sleep(0.01)
+            await connect()
+            await asyncio.gather(*scans)
+
+        asyncio.run(asyncio.wait_for(scenario(), timeout=1))
+        assert events == ["background stopped", "discovery stopped", "connecting (idle)"]
+
+    def test_background_work_waits_for_foreground(self):
+        events = []
+
+        async def scenario():
+            radio = RadioScheduler(settle_time=0.05)
+
+            async def poll():
+                async with radio.background():
+                    # Commands sent by the background work do not block other background jobs
+                    async with radio.command():
+                        events.append("poll")
+
+            async with radio.command():
+                poll_task = asyncio.ensure_future(poll())
+                await asyncio.sleep(0.1)
+                events.append("command")
+            await poll_task
+
+        asyncio.run(asyncio.wait_for(scenario(), timeout=1))
+        assert events == ["command", "poll"]
@@ -0,0 +1,91 @@
+#    Prana RC
+#    Copyright (C) 2020 Dmitry Berezovsky
+#
+#    prana is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    prana is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import time
+
+import pytest
+
+from prana_rc.command_queue import CommandQueue
+from prana_rc.rate_limit import RateLimiter, RateLimitExceededError, RateLimitPolicy
+
+
+class TestRateLimiter:
+
+    def test_burst_is_sent_immediately_then_throttled(self):
+        sent_at = []
+
+        async def writer(command, expect_reply):
+            sent_at.append(time.monotonic())
+
+        async def scenario():
+            limiter = RateLimiter(rate=20, burst=3)
+            queue = CommandQueue(writer, rate_limiter=limiter)
+            started_at = time.monotonic()
+            await asyncio.gather(*queue.submit_many([bytearray([x]) for x in range(5)]))
+            await queue.close()
+            return started_at, limiter.stats.to_dict()
+
+        started_at, stats = asyncio.run(scenario())
+        assert sent_at[2] - started_at < 0.04
+        # Two writes over the burst wait for the bucket to refill at 20 writes/s
+        assert sent_at[4] - started_at >= 0.09
+        assert stats["throttled"] == 2
+        assert stats["rejected"] == 0
+
+    def test_writes_over_budget_are_rejected(self):
+        async def writer(command, expect_reply):
+            pass
+
+        async def scenario():
+            limiter = RateLimiter(rate=1, burst=2, policy=RateLimitPolicy.REJECT)
+            queue = CommandQueue(writer, rate_limiter=limiter)
+            futures = [queue.submit(bytearray([x])) for x in range(3)]
+            results = await asyncio.gather(*futures, return_exceptions=True)
+            await queue.close()
+            return results, limiter.stats.to_dict()
+
+        results, stats = asyncio.run(scenario())
+        assert results[:2] == [None, None]
+        assert isinstance(results[2], RateLimitExceededError)
+        assert stats["rejected"] == 1
+
+    def test_sequence_over_budget_is_rejected_before_sending(self):
+        sent = []
+
+        async def writer(command, expect_reply):
+            sent.append(command)
+
+        async def scenario():
+            limiter = RateLimiter(rate=1, burst=2, policy=RateLimitPolicy.REJECT)
+            queue = CommandQueue(writer, rate_limiter=limiter)
+            rejected = await asyncio.gather(
+                *queue.submit_many([bytearray([x]) for x in range(3)]), return_exceptions=True
+            )
+            accepted = await asyncio.gather(*queue.submit_many([bytearray([x]) for x in range(2)]))
+            await queue.close()
+            return rejected, accepted, limiter.stats.to_dict()
+
+        rejected, accepted, stats = asyncio.run(scenario())
+        assert all(isinstance(x, RateLimitExceededError) for x in rejected)
+        assert accepted == [None, None]
+        # Nothing of the rejected sequence is sent, budget is left for the next one
+        assert sent == [bytearray([0]), bytearray([1])]
+        assert stats["rejected"] == 3
+
+    def test_invalid_config(self):
+        with pytest.raises(ValueError):
+            RateLimiter(rate=0, burst=1)
@@ -0,0 +1,44 @@
+#    Prana RC
+#    Copyright (C) 2020 Dmitry Berezovsky
+#    
+#    prana is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#    
+#    prana is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#    
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import asyncio
+
+from prana_rc.reply_matcher import ReplyMatcher
+
+
+class TestReplyMatcher:
+
+    def test_frame_resolves_matching_waiter_only(self):
+        async def scenario():
+            matcher = ReplyMatcher()
+            state_reply = matcher.expect(b"\xbe\xef\x05\x01")
+            details_reply = matcher.expect(b"\xbe\xef\x05\x02")
+            assert matcher.dispatch(bytearray(b"\xbe\xef\x05\x02\xff"))
+            assert details_reply.result() == bytearray(b"\xbe\xef\x05\x02\xff")
+            assert not state_reply.done()
+            matcher.cancel_all()
+            return state_reply.cancelled()
+
+        assert asyncio.run(scenario())
+
+    def test_unsolicited_frame_is_not_consumed(self):
+        async def scenario():
+            matcher = ReplyMatcher()
+            matcher.expect(b"\xbe\xef")
+            return matcher.dispatch(bytearray(b"\x00\x01"))
+
+        assert asyncio.run(scenario()) is False
@@ -0,0 +1,55 @@
+#    Prana RC
+#    Copyright (C) 2020 Dmitry Berezovsky
+#    
+#    prana is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#    
+#    prana is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#    
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import pytest
+
+from prana_rc.retry import CircuitBreaker, CircuitOpenError, CircuitState, ExponentialBackoffRetryPolicy
+
+
+class TestExponentialBackoffRetryPolicy:
+
+    def test_delay_grows_up_to_limit(self):
+        policy = ExponentialBackoffRetryPolicy(base_delay=1, factor=2, max_delay=5, jitter=0)
+        assert [policy.delay(x) for x in range(1, 6)] == [1, 2, 4, 5, 5]
+
+    def test_jitter_shortens_delay(self):
+        policy = ExponentialBackoffRetryPolicy(base_delay=1, factor=2, max_delay=5, jitter=0.5)
+        assert all(2 <= policy.delay(3) <= 4 for _ in range(100))
+
+
+class TestCircuitBreaker:
+
+    def test_opens_after_consecutive_failures(self):
+        breaker = CircuitBreaker("00:00:00:00:00:01", failure_threshold=2, cooldown=60)
+        breaker.record_failure()
+        breaker.check()
+        breaker.record_failure()
+        assert breaker.state == CircuitState.OPEN
+        with pytest.raises(CircuitOpenError):
+            breaker.check()
+
+    def test_success_resets_failures(self):
+        breaker = CircuitBreaker("00:00:00:00:00:01", failure_threshold=2, cooldown=60)
+        breaker.record_failure()
+        breaker.record_success()
+        breaker.record_failure()
+        assert breaker.state == CircuitState.CLOSED
+
+    def test_half_open_after_cooldown(self):
+        breaker = CircuitBreaker("00:00:00:00:00:01", failure_threshold=1, cooldown=0)
+        breaker.record_failure()
+        assert breaker.state == CircuitState.HALF_OPEN
+        breaker.check()
@@ -0,0 +1,95 @@
+#    Prana RC
+#    Copyright (C) 2020 Dmitry Berezovsky
+#
+#    prana is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    prana is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+
+import pytest
+
+from prana_rc.rtt import RttEstimator
+from prana_rc.service import PranaDevice
+
+
+class TestRttEstimator:
+
+    def test_timeout_follows_samples(self):
+        rtt = RttEstimator(initial_timeout=1, min_timeout=0.01)
+        rtt.add_sample(0.1)
+        assert rtt.timeout == pytest.approx(0.1 + 4 * 0.05)
+        for _ in range(50):
+            rtt.add_sample(0.1)
+        # Stable link converges to the lower bound quickly
+        assert rtt.timeout < 0.15
+
+    def test_timeout_is_backed_off_and_clamped(self):
+        rtt = RttEstimator(initial_timeout=1, max_timeout=3)
+        rtt.on_timeout()
+        assert rtt.timeout == 2
+        rtt.on_timeout()
+        assert rtt.timeout == 3
+        assert rtt.status().timeouts == 2
+
+
+class TestAdaptiveReplyTimeout:
+
+    def test_lost_reply_is_retried(self, fake_bleak_client):
+        async def scenario():
+            rtt = RttEstimator(initial_timeout=0.05, min_timeout=0.05)
+            device = PranaDevice("00:00:00:00:00:01", rtt_estimator=rtt)
+            await device.connect()
+            samples_after_connect = rtt.status().samples
+            fake_bleak_client.instances[0].lost_replies = 1
+            state = await device.read_state(force_read=True)
+            await device.disconnect()
+            return state, samples_after_connect, rtt.status()
+
+        state, samples_after_connect, status = asyncio.run(scenario())
+        assert state is not None
+        assert status.timeouts == 1
+        # Reply to the repeated command is not used as a sample
+        assert status.samples == samples_after_connect
+
+    def test_read_fails_once_attempts_are_exhausted(self, fake_bleak_client):
+        async def scenario():
+            device = PranaDevice("00:00:00:00:00:01", rtt_estimator=RttEstimator(initial_timeout=0.02, min_timeout=0))
+            await device.connect()
+            fake_bleak_client.instances[0].lost_replies = PranaDevice.REPLY_ATTEMPTS
+            try:
+                with pytest.raises(asyncio.TimeoutError):
+                    await device.read_state(force_read=True)
+            finally:
+                await device.disconnect()
+
+        asyncio.run(scenario())
+
+    def test_details_read_is_sent_once_with_fixed_timeout(self, fake_bleak_client, monkeypatch):
+        monkeypatch.setitem(PranaDevice.FIXED_REPLY_TIMEOUTS, bytes(PranaDevice.Cmd.READ_DEVICE_DETAILS), 0.05)
+
+        async def scenario():
+            rtt = RttEstimator()
+            device = PranaDevice("00:00:00:00:00:01", rtt_estimator=rtt)
+            client = fake_bleak_client.instances[0]
+            client.lost_replies = 1
+            await device.connect()
+            client.drop()
+            # Device which didn't reply is not asked again on reconnect
+            await device.connect()
+            await device.disconnect()
+            return client.written, rtt.status()
+
+        written, status = asyncio.run(scenario())
+        assert written == [bytes(PranaDevice.Cmd.READ_DEVICE_DETAILS)]
+        assert status.timeouts == 0
+        assert status.timeout == RttEstimator().timeout
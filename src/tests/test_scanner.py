@@ -0,0 +1,150 @@
+#    Prana RC
+#    Copyright (C) 2020 Dmitry Berezovsky
+#
+#    prana is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    prana is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import functools
+from collections import namedtuple
+
+import pytest
+
+from prana_rc.radio import RadioScheduler
+from prana_rc.scanner import AdvertisementCache, BackgroundScanner
+from prana_rc.service import PranaDeviceManager
+
+FakeBLEDevice = namedtuple("FakeBLEDevice", ("address", "name", "rssi"))
+FakeAdvertisementData = namedtuple("FakeAdvertisementData", ("local_name", "rssi"))
+
+
+class FakeBleakScanner(object):
+    advertisements = []  # type: list
+    # If set, advertisements seen during each of the following scan windows
+    windows = []  # type: list
+    running = 0
+
+    def __init__(self, detection_callback=None, **kwargs):
+        self.callback = detection_callback
+
+    async def start(self):
+        FakeBleakScanner.running += 1
+        if FakeBleakScanner.windows:
+            FakeBleakScanner.advertisements = FakeBleakScanner.windows.pop(0)
+        for device in FakeBleakScanner.advertisements if self.callback is not None else []:
+            self.callback(device, FakeAdvertisementData(device.name, device.rssi))
+
+    async def stop(self):
+        FakeBleakScanner.running -= 1
+
+    @property
+    def discovered_devices_and_advertisement_data(self):
+        return {x.address: (x, FakeAdvertisementData(x.name, x.rssi)) for x in FakeBleakScanner.advertisements}
+
+
+@pytest.fixture
+def fake_bleak_scanner(monkeypatch):
+    import prana_rc.scanner
+
+    FakeBleakScanner.advertisements = []
+    FakeBleakScanner.windows = []
+    FakeBleakScanner.running = 0
+    monkeypatch.setattr(prana_rc.scanner.bleak, "BleakScanner", FakeBleakScanner)
+    return FakeBleakScanner
+
+
+class TestAdvertisementCache:
+
+    def test_rssi_is_smoothed(self):
+        cache = AdvertisementCache(ttl=10, rssi_smoothing=0.5)
+        cache.update("hci0", "00:00:00:00:00:01", "PRANA Kitchen", -80, now=0)
+        cache.update("hci0", "00:00:00:00:00:01", None, -60, now=1)
+        (adv,) = cache.devices(now=1)
+        assert adv.rssi == -70
+        assert adv.bt_device_name == "PRANA Kitchen"
+        assert adv.last_seen == 1
+
+    def test_expired_devices_are_evicted(self):
+        cache = AdvertisementCache(ttl=10)
+        cache.update("hci0", "00:00:00:00:00:01", "PRANA 1", -80, now=0)
+        cache.update("hci1", "00:00:00:00:00:02", "PRANA 2", -80, now=5)
+        assert [x.address for x in cache.devices(now=12)] == ["00:00:00:00:00:02"]
+        assert len(cache) == 1
+
+
+class TestPassiveDiscovery:
+
+    def test_discover_is_served_from_cache(self, fake_bleak_scanner):
+        fake_bleak_scanner.advertisements = [
+            FakeBLEDevice("00:00:00:00:00:01", "PRANA Bedroom", -70),
+            FakeBLEDevice("00:00:00:00:00:02", "Headphones", -40),
+        ]
+
+        async def scenario():
+            manager = PranaDeviceManager(passive_scan=True, idle_timeout=None, keepalive_interval=None)
+            await manager.start_background_scan()
+            await asyncio.sleep(0.05)
+            devices = await manager.discover(timeout=60)
+            await manager.stop_background_scan()
+            return devices
+
+        (device,) = asyncio.run(asyncio.wait_for(scenario(), timeout=1))
+        assert device.address == "00:00:00:00:00:01"
+        assert device.name == "Bedroom"
+        assert device.rssi == -70
+
+    def test_fresh_discover_scans_and_fills_cache(self, fake_bleak_scanner):
+        fake_bleak_scanner.advertisements = [FakeBLEDevice("00:00:00:00:00:01", "PRANA Bedroom", -70)]
+
+        async def scenario():
+            manager = PranaDeviceManager(passive_scan=True, idle_timeout=None, keepalive_interval=None)
+            scanned = await manager.discover(timeout=0.05, fresh=True)
+            # Scanner is not running, the cache is already filled by the active scan
+            fake_bleak_scanner.advertisements = []
+            cached = await manager.discover(timeout=0)
+            return scanned, cached
+
+        scanned, cached = asyncio.run(asyncio.wait_for(scenario(), timeout=1))
+        assert [x.address for x in scanned] == ["00:00:00:00:00:01"]
+        assert cached == scanned
+
+    def test_name_is_kept_across_scan_windows(self, fake_bleak_scanner, monkeypatch):
+        import prana_rc.service
+
+        monkeypatch.setattr(prana_rc.service, "RadioScheduler", functools.partial(RadioScheduler, scan_window=0.02))
+        fake_bleak_scanner.windows = [
+            [FakeBLEDevice("00:00:00:00:00:01", "PRANA Bedroom", -70)],
+            [FakeBLEDevice("00:00:00:00:00:01", None, -60)],
+        ]
+
+        async def scenario():
+            manager = PranaDeviceManager(idle_timeout=None, keepalive_interval=None)
+            return await manager.discover(timeout=0.1, fresh=True)
+
+        (device,) = asyncio.run(asyncio.wait_for(scenario(), timeout=1))
+        assert device.name == "Bedroom"
+        assert device.rssi == -60
+
+    def test_scanning_is_paused_during_connection_setup(self, fake_bleak_scanner):
+        async def scenario():
+            radio = RadioScheduler()
+            scanner = BackgroundScanner({"hci0": radio}, AdvertisementCache())
+            await scanner.start()
+            await asyncio.sleep(0.05)
+            scanning_before = fake_bleak_scanner.running
+            async with radio.connection_setup():
+                scanning_during = fake_bleak_scanner.running
+            await scanner.stop()
+            return scanning_before, scanning_during, fake_bleak_scanner.running
+
+        assert asyncio.run(asyncio.wait_for(scenario(), timeout=1)) == (1, 0, 0)
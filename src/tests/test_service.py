@@ -14,7 +14,482 @@
 #    You should have received a copy of the GNU General Public License
 #    along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import asyncio
+
+from conftest import SAMPLE_STATE_FRAMES
+from prana_rc.command_queue import CommandPriority
+from prana_rc.decoder import decode_state
+from prana_rc.entity import PranaTargetState, Speed, StateLayout
+from prana_rc.retry import CircuitOpenError, CircuitState
+from prana_rc.rtt import RttEstimator
+from prana_rc.service import DeviceDetailsRegistry, PranaDevice, PranaDeviceManager
+from prana_rc.state_store import StateStore
+
+Cmd = PranaDevice.Cmd
+
+
 class TestPranaDevice:
 
     def test_ok(self):
         assert 1
+
+
+class TestDeviceDetailsRegistry:
+
+    def test_layout_is_learned_once_confirmed(self):
+        registry = DeviceDetailsRegistry(confirmation_frames=3)
+        registry.register("00:00:00:00:00:01", "012a")
+        assert registry.observe_layout("00:00:00:00:00:01", StateLayout.EXTENDED) is None
+        # Disagreeing frame restarts confirmation
+        assert registry.observe_layout("00:00:00:00:00:01", StateLayout.LEGACY) is None
+        assert registry.observe_layout("00:00:00:00:00:01", StateLayout.LEGACY) is None
+        assert registry.observe_layout("00:00:00:00:00:01", StateLayout.LEGACY) == StateLayout.LEGACY
+        # Layout is shared by devices with the same firmware
+        assert registry.register("00:00:00:00:00:02", "012a").state_layout == StateLayout.LEGACY
+        assert registry.register("00:00:00:00:00:03", "012b").state_layout == StateLayout.AUTO
+
+    def test_device_without_details_is_not_learned(self):
+        registry = DeviceDetailsRegistry(confirmation_frames=1)
+        assert registry.observe_layout("00:00:00:00:00:01", StateLayout.EXTENDED) is None
+        assert registry.get("00:00:00:00:00:01") is None
+
+    def test_device_pins_layout_after_agreeing_frames(self, fake_bleak_client):
+        async def scenario(frame):
+            registry = DeviceDetailsRegistry()
+            device = PranaDevice("00:00:00:00:00:01", details_registry=registry)
+            await device.connect()
+            fake_bleak_client.instances[-1].state_frame = frame
+            layouts = []
+            for _ in range(3):
+                await device.read_state(force_read=True)
+                layouts.append(device.details.state_layout)
+            await device.disconnect()
+            return device.details.firmware, layouts
+
+        firmware, layouts = asyncio.run(scenario(SAMPLE_STATE_FRAMES["sensors"]))
+        assert firmware == "012a"
+        assert layouts == [StateLayout.AUTO, StateLayout.AUTO, StateLayout.EXTENDED]
+        # Frames without CO2 reading are decoded with auto detection and never pin a layout
+        _, layouts = asyncio.run(scenario(SAMPLE_STATE_FRAMES["legacy_sensors"]))
+        assert layouts == [StateLayout.AUTO] * 3
+
+
+class TestSpeedPlanner:
+
+    def test_single_step(self):
+        assert PranaDevice._plan_speed_change(4, Speed.SPEED_5) == [Cmd.SPEED_UP]
+        assert PranaDevice._plan_speed_change(7, Speed.SPEED_6) == [Cmd.SPEED_DOWN]
+
+    def test_same_speed_is_noop(self):
+        assert PranaDevice._plan_speed_change(3, Speed.SPEED_3) == []
+        assert PranaDevice._plan_speed_change(0, Speed.OFF) == []
+
+    def test_reset_is_cheaper_than_walk(self):
+        assert PranaDevice._plan_speed_change(9, Speed.SPEED_2) == [Cmd.ENABLE_NIGHT_MODE, Cmd.SPEED_UP]
+        assert PranaDevice._plan_speed_change(2, Speed.SPEED_9) == [Cmd.ENABLE_HIGH_SPEED, Cmd.SPEED_DOWN]
+
+    def test_unknown_or_off_device_is_reset(self):
+        assert PranaDevice._plan_speed_change(None, Speed.SPEED_4) == [Cmd.ENABLE_NIGHT_MODE] + [Cmd.SPEED_UP] * 3
+        assert PranaDevice._plan_speed_change(0, Speed.SPEED_7) == [Cmd.ENABLE_HIGH_SPEED] + [Cmd.SPEED_DOWN] * 3
+
+    def test_single_command_targets(self):
+        assert PranaDevice._plan_speed_change(None, Speed.OFF) == [Cmd.STOP]
+        assert PranaDevice._plan_speed_change(5, Speed.LOW) == [Cmd.ENABLE_NIGHT_MODE]
+        assert PranaDevice._plan_speed_change(5, Speed.HIGH) == [Cmd.ENABLE_HIGH_SPEED]
+
+
+class TestConnectionPool:
+
+    def test_least_recently_used_device_is_evicted(self, fake_bleak_client):
+        async def scenario():
+            manager = PranaDeviceManager(max_connections=2, idle_timeout=None)
+            first = await manager.connect("00:00:00:00:00:01")
+            await manager.connect("00:00:00:00:00:02")
+            assert await manager.connect("00:00:00:00:00:01") is first
+            await manager.connect("00:00:00:00:00:03")
+            addresses = manager.get_connected_devices_addresses()
+            stats = manager.pool_stats.to_dict()
+            await manager.disconnect_all()
+            return addresses, stats
+
+        addresses, stats = asyncio.run(scenario())
+        assert addresses == ["00:00:00:00:00:01", "00:00:00:00:00:03"]
+        assert stats == dict(hits=1, misses=3, evictions=1, expirations=0, drops=0, reconnects=0)
+
+    def test_released_devices_are_forgotten(self, fake_bleak_client):
+        fake_bleak_client.unreachable_devices.add("00:00:00:00:00:03")
+
+        async def scenario():
+            manager = PranaDeviceManager(max_connections=1, idle_timeout=None, breaker_failure_threshold=1)
+            await manager.connect("00:00:00:00:00:01")
+            await manager.connect("00:00:00:00:00:02")
+            for _ in range(2):
+                try:
+                    await manager.connect("00:00:00:00:00:03")
+                except Exception as e:
+                    error = e
+            breakers = manager.get_circuit_breakers_status()
+            await manager.disconnect_all()
+            return error, breakers
+
+        error, breakers = asyncio.run(scenario())
+        assert isinstance(error, CircuitOpenError)
+        # Healthy breakers of evicted devices are dropped, open one is kept to reject further connects
+        assert [(x.address, x.state) for x in breakers] == [("00:00:00:00:00:03", CircuitState.OPEN)]
+
+    def test_slow_device_does_not_block_others(self, fake_bleak_client):
+        fake_bleak_client.connect_delays["00:00:00:00:00:01"] = 0.5
+
+        async def scenario():
+            manager = PranaDeviceManager(idle_timeout=None)
+            connected = []
+
+            async def connect(address):
+                await manager.connect(address)
+                connected.append(address)
+
+            await asyncio.gather(connect("00:00:00:00:00:01"), connect("00:00:00:00:00:02"))
+            await manager.disconnect_all()
+            return connected
+
+        assert asyncio.run(scenario()) == ["00:00:00:00:00:02", "00:00:00:00:00:01"]
+
+
+class TestConnectionSupervisor:
+
+    def test_dropped_connection_is_restored(self, fake_bleak_client):
+        async def scenario():
+            manager = PranaDeviceManager(idle_timeout=None)
+            device = await manager.connect("00:00:00:00:00:01")
+            client = fake_bleak_client.instances[0]
+            client.written.clear()
+            client.drop()
+            await asyncio.sleep(0.1)
+            connected = await device.is_connected()
+            stats = manager.pool_stats.to_dict()
+            await manager.disconnect_all()
+            return connected, client.written, stats
+
+        connected, written, stats = asyncio.run(scenario())
+        assert connected
+        # State is re-read after reconnect, details are already known
+        assert written == [bytes(Cmd.READ_STATE)]
+        assert stats["drops"] == 1
+        assert stats["reconnects"] == 1
+
+    def test_device_evicted_during_reconnect_is_not_restored(self, fake_bleak_client):
+        async def scenario():
+            manager = PranaDeviceManager(max_connections=2, max_concurrent_connects=1, idle_timeout=None)
+            dropped = await manager.connect("00:00:00:00:00:01")
+            # Holds the only connect slot while dropped connection waits for it
+            fake_bleak_client.connect_delays["00:00:00:00:00:03"] = 0.1
+            slow_connect = asyncio.ensure_future(manager.connect("00:00:00:00:00:03"))
+            await asyncio.sleep(0.01)
+            fake_bleak_client.instances[0].drop()
+            await asyncio.sleep(0.01)
+            await manager.connect("00:00:00:00:00:02")
+            await slow_connect
+            await asyncio.sleep(0.1)
+            connected = await dropped.is_connected()
+            addresses = manager.get_connected_devices_addresses()
+            stats = manager.pool_stats.to_dict()
+            await manager.disconnect_all()
+            return connected, addresses, stats
+
+        connected, addresses, stats = asyncio.run(scenario())
+        assert not connected
+        assert addresses == ["00:00:00:00:00:03", "00:00:00:00:00:02"]
+        assert stats["reconnects"] == 0
+
+    def test_requested_disconnect_is_not_restored(self, fake_bleak_client):
+        async def scenario():
+            manager = PranaDeviceManager(max_connections=1, idle_timeout=None)
+            first = await manager.connect("00:00:00:00:00:01")
+            await manager.connect("00:00:00:00:00:02")
+            await asyncio.sleep(0.1)
+            connected = await first.is_connected()
+            stats = manager.pool_stats.to_dict()
+            await manager.disconnect_all()
+            return connected, stats
+
+        connected, stats = asyncio.run(scenario())
+        assert not connected
+        assert stats["drops"] == 0
+
+    def test_keepalive_reads_state(self, fake_bleak_client):
+        async def scenario():
+            manager = PranaDeviceManager(idle_timeout=None, keepalive_interval=0.05)
+            await manager.connect("00:00:00:00:00:01")
+            client = fake_bleak_client.instances[0]
+            client.written.clear()
+            await asyncio.sleep(0.4)
+            await manager.disconnect_all()
+            return client.written
+
+        written = asyncio.run(scenario())
+        assert len(written) >= 2
+        assert set(written) == {bytes(Cmd.READ_STATE)}
+
+    def test_zero_intervals_disable_background_tasks(self, fake_bleak_client):
+        async def scenario():
+            manager = PranaDeviceManager(idle_timeout=0, keepalive_interval=0)
+            await manager.connect("00:00:00:00:00:01")
+            client = fake_bleak_client.instances[0]
+            client.written.clear()
+            await asyncio.sleep(0.1)
+            addresses = manager.get_connected_devices_addresses()
+            await manager.disconnect_all()
+            return addresses, client.written
+
+        addresses, written = asyncio.run(asyncio.wait_for(scenario(), timeout=1))
+        assert addresses == ["00:00:00:00:00:01"]
+        assert written == []
+
+    def test_broker_receives_reads_and_notifications(self, fake_bleak_client):
+        async def scenario():
+            manager = PranaDeviceManager(idle_timeout=None, keepalive_interval=None)
+            mailbox = manager.state_broker.subscribe()
+            device = await manager.connect("00:00:00:00:00:01")
+            await device.read_state(force_read=True)
+            received = mailbox.drain()
+            client = fake_bleak_client.instances[0]
+            client.notification_handler(None, bytearray(SAMPLE_STATE_FRAMES["legacy_sensors"]))
+            received += mailbox.drain()
+            await manager.disconnect_all()
+            # The last state is kept after disconnect
+            assert manager.get_last_state("00:00:00:00:00:01") is received[-1][1]
+            return received
+
+        received = asyncio.run(scenario())
+        assert [x[0] for x in received] == ["00:00:00:00:00:01"] * 2
+        assert received[0][1] == decode_state(SAMPLE_STATE_FRAMES["sensors"])._replace(
+            timestamp=received[0][1].timestamp
+        )
+        assert received[1][1].night_mode
+
+    def test_persisted_state_is_restored_until_device_is_warmed_up(self, fake_bleak_client, tmp_path):
+        path = str(tmp_path / "states.db")
+        persisted = decode_state(SAMPLE_STATE_FRAMES["legacy_sensors"])
+
+        async def scenario():
+            store = StateStore(path)
+            store.put("00:00:00:00:00:01", persisted)
+            store.close()
+            manager = PranaDeviceManager(idle_timeout=None, keepalive_interval=None, state_store=StateStore(path))
+            restored = manager.get_last_state("00:00:00:00:00:01"), manager.is_state_restored("00:00:00:00:00:01")
+            await manager.warm_up()
+            refreshed = manager.get_last_state("00:00:00:00:00:01"), manager.is_state_restored("00:00:00:00:00:01")
+            await manager.disconnect_all()
+            return restored, refreshed
+
+        restored, refreshed = asyncio.run(scenario())
+        assert restored == (persisted, True)
+        assert refreshed[0].speed_locked == decode_state(SAMPLE_STATE_FRAMES["sensors"]).speed_locked
+        assert not refreshed[1]
+
+
+class TestReplyMatching:
+
+    def test_state_read_ignores_other_frames(self, fake_bleak_client):
+        async def scenario():
+            manager = PranaDeviceManager(idle_timeout=None, keepalive_interval=None)
+            device = await manager.connect("00:00:00:00:00:01")
+            client = fake_bleak_client.instances[0]
+            write = client.write_gatt_char
+
+            async def write_after_unrelated_frame(uuid, data, response=False):
+                client.notification_handler(uuid, bytearray(b"\xbe\xef\x05\x03\x00"))
+                await write(uuid, data, response)
+
+            client.write_gatt_char = write_after_unrelated_frame
+            state = await device.read_state(force_read=True)
+            await manager.disconnect_all()
+            return state
+
+        state = asyncio.run(scenario())
+        assert state.speed == decode_state(SAMPLE_STATE_FRAMES["sensors"]).speed
+
+
+class TestStateCache:
+
+    def test_fresh_state_is_served_from_cache(self, fake_bleak_client):
+        async def scenario():
+            manager = PranaDeviceManager(idle_timeout=None, keepalive_interval=None, state_max_age=60)
+            device = await manager.connect("00:00:00:00:00:01")
+            client = fake_bleak_client.instances[0]
+            client.written.clear()
+            stats_before = manager.state_cache_stats.to_dict()
+            first = await device.read_state()
+            second = await device.read_state()
+            stats = manager.state_cache_stats.to_dict()
+            await manager.disconnect_all()
+            return first, second, client.written, stats_before, stats
+
+        first, second, written, stats_before, stats = asyncio.run(scenario())
+        assert first is second
+        assert written == [bytes(Cmd.READ_STATE)]
+        assert stats["misses"] - stats_before["misses"] == 1
+        assert stats["hits"] - stats_before["hits"] == 1
+
+    def test_expired_state_is_read_from_device(self, fake_bleak_client):
+        async def scenario():
+            manager = PranaDeviceManager(idle_timeout=None, keepalive_interval=None, state_max_age=0.05)
+            device = await manager.connect("00:00:00:00:00:01")
+            client = fake_bleak_client.instances[0]
+            client.written.clear()
+            stats_before = manager.state_cache_stats.to_dict()
+            await asyncio.sleep(0.1)
+            await device.read_state()
+            stats = manager.state_cache_stats.to_dict()
+            await manager.disconnect_all()
+            return client.written, stats_before, stats
+
+        written, stats_before, stats = asyncio.run(scenario())
+        assert written == [bytes(Cmd.READ_STATE)]
+        assert stats["misses"] - stats_before["misses"] == 1
+        assert stats["hits"] == stats_before["hits"]
+
+    def test_write_invalidates_cached_state(self, fake_bleak_client):
+        async def scenario():
+            manager = PranaDeviceManager(idle_timeout=None, keepalive_interval=None, state_max_age=60)
+            device = await manager.connect("00:00:00:00:00:01")
+            client = fake_bleak_client.instances[0]
+            await device.read_state()
+            await device.brightness_up()
+            client.written.clear()
+            await device.read_state()
+            await manager.disconnect_all()
+            return client.written
+
+        assert asyncio.run(scenario()) == [bytes(Cmd.READ_STATE)]
+
+    def test_concurrent_reads_share_one_command(self, fake_bleak_client):
+        async def scenario():
+            manager = PranaDeviceManager(idle_timeout=None, keepalive_interval=None)
+            device = await manager.connect("00:00:00:00:00:01")
+            client = fake_bleak_client.instances[0]
+            client.written.clear()
+            stats_before = manager.state_cache_stats.to_dict()
+            states = await asyncio.gather(*[device.read_state(force_read=True) for _ in range(3)])
+            stats = manager.state_cache_stats.to_dict()
+            await manager.disconnect_all()
+            return states, client.written, stats_before, stats
+
+        states, written, stats_before, stats = asyncio.run(scenario())
+        assert written == [bytes(Cmd.READ_STATE)]
+        assert states[0] is states[1] is states[2]
+        assert stats["misses"] - stats_before["misses"] == 1
+        assert stats["coalesced"] - stats_before["coalesced"] == 2
+
+    def test_interactive_read_does_not_join_background_read(self, fake_bleak_client):
+        async def scenario():
+            manager = PranaDeviceManager(idle_timeout=None, keepalive_interval=None)
+            device = await manager.connect("00:00:00:00:00:01")
+            client = fake_bleak_client.instances[0]
+            client.written.clear()
+            stats_before = manager.state_cache_stats.to_dict()
+            await asyncio.gather(
+                device.read_state(force_read=True, priority=CommandPriority.BACKGROUND),
+                device.read_state(force_read=True, priority=CommandPriority.INTERACTIVE),
+            )
+            stats = manager.state_cache_stats.to_dict()
+            await manager.disconnect_all()
+            return client.written, stats_before, stats
+
+        written, stats_before, stats = asyncio.run(scenario())
+        assert written == [bytes(Cmd.READ_STATE)] * 2
+        assert stats["misses"] - stats_before["misses"] == 2
+        assert stats["coalesced"] == stats_before["coalesced"]
+
+
+class TestReconciler:
+    TARGET = PranaTargetState(speed=Speed.LOW, heating=True, winter_mode=True, brightness=6)
+
+    def test_minimal_plan(self):
+        state = decode_state(SAMPLE_STATE_FRAMES["sensors"])
+        assert PranaDevice._plan_reconciliation(state, self.TARGET) == [
+            Cmd.ENABLE_NIGHT_MODE,
+            Cmd.TOGGLE_HEATING,
+            Cmd.TOGGLE_WINTER_MODE,
+        ] + [Cmd.CHANGE_BRIGHTNESS] * 3
+        assert PranaDevice._plan_reconciliation(state, PranaTargetState(speed=Speed.SPEED_4, heating=False)) == []
+
+    def test_night_mode_is_planned_and_verified(self):
+        target = PranaTargetState(speed=Speed.LOW, night_mode=True)
+        night = decode_state(SAMPLE_STATE_FRAMES["legacy_sensors"])
+        low_speed = night._replace(night_mode=False)
+        assert PranaDevice._plan_reconciliation(night, target) == []
+        assert PranaDevice._state_matches(night, target)
+        # Device already runs at the lowest speed, but not in night mode
+        assert PranaDevice._plan_reconciliation(low_speed, target) == [Cmd.ENABLE_NIGHT_MODE]
+        assert not PranaDevice._state_matches(low_speed, target)
+
+    def test_speed_change_cancels_merged_night_mode(self):
+        merged = PranaTargetState(speed=Speed.LOW, night_mode=True).updated_with(PranaTargetState(speed=Speed.SPEED_3))
+        assert merged == PranaTargetState(speed=Speed.SPEED_3)
+
+    def test_result_is_verified_by_notification(self, fake_bleak_client):
+        async def scenario():
+            device = PranaDevice("00:00:00:00:00:01")
+            await device.connect()
+            client = fake_bleak_client.instances[0]
+            client.state_after_control = SAMPLE_STATE_FRAMES["legacy_sensors"]
+            client.written.clear()
+            result = await device.reconcile(self.TARGET)
+            await device.disconnect()
+            return result, client.written
+
+        result, written = asyncio.run(scenario())
+        assert result.converged
+        assert result.verified_by_notification
+        assert result.sent_writes == result.planned_writes == 6
+        # Single read before the changes, no polling afterwards
+        assert written.count(bytes(Cmd.READ_STATE)) == 1
+
+    def test_toggles_are_planned_from_actual_state(self, fake_bleak_client):
+        async def scenario():
+            device = PranaDevice("00:00:00:00:00:01", state_max_age=60)
+            await device.connect()
+            client = fake_bleak_client.instances[0]
+            await device.read_state()
+            # Heating was enabled on the device itself, cached state doesn't know it
+            client.state_frame = SAMPLE_STATE_FRAMES["legacy_sensors"]
+            client.written.clear()
+            result = await device.reconcile(PranaTargetState(heating=True))
+            await device.disconnect()
+            return result, client.written
+
+        result, written = asyncio.run(scenario())
+        assert result.converged
+        assert written == [bytes(Cmd.READ_STATE)]
+
+    def test_absolute_commands_are_planned_from_cache(self, fake_bleak_client):
+        async def scenario():
+            device = PranaDevice("00:00:00:00:00:01", state_max_age=60)
+            await device.connect()
+            client = fake_bleak_client.instances[0]
+            client.state_after_control = SAMPLE_STATE_FRAMES["no_sensors"]
+            await device.read_state()
+            client.written.clear()
+            result = await device.reconcile(PranaTargetState(speed=Speed.OFF))
+            await device.disconnect()
+            return result, client.written
+
+        result, written = asyncio.run(scenario())
+        assert result.converged
+        assert written == [bytes(Cmd.STOP)]
+
+    def test_device_is_polled_without_notification(self, fake_bleak_client):
+        async def scenario():
+            device = PranaDevice("00:00:00:00:00:01", rtt_estimator=RttEstimator(initial_timeout=0.05))
+            await device.connect()
+            client = fake_bleak_client.instances[0]
+            client.written.clear()
+            result = await device.reconcile(PranaTargetState(heating=True))
+            await device.disconnect()
+            return result, client.written
+
+        result, written = asyncio.run(scenario())
+        assert not result.verified_by_notification
+        assert not result.converged
+        assert written == [bytes(Cmd.READ_STATE), bytes(Cmd.TOGGLE_HEATING), bytes(Cmd.READ_STATE)]
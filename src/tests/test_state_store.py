@@ -0,0 +1,68 @@
+#    Prana RC
+#    Copyright (C) 2020 Dmitry Berezovsky
+#
+#    prana is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    prana is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import datetime
+import sqlite3
+
+from prana_rc.entity import PranaSensorsState, PranaState
+from prana_rc.state_store import StateStore
+
+STATE = PranaState(
+    speed_locked=3,
+    is_on=True,
+    brightness=2,
+    sensors=PranaSensorsState(temperature_in=21.5, humidity=40, co2=500),
+    timestamp=datetime.datetime(2020, 11, 1, 12, 30, 15, 250),
+)
+
+
+class TestStateStore:
+
+    def test_states_survive_reopen(self, tmp_path):
+        path = str(tmp_path / "states.db")
+
+        async def scenario():
+            store = StateStore(path, flush_interval=10)
+            store.put("00:00:00:00:00:01", STATE._replace(brightness=1))
+            store.put("00:00:00:00:00:01", STATE)
+            store.put("00:00:00:00:00:02", PranaState(is_on=False))
+            store.close()
+
+        asyncio.run(scenario())
+        assert StateStore(path).load() == {"00:00:00:00:00:01": STATE, "00:00:00:00:00:02": PranaState(is_on=False)}
+
+    def test_states_are_flushed_in_background(self, tmp_path):
+        path = str(tmp_path / "states.db")
+
+        async def scenario():
+            store = StateStore(path, flush_interval=0.05)
+            store.put("00:00:00:00:00:01", STATE)
+            before = StateStore(path).load()
+            await asyncio.sleep(0.1)
+            return before, StateStore(path).load()
+
+        before, after = asyncio.run(scenario())
+        assert before == {}
+        assert after == {"00:00:00:00:00:01": STATE}
+
+    def test_broken_record_is_skipped(self, tmp_path):
+        path = str(tmp_path / "states.db")
+        StateStore(path).close()
+        with sqlite3.connect(path) as db:
+            db.execute("INSERT INTO device_state VALUES ('00:00:00:00:00:01', '{\"unknown\": 1, \"is_on\": true}')")
+            db.execute("INSERT INTO device_state VALUES ('00:00:00:00:00:02', 'not a json')")
+        assert StateStore(path).load() == {"00:00:00:00:00:01": PranaState(is_on=True)}
@@ -0,0 +1,93 @@
+#    Prana RC
+#    Copyright (C) 2020 Dmitry Berezovsky
+#
+#    prana is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    prana is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+
+from prana_rc.broker import StateBroker
+from prana_rc.contrib.api.subscription import StateSubscriptions, state_delta
+from prana_rc.entity import PranaSensorsState, PranaState
+
+SENSORS = PranaSensorsState(temperature_in=21.5, temperature_out=3.0, humidity=40, pressure=990, voc=1, co2=500)
+STATE = PranaState(speed_locked=3, is_on=True, brightness=2, sensors=SENSORS)
+
+
+class TestStateDelta:
+
+    def test_first_update_contains_all_fields(self):
+        delta = state_delta(None, STATE)
+        assert delta["speed_locked"] == 3
+        assert delta["sensors"]["co2"] == 500
+        assert "timestamp" not in delta
+
+    def test_only_changed_fields_are_reported(self):
+        current = STATE._replace(brightness=4, sensors=SENSORS._replace(co2=800))
+        assert state_delta(STATE, current) == {"brightness": 4, "sensors": {"co2": 800}}
+        assert state_delta(STATE, STATE) == {}
+
+
+class TestStateSubscriptions:
+
+    def test_updates_are_merged_and_filtered(self):
+        async def scenario():
+            broker = StateBroker()
+            subscriptions = StateSubscriptions(broker)
+            subscription = subscriptions.subscribe(["00:00:00:00:00:01"], min_interval=0)
+            broker.publish("00:00:00:00:00:01", STATE)
+            broker.publish("00:00:00:00:00:01", STATE._replace(brightness=5))
+            broker.publish("00:00:00:00:00:02", STATE)
+            first = await subscription.poll(timeout=0.1)
+            broker.publish("00:00:00:00:00:01", STATE._replace(brightness=5))
+            unchanged = await subscription.poll(timeout=0.05)
+            broker.publish("00:00:00:00:00:01", STATE._replace(brightness=6))
+            second = await subscription.poll(timeout=0.1)
+            return first, unchanged, second
+
+        first, unchanged, second = asyncio.run(scenario())
+        assert [x.address for x in first] == ["00:00:00:00:00:01"]
+        assert first[0].changes["brightness"] == 5 and first[0].changes["speed_locked"] == 3
+        assert unchanged == []
+        assert second[0].changes == {"brightness": 6}
+
+    def test_delivery_is_rate_limited(self):
+        async def scenario():
+            loop = asyncio.get_running_loop()
+            broker = StateBroker()
+            subscriptions = StateSubscriptions(broker)
+            subscription = subscriptions.subscribe(min_interval=0.2)
+            broker.publish("00:00:00:00:00:01", STATE)
+            await subscription.poll(timeout=1)
+            broker.publish("00:00:00:00:00:01", STATE._replace(brightness=3))
+            started_at = loop.time()
+            updates = await subscription.poll(timeout=1)
+            return updates, loop.time() - started_at
+
+        updates, elapsed = asyncio.run(scenario())
+        assert updates[0].changes == {"brightness": 3}
+        assert elapsed >= 0.15
+
+    def test_abandoned_subscription_expires(self):
+        async def scenario():
+            broker = StateBroker()
+            subscriptions = StateSubscriptions(broker, ttl=0.05)
+            subscription = subscriptions.subscribe()
+            await asyncio.sleep(0.1)
+            try:
+                subscriptions.get(subscription.id)
+            except ValueError:
+                return len(subscriptions), broker.subscribers
+            return None
+
+        assert asyncio.run(scenario()) == (0, 0)